@@ -0,0 +1,231 @@
+"""
+Account deletion and account export.
+
+Deleting an account
+-------------------
+``POST /delete_account/`` marks the user deleted (logins stop finding
+them), revokes every token family and queues a ``delete_account`` job on
+the user's shard. The job removes the user's rows with set-based DELETEs
+of ACCOUNT_DELETE_BATCH_ROWS rows at a time. Each batch is its own short
+transaction, with ACCOUNT_DELETE_PAUSE_SECONDS between batches, so even
+a power user's climbs go without long locks or a burst of WAL. Nothing
+is loaded into the ORM. The job is idempotent: a retry carries on where
+the last attempt stopped. The directory entry (and with it the email) is
+released last.
+
+Exporting an account
+--------------------
+``POST /account_exports/`` queues an ``export_account`` job. It streams
+the user, gyms, projects, climbs and imports as JSON lines into a gzip
+file under EXPORT_DIR, reading climbs in batches from a server-side
+cursor. Poll ``GET /account_exports/{id}`` and fetch the file from
+``/account_exports/{id}/download`` until it expires after
+EXPORT_TTL_HOURS. As with imports, EXPORT_DIR must be shared storage
+when workers run in a separate process.
+"""
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select, text, update
+from sqlalchemy.orm import Session
+
+from . import jobs, models, revocation
+from .cache import cache, user_namespace
+from .database import SessionLocal, record_writes
+from .revocation import revocations
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_DELETE_BATCH_ROWS = int(os.getenv("ACCOUNT_DELETE_BATCH_ROWS", 2000))
+# Breathing room for the primary (and replicas) between delete batches
+ACCOUNT_DELETE_PAUSE_SECONDS = float(os.getenv("ACCOUNT_DELETE_PAUSE_SECONDS", 0.05))
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(tempfile.gettempdir(), "flashed_exports"))
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", 2000))
+EXPORT_TTL_HOURS = int(os.getenv("EXPORT_TTL_HOURS", 72))
+
+# Child tables first. Bands go with their gym (ON DELETE CASCADE).
+# climbs is partitioned, so its rows are picked by (id, created_at).
+DELETE_STEPS = [
+    ("climbs", """
+        DELETE FROM climbs WHERE (id, created_at) IN (
+            SELECT id, created_at FROM climbs WHERE user_id = :user_id LIMIT :batch
+        )"""),
+    ("climb_imports", """
+        DELETE FROM climb_imports WHERE id IN (
+            SELECT id FROM climb_imports WHERE user_id = :user_id LIMIT :batch
+        )"""),
+    ("account_exports", """
+        DELETE FROM account_exports WHERE id IN (
+            SELECT id FROM account_exports WHERE user_id = :user_id LIMIT :batch
+        )"""),
+    ("grade_forecasts", "DELETE FROM grade_forecasts WHERE user_id = :user_id"),
+    ("projects", """
+        DELETE FROM projects WHERE id IN (
+            SELECT id FROM projects WHERE user_id = :user_id LIMIT :batch
+        )"""),
+    ("gyms", """
+        DELETE FROM gyms WHERE id IN (
+            SELECT id FROM gyms WHERE user_id = :user_id LIMIT :batch
+        )"""),
+    # Queued follow-up work (stats refreshes, imports) for the user; the
+    # running delete job itself is left alone
+    ("jobs", """
+        DELETE FROM jobs WHERE id IN (
+            SELECT id FROM jobs
+             WHERE status <> 'running' AND payload->>'user_id' = CAST(:user_id AS text)
+             LIMIT :batch
+        )"""),
+    ("users", "DELETE FROM users WHERE id = :user_id"),
+]
+
+
+def remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# -------------------------------------------------
+# Deletion
+# -------------------------------------------------
+
+def request_deletion(db: Session, directory: Session, user: models.User) -> None:
+    """Locks the account out straight away; the job does the heavy part."""
+    user.deleted_at = datetime.now(timezone.utc)
+    jobs.enqueue(db, "delete_account", {"user_id": user.id}, dedupe_key=f"delete_account:{user.id}")
+    db.commit()
+    for family_id in revocation.revoke_user_families(directory, user.id, "deleted"):
+        revocations.add(family_id)
+    directory.commit()
+
+
+def _delete_in_batches(engine, name: str, sql: str, user_id: int) -> int:
+    statement = text(sql)
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            count = conn.execute(statement, {"user_id": user_id, "batch": ACCOUNT_DELETE_BATCH_ROWS}).rowcount
+        deleted += count
+        if count < ACCOUNT_DELETE_BATCH_ROWS:
+            return deleted
+        logger.info("deleting user %s: %s %s rows so far", user_id, deleted, name)
+        time.sleep(ACCOUNT_DELETE_PAUSE_SECONDS)
+
+
+def delete_account(db: Session, user_id: int) -> dict:
+    # The job runs on the user's shard; the deletes go to the same one
+    engine = db.get_bind()
+    db.close()
+
+    with engine.connect() as conn:
+        paths = conn.execute(
+            select(models.AccountExport.path).where(
+                models.AccountExport.user_id == user_id, models.AccountExport.path.is_not(None),
+            )
+        ).scalars().all()
+    for path in paths:
+        remove_file(path)
+
+    counts = {}
+    for name, sql in DELETE_STEPS:
+        counts[name] = _delete_in_batches(engine, name, sql, user_id)
+
+    # Directory last: until here the user still routes to this shard
+    with SessionLocal() as directory:
+        directory.execute(text("DELETE FROM refresh_token_families WHERE user_id = :user_id"), {"user_id": user_id})
+        directory.execute(text("DELETE FROM user_shards WHERE user_id = :user_id"), {"user_id": user_id})
+        directory.commit()
+    cache.delete("shards", user_id)
+    cache.invalidate(user_namespace(user_id))
+    record_writes([user_namespace(user_id)])
+    return {"user_id": user_id, "deleted": counts}
+
+
+# -------------------------------------------------
+# Export
+# -------------------------------------------------
+
+EXPORT_SECTIONS = [
+    ("gym", models.Gym),
+    ("project", models.Project),
+    ("climb", models.Climb),
+    ("import", models.ClimbImport),
+]
+
+
+def _row(kind: str, mapping) -> bytes:
+    return (json.dumps({"type": kind, **jsonable_encoder(dict(mapping))}) + "\n").encode()
+
+
+def _set_export(db: Session, export_id: int, **values) -> None:
+    # Core UPDATE, like import progress: not a user write
+    db.execute(update(models.AccountExport).where(models.AccountExport.id == export_id).values(**values))
+    db.commit()
+
+
+def run_export(db: Session, export_id: int) -> dict:
+    expire_exports(db)
+    # Claim it, so a job re-queued after a lease timeout doesn't export twice
+    user_id = db.execute(
+        update(models.AccountExport)
+          .where(models.AccountExport.id == export_id, models.AccountExport.status == "queued")
+          .values(status="running")
+          .returning(models.AccountExport.user_id)
+    ).scalar()
+    db.commit()
+    if user_id is None:
+        return {"status": "skipped"}
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"{uuid.uuid4().hex}.jsonl.gz")
+    counts = {}
+    try:
+        engine = db.get_bind()
+        with engine.connect() as conn, gzip.open(path, "wb") as out:
+            user = conn.execute(
+                select(*[c for c in models.User.__table__.columns if c.key != "password_hash"])
+                  .where(models.User.id == user_id)
+            ).mappings().first()
+            out.write(_row("user", user or {"id": user_id}))
+            for kind, model in EXPORT_SECTIONS:
+                # Server-side cursor: climbs never sit in memory all at once
+                rows = conn.execution_options(yield_per=EXPORT_BATCH_ROWS).execute(
+                    select(model.__table__).where(model.__table__.c.user_id == user_id)
+                ).mappings()
+                counts[kind] = 0
+                for batch in rows.partitions():
+                    out.writelines(_row(kind, row) for row in batch)
+                    counts[kind] += len(batch)
+    except Exception as e:
+        remove_file(path)
+        _set_export(db, export_id, status="failed", error=str(e), finished_at=datetime.now(timezone.utc))
+        raise
+
+    finished_at = datetime.now(timezone.utc)
+    _set_export(
+        db, export_id, status="done", path=path, size_bytes=os.path.getsize(path), row_counts=counts,
+        finished_at=finished_at, expires_at=finished_at + timedelta(hours=EXPORT_TTL_HOURS),
+    )
+    return {"status": "done", "rows": counts}
+
+
+def expire_exports(db: Session) -> int:
+    """Deletes export files past their expiry; the rows stay as history."""
+    expired = db.execute(
+        select(models.AccountExport.id, models.AccountExport.path).where(
+            models.AccountExport.expires_at < datetime.now(timezone.utc),
+            models.AccountExport.path.is_not(None),
+        )
+    ).all()
+    for export_id, path in expired:
+        remove_file(path)
+        _set_export(db, export_id, path=None, status="expired")
+    return len(expired)
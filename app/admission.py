@@ -0,0 +1,177 @@
+"""
+Admission control for the bcrypt-heavy auth routes.
+
+Each guarded route gets:
+
+* a per-client token bucket (429 + Retry-After when empty), and
+* a concurrency limit with a bounded wait queue (503 + Retry-After when
+  the queue is full or the wait times out).
+
+Waiting happens on the event loop, so queued logins never hold one of the
+threadpool threads that serve cheap reads like /get_gyms/.
+
+Settings are read per route, falling back to the AUTH_* defaults, e.g.
+``LOGIN_MAX_CONCURRENCY`` then ``AUTH_MAX_CONCURRENCY``.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request
+
+
+def _setting(route: str, name: str, default: float) -> float:
+    value = os.getenv(f"{route.upper()}_{name}", os.getenv(f"AUTH_{name}"))
+    return float(value) if value is not None else default
+
+
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+
+def _retry_after(seconds: float) -> dict:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+class ConcurrencyLimiter:
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self) -> None:
+        if self.in_flight >= self.limit and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server busy, please retry",
+                headers=_retry_after(self.queue_timeout),
+            )
+        self.waiting += 1
+        try:
+            acquired = await self._acquire_within(self.queue_timeout)
+        finally:
+            self.waiting -= 1
+        if not acquired:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server busy, please retry",
+                headers=_retry_after(self.queue_timeout),
+            )
+        self.in_flight += 1
+
+    async def _acquire_within(self, timeout: float) -> bool:
+        # Not wait_for: if the timeout fires just as the acquire succeeds,
+        # the permit could be lost. Checking the task afterwards can't miss it.
+        acquiring = asyncio.ensure_future(self._semaphore.acquire())
+        try:
+            await asyncio.wait({acquiring}, timeout=timeout)
+        except BaseException:
+            self._abandon(acquiring)
+            raise
+        if acquiring.done() and not acquiring.cancelled():
+            return True
+        self._abandon(acquiring)
+        return False
+
+    def _abandon(self, acquiring: asyncio.Future) -> None:
+        # The acquire may still win the permit before the cancel lands;
+        # hand it straight back if it does
+        acquiring.cancel()
+        acquiring.add_done_callback(lambda task: task.cancelled() or self._semaphore.release())
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+class TokenBucketLimiter:
+    """
+    One bucket per client key, refilled continuously at ``rate`` tokens
+    per second up to ``burst``. Least recently seen clients are evicted
+    once ``max_clients`` is reached.
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 50_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, client: str) -> float:
+        """Returns 0 when allowed, otherwise seconds until a token is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+def client_key(request: Request) -> str:
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+limiters: dict[str, ConcurrencyLimiter] = {}
+
+
+def guard(route: str):
+    """
+    Route dependency: rate limit the client, then wait for a concurrency
+    slot. Use as ``dependencies=[Depends(admission.guard("login"))]``.
+    """
+    concurrency = ConcurrencyLimiter(
+        route,
+        limit=int(_setting(route, "MAX_CONCURRENCY", 4)),
+        max_queue=int(_setting(route, "MAX_QUEUE", 32)),
+        queue_timeout=_setting(route, "QUEUE_TIMEOUT_SECONDS", 2),
+    )
+    buckets = TokenBucketLimiter(
+        rate=_setting(route, "RATE_PER_MINUTE", 20) / 60,
+        burst=_setting(route, "RATE_BURST", 10),
+    )
+    limiters[route] = concurrency
+
+    async def dependency(request: Request):
+        wait = buckets.take(client_key(request))
+        if wait:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers=_retry_after(wait),
+            )
+        await concurrency.acquire()
+        try:
+            yield
+        finally:
+            concurrency.release()
+
+    return dependency
@@ -2,7 +2,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
-from . import models
+from . import crud, revocation, tracing
 from .database import get_db
 from .schemas import TokenData
 import os
@@ -14,6 +14,7 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+tracer = tracing.get_tracer(__name__)
 
 def get_current_user(
     token: str = Depends(oauth2_scheme),
@@ -25,15 +26,21 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with tracer.start_as_current_span("jwt.decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
-        if email is None:
+        if email is None or payload.get("type") == "refresh":
             raise credentials_exception
         token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
+    with tracer.start_as_current_span("auth.revocation_check"):
+        revoked = revocation.is_revoked(payload)
+    if revoked:
+        raise credentials_exception
 
-    user = db.query(models.User).filter(models.User.email == token_data.email).first()
+    user = crud.get_user_by_email(db, token_data.email)
     if user is None:
         raise credentials_exception
+    tracing.set_root_attributes({"enduser.id": user.id})
     return user
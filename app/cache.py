@@ -0,0 +1,368 @@
+"""
+Small cache layer shared by every worker.
+
+Two backends:
+
+* ``LRUBackend`` – bounded, in-process, per-key TTL. The default, and
+  what tests/ runs against.
+* ``RedisBackend`` – speaks plain RESP to anything Redis-compatible
+  (Redis, Valkey, a local fake) so caches are shared across workers/nodes.
+
+``CACHE_URL`` picks the backend (``redis://host:6379/0`` or ``memory://``).
+
+Keys are namespaced and versioned: ``<prefix>:<ns>:v<version>:<key>``.
+``invalidate(ns)`` bumps the version, so every key in the namespace is
+orphaned in one write and ages out by TTL. ``get_or_set`` is single-flight:
+one caller per key loads, the rest wait for its result.
+
+``invalidate`` also leaves a write marker on the namespace for
+CACHE_WRITE_MARKER_SECONDS. A loader whose reads may predate the write
+(app.database flags reads served by the replica through ``stale_read``)
+still returns its value, but it is not stored while the marker is there.
+Otherwise a lagging replica could refill the cache with the old data for
+the whole TTL.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+CACHE_URL = os.getenv("CACHE_URL", "memory://")
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "flashed")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10_000))
+CACHE_DEFAULT_TTL = float(os.getenv("CACHE_DEFAULT_TTL_SECONDS", 300))
+# At least as long as a replica may lag behind a write
+CACHE_WRITE_MARKER_SECONDS = float(os.getenv("CACHE_WRITE_MARKER_SECONDS", 10))
+
+# True while a loader has read from a source that may lag (the replica)
+stale_read: ContextVar[bool] = ContextVar("stale_read", default=False)
+
+
+class CacheUnavailable(Exception):
+    pass
+
+
+# -------------------------------------------------
+# Backends
+# -------------------------------------------------
+
+class LRUBackend:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data: OrderedDict[str, tuple[Optional[float], bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key: str) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def _store(self, key: str, value: bytes, ttl: Optional[float]) -> None:
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._live(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = int(self._live(key) or 0) + 1
+            self._store(key, str(value).encode(), None)
+            return value
+
+    def ping(self) -> bool:
+        return True
+
+
+class RedisBackend:
+    """
+    Minimal RESP2 client: one socket per thread, reconnect on failure.
+    Only the handful of commands the cache needs.
+    """
+
+    def __init__(self, url: str, timeout: float = 0.5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock = sock
+        self._local.reader = sock.makefile("rb")
+        if self.password:
+            self._roundtrip("AUTH", self.password)
+        if self.db:
+            self._roundtrip("SELECT", self.db)
+
+    def _close(self):
+        for attr in ("reader", "sock"):
+            handle = getattr(self._local, attr, None)
+            if handle is not None:
+                try:
+                    handle.close()
+                except OSError:
+                    pass
+                setattr(self._local, attr, None)
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("connection closed by cache server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise CacheUnavailable(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise CacheUnavailable(f"unexpected reply {line!r}")
+
+    def _roundtrip(self, *args):
+        self._local.sock.sendall(self._encode(args))
+        return self._read_reply()
+
+    def _command(self, *args):
+        try:
+            if getattr(self._local, "sock", None) is None:
+                self._connect()
+            return self._roundtrip(*args)
+        except (OSError, ConnectionError) as exc:
+            self._close()
+            raise CacheUnavailable(str(exc)) from exc
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        if ttl:
+            self._command("SET", key, value, "PX", int(ttl * 1000))
+        else:
+            self._command("SET", key, value)
+
+    def add(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        args = ["SET", key, value, "NX"]
+        if ttl:
+            args += ["PX", int(ttl * 1000)]
+        return self._command(*args) == "OK"
+
+    def delete(self, key: str) -> None:
+        self._command("DEL", key)
+
+    def incr(self, key: str) -> int:
+        return self._command("INCR", key)
+
+    def ping(self) -> bool:
+        return self._command("PING") == "PONG"
+
+
+def backend_from_url(url: str):
+    scheme = urlparse(url).scheme
+    if scheme in ("redis", "valkey"):
+        return RedisBackend(url)
+    if scheme in ("memory", ""):
+        return LRUBackend()
+    raise ValueError(f"Unsupported CACHE_URL scheme '{scheme}'")
+
+
+# -------------------------------------------------
+# Cache front end
+# -------------------------------------------------
+
+_MISSING = object()
+
+
+class Cache:
+    """
+    JSON values, namespaced + versioned keys, single-flight loading.
+    Backend errors are logged and treated as misses so a cache outage
+    never fails a request.
+    """
+
+    lock_ttl = 5.0
+    wait_interval = 0.02
+
+    def __init__(self, backend, prefix: str = CACHE_PREFIX):
+        self.backend = backend
+        self.prefix = prefix
+        self.available = True
+        # full key -> [lock, callers using it]; an entry goes once its last
+        # caller leaves, so everyone waiting on a key shares one lock
+        self._flights: dict[str, list] = {}
+        self._flights_lock = threading.Lock()
+
+    def _call(self, method: str, *args, default=None):
+        try:
+            result = getattr(self.backend, method)(*args)
+            self.available = True
+            return result
+        except CacheUnavailable as exc:
+            if self.available:
+                logger.warning("cache unavailable: %s", exc)
+            self.available = False
+            return default
+
+    def _version(self, namespace: str) -> int:
+        raw = self._call("get", f"{self.prefix}:{namespace}:__version__")
+        return int(raw or 0)
+
+    def key(self, namespace: str, key: Any) -> str:
+        return f"{self.prefix}:{namespace}:v{self._version(namespace)}:{key}"
+
+    def get(self, namespace: str, key: Any, default: Any = None) -> Any:
+        raw = self._call("get", self.key(namespace, key))
+        return default if raw is None else json.loads(raw)
+
+    def set(self, namespace: str, key: Any, value: Any, ttl: Optional[float] = CACHE_DEFAULT_TTL) -> None:
+        self._call("set", self.key(namespace, key), json.dumps(value).encode(), ttl)
+
+    def delete(self, namespace: str, key: Any) -> None:
+        self._call("delete", self.key(namespace, key))
+
+    def invalidate(self, namespace: str) -> None:
+        self._call("incr", f"{self.prefix}:{namespace}:__version__")
+        self._call("set", f"{self.prefix}:{namespace}:__written__", b"1", CACHE_WRITE_MARKER_SECONDS)
+
+    def written_recently(self, namespace: str) -> bool:
+        return self._call("get", f"{self.prefix}:{namespace}:__written__") is not None
+
+    def ping(self) -> bool:
+        return bool(self._call("ping", default=False))
+
+    def _join_flight(self, full_key: str) -> threading.Lock:
+        with self._flights_lock:
+            flight = self._flights.setdefault(full_key, [threading.Lock(), 0])
+            flight[1] += 1
+            return flight[0]
+
+    def _leave_flight(self, full_key: str) -> None:
+        with self._flights_lock:
+            flight = self._flights[full_key]
+            flight[1] -= 1
+            if not flight[1]:
+                del self._flights[full_key]
+
+    def get_or_set(
+        self,
+        namespace: str,
+        key: Any,
+        loader: Callable[[], Any],
+        ttl: Optional[float] = CACHE_DEFAULT_TTL,
+    ) -> Any:
+        full_key = self.key(namespace, key)
+        raw = self._call("get", full_key)
+        if raw is not None:
+            return json.loads(raw)
+
+        # Single-flight within this worker...
+        local_lock = self._join_flight(full_key)
+        try:
+            with local_lock:
+                raw = self._call("get", full_key)
+                if raw is not None:
+                    return json.loads(raw)
+
+                # ...and across workers via a short-lived lock key
+                lock_key = f"{full_key}:__lock__"
+                if not self._call("add", lock_key, b"1", self.lock_ttl, default=True):
+                    value = self._wait_for(full_key)
+                    if value is not _MISSING:
+                        return value
+                read = stale_read.set(False)
+                try:
+                    value = loader()
+                    if not (stale_read.get() and self.written_recently(namespace)):
+                        self._call("set", full_key, json.dumps(value).encode(), ttl)
+                    return value
+                finally:
+                    stale_read.reset(read)
+                    self._call("delete", lock_key)
+        finally:
+            self._leave_flight(full_key)
+
+    def _wait_for(self, full_key: str) -> Any:
+        deadline = time.monotonic() + self.lock_ttl
+        while time.monotonic() < deadline:
+            time.sleep(self.wait_interval)
+            raw = self._call("get", full_key)
+            if raw is not None:
+                return json.loads(raw)
+            if not self.available:
+                break
+        return _MISSING
+
+
+cache = Cache(backend_from_url(CACHE_URL))
+
+
+# -------------------------------------------------
+# Namespaces used by the app
+# -------------------------------------------------
+
+def user_namespace(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def gym_namespace(gym_id: int) -> str:
+    return f"gym:{gym_id}"
+
+
+def catalog_namespace(catalog_id: int) -> str:
+    return f"catalog:{catalog_id}"
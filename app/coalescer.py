@@ -0,0 +1,160 @@
+"""
+Group commit for high-frequency inserts.
+
+Callers hand a row to a ``WriteCoalescer`` and block on a future. Flusher
+threads collect whatever arrives within ``max_wait_ms`` (or until
+``max_batch`` rows), write the batch as one multi-row INSERT ... RETURNING
+in one transaction, and hand each caller its own row back. At peak that
+is one commit (one fsync) per batch instead of per row, at the cost of at
+most ``max_wait_ms`` extra latency.
+
+If a batch fails (e.g. one row violates a constraint) its rows are retried
+one by one, so a bad row only fails its own caller.
+
+A caller that times out must know whether its row can still be written,
+or a retry would duplicate it. A row no flusher has picked up yet is
+withdrawn (``GroupCommitTimeout``: nothing written, safe to retry). A row
+whose batch is already being written is waited on for one more timeout;
+past that, ``GroupCommitPending`` means it may still commit, so the
+client must not resend it.
+
+Opt in with CLIMB_GROUP_COMMIT=true.
+"""
+import functools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable
+
+from sqlalchemy import insert
+
+from . import jobs, models
+from .cache import user_namespace
+from .database import record_writes, shard_engines
+
+logger = logging.getLogger(__name__)
+
+CLIMB_GROUP_COMMIT = os.getenv("CLIMB_GROUP_COMMIT", "false").lower() == "true"
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", 200))
+GROUP_COMMIT_MAX_WAIT_MS = float(os.getenv("GROUP_COMMIT_MAX_WAIT_MS", 5))
+GROUP_COMMIT_FLUSHERS = int(os.getenv("GROUP_COMMIT_FLUSHERS", 2))
+GROUP_COMMIT_TIMEOUT_SECONDS = float(os.getenv("GROUP_COMMIT_TIMEOUT_SECONDS", 10))
+
+
+class GroupCommitTimeout(Exception):
+    """The row was withdrawn before any flusher took it; nothing was written."""
+
+
+class GroupCommitPending(Exception):
+    """The row's batch is still being written and may yet commit."""
+
+
+class WriteCoalescer:
+    def __init__(
+        self,
+        flush: Callable[[list[dict]], list[dict]],
+        max_batch: int = GROUP_COMMIT_MAX_BATCH,
+        max_wait_ms: float = GROUP_COMMIT_MAX_WAIT_MS,
+        flushers: int = GROUP_COMMIT_FLUSHERS,
+    ):
+        self.flush = flush
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: queue.Queue[tuple[dict, Future]] = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"write-coalescer-{i}", daemon=True)
+            for i in range(flushers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, values: dict) -> dict:
+        future: Future = Future()
+        self._queue.put((values, future))
+        try:
+            return future.result(timeout=GROUP_COMMIT_TIMEOUT_SECONDS)
+        except FutureTimeoutError:
+            # Only succeeds while the row is still queued
+            if future.cancel():
+                raise GroupCommitTimeout() from None
+        try:
+            return future.result(timeout=GROUP_COMMIT_TIMEOUT_SECONDS)
+        except FutureTimeoutError:
+            raise GroupCommitPending() from None
+
+    def _collect(self) -> list[tuple[dict, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Marks each row as taken; rows their callers withdrew are dropped
+            batch = [(values, future) for values, future in self._collect() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._write([values for values, _ in batch], [future for _, future in batch])
+            except Exception:
+                logger.exception("group commit flusher failed")
+
+    def _write(self, rows: list[dict], futures: list[Future]) -> None:
+        try:
+            results = self.flush(rows)
+        except Exception as exc:
+            if len(rows) == 1:
+                futures[0].set_exception(exc)
+                return
+            # Isolate the failing row(s)
+            for row, future in zip(rows, futures):
+                self._write([row], [future])
+            return
+        for result, future in zip(results, futures):
+            future.set_result(result)
+
+
+# -------------------------------------------------
+# Climbs
+# -------------------------------------------------
+
+def insert_climbs(rows: list[dict], shard: int = 0) -> list[dict]:
+    table = models.Climb.__table__
+    user_ids = {row["user_id"] for row in rows}
+    with shard_engines[shard].begin() as conn:
+        # sort_by_parameter_order ties each RETURNING row to its input row
+        result = conn.execute(
+            insert(table).returning(*table.columns, sort_by_parameter_order=True),
+            rows,
+        )
+        inserted = [dict(row._mapping) for row in result]
+        for user_id in user_ids:
+            jobs.enqueue(
+                conn, "refresh_user_stats", {"user_id": user_id},
+                dedupe_key=f"refresh_user_stats:{user_id}",
+            )
+    record_writes(user_namespace(user_id) for user_id in user_ids)
+    return inserted
+
+
+# One per shard: a batch is one transaction, so it can't span databases
+_climb_coalescers: dict[int, WriteCoalescer] = {}
+_climb_coalescer_lock = threading.Lock()
+
+
+def climb_coalescer(shard: int = 0) -> WriteCoalescer:
+    if shard not in _climb_coalescers:
+        with _climb_coalescer_lock:
+            if shard not in _climb_coalescers:
+                _climb_coalescers[shard] = WriteCoalescer(functools.partial(insert_climbs, shard=shard))
+    return _climb_coalescers[shard]
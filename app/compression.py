@@ -0,0 +1,184 @@
+"""
+Negotiated response compression (brotli or gzip) for JSON payloads.
+
+Brotli is used when the client accepts ``br``; otherwise gzip. ``brotli``
+is in requirements.txt, but the import stays optional: without it ``br``
+is never offered and every client gets gzip. Bodies under
+``minimum_size``, and responses to clients that accept neither, pass
+through uncompressed. Those still get ``Vary: Accept-Encoding``, since
+another request for them could have been compressed. Responses that are
+already encoded or not text-like pass through as-is. Streaming responses
+are compressed chunk by chunk.
+"""
+import gzip
+import os
+import zlib
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", 1024))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4))
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "text/",
+)
+
+
+def _accepted_encodings(header: str) -> dict[str, float]:
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def choose_encoding(header: str):
+    accepted = _accepted_encodings(header)
+    wildcard = accepted.get("*", 0.0)
+    if brotli is not None and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+class _Gzip:
+    def __init__(self, level: int):
+        # wbits 16+ => gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def _one_shot(encoding: str, body: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _vary(existing: list[bytes]) -> bytes:
+    """The route's Vary values (Origin, Authorization, ...) plus Accept-Encoding."""
+    names = [name.strip() for value in existing for name in value.split(b",") if name.strip()]
+    if b"*" in names:
+        return b"*"
+    if b"accept-encoding" not in (name.lower() for name in names):
+        names.append(b"Accept-Encoding")
+    return b", ".join(names)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        # None still goes through _CompressingSend, for the Vary header
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        await self.app(scope, receive, _CompressingSend(send, encoding, self.minimum_size))
+
+
+class _CompressingSend:
+    def __init__(self, send, encoding: Optional[str], minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+
+    def _compressible(self) -> bool:
+        headers = {k.lower(): v for k, v in self.start["headers"]}
+        if b"content-encoding" in headers:
+            return False
+        content_type = headers.get(b"content-type", b"").decode("latin-1")
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def _headers(self, encoding=None, content_length=None):
+        # Without an encoding only Vary changes; Content-Length stays
+        dropped = (b"content-length", b"vary") if encoding else (b"vary",)
+        headers = [(k, v) for k, v in self.start["headers"] if k.lower() not in dropped]
+        if encoding:
+            headers.append((b"content-encoding", encoding.encode()))
+        headers.append((b"vary", _vary([v for k, v in self.start["headers"] if k.lower() == b"vary"])))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode()))
+        return headers
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.passthrough:
+            await self.send(message)
+            return
+
+        if self.compressor is None:
+            if not self._compressible():
+                self.passthrough = True
+                await self.send(self.start)
+                await self.send(message)
+                return
+
+            if self.encoding is None or (not more_body and len(body) < self.minimum_size):
+                self.passthrough = True
+                await self.send({**self.start, "headers": self._headers()})
+                await self.send(message)
+                return
+
+            if not more_body:
+                compressed = _one_shot(self.encoding, body)
+                await self.send({**self.start, "headers": self._headers(self.encoding, len(compressed))})
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+
+            self.compressor = _Brotli(BROTLI_QUALITY) if self.encoding == "br" else _Gzip(GZIP_LEVEL)
+            await self.send({**self.start, "headers": self._headers(self.encoding)})
+
+        chunk = self.compressor.compress(body)
+        if not more_body:
+            chunk += self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
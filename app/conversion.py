@@ -1,4 +1,5 @@
 from enum import Enum
+from typing import Iterable
 
 class GradeStyle(str, Enum):
     VSCALE = "VScale"
@@ -31,6 +32,18 @@ CONVERSION_TABLE = [
 ]
 
 
+# Lookup tables built once from CONVERSION_TABLE. A coarse V grade maps to
+# its lowest internal value, as the old linear scan did.
+_SCALE_KEYS = {GradeStyle.VSCALE: "v", GradeStyle.FONT: "font"}
+
+TO_INTERNAL = {scale: {} for scale in _SCALE_KEYS}
+TO_DISPLAY = {scale: {} for scale in _SCALE_KEYS}
+for _row in CONVERSION_TABLE:
+    for _scale, _key in _SCALE_KEYS.items():
+        TO_INTERNAL[_scale].setdefault(_row[_key], _row["internal"])
+        TO_DISPLAY[_scale][_row["internal"]] = _row[_key]
+
+
 # -------------------------------------------------
 # Conversion functions
 # -------------------------------------------------
@@ -40,12 +53,10 @@ def convert_grade_to_internal(grade: str, scale: GradeStyle) -> int:
     Converts a user-entered grade (like "V8" or "7B+") into
     the internal integer value.
     """
-    for row in CONVERSION_TABLE:
-        if scale == GradeStyle.VSCALE and row["v"] == grade:
-            return row["internal"]
-        if scale == GradeStyle.FONT and row["font"] == grade:
-            return row["internal"]
-    raise ValueError(f"Unknown grade '{grade}' for scale '{scale}'")
+    try:
+        return TO_INTERNAL[scale][grade]
+    except KeyError:
+        raise ValueError(f"Unknown grade '{grade}' for scale '{scale}'")
 
 
 def convert_internal_to_display(internal: int, scale: GradeStyle) -> str:
@@ -53,13 +64,36 @@ def convert_internal_to_display(internal: int, scale: GradeStyle) -> str:
     Converts the internal stored grade integer into the
     user-facing grade string for the requested scale.
     """
-    for row in CONVERSION_TABLE:
-        if row["internal"] == internal:
-            if scale == GradeStyle.VSCALE:
-                return row["v"]
-            elif scale == GradeStyle.FONT:
-                return row["font"]
-    raise ValueError(f"Cannot find mapping for internal value '{internal}'")
+    try:
+        return TO_DISPLAY[scale][internal]
+    except KeyError:
+        raise ValueError(f"Cannot find mapping for internal value '{internal}'")
+
+
+def convert_internals_to_display(internals: Iterable[int], scale: GradeStyle) -> list[str]:
+    """
+    Batch version of convert_internal_to_display for whole result sets:
+    one table lookup, then a dict hit per value.
+    """
+    table = TO_DISPLAY.get(scale)
+    if table is None:
+        raise ValueError(f"Unknown scale '{scale}'")
+    try:
+        return [table[internal] for internal in internals]
+    except KeyError as e:
+        raise ValueError(f"Cannot find mapping for internal value '{e.args[0]}'")
+
+
+def grade_to_internal_range(grade: str, scale: GradeStyle) -> tuple[int, int]:
+    """
+    Returns the lowest and highest internal values a grade covers; coarse
+    V grades span several Font grades (e.g. "V3" is 4..5).
+    """
+    key = "v" if scale == GradeStyle.VSCALE else "font"
+    values = [row["internal"] for row in CONVERSION_TABLE if row[key] == grade]
+    if not values:
+        raise ValueError(f"Unknown grade '{grade}' for scale '{scale}'")
+    return min(values), max(values)
 
 
 def label_to_internal(label: str, ranges: list[dict]) -> int:
@@ -1,13 +1,18 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import func, delete, cast, Integer, bindparam, lambda_stmt, literal_column, select
+from sqlalchemy.dialects.postgresql import Range
+from sqlalchemy.orm import Session, load_only
 from fastapi import HTTPException
 from passlib.context import CryptContext
 from jose import jwt, JWTError
-from datetime import datetime, timedelta
-from . import models, schemas
+from datetime import datetime, timedelta, timezone
+from . import gym_catalog, models, schemas, shards, tracing
 from dotenv import load_dotenv
 import os
 from .utils import verify_password, hash_password
-from typing import List, Optional
+from .cache import cache, gym_namespace, user_namespace
+from .conversion import convert_internal_to_display, GradeStyle
+from typing import Iterable, List, Optional
+import base64
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -15,6 +20,7 @@ load_dotenv()
 ALGORITHM = os.getenv("ALGORITHM")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ACCESS_TOKEN_EXPIRE_MINUTES = os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES")
+tracer = tracing.get_tracer(__name__)
 
 def decode_access_token(token: str) -> dict:
     try:
@@ -25,23 +31,66 @@ def decode_access_token(token: str) -> dict:
 
 # CRUD Functions
 def create_user(db: Session, user: schemas.UserCreate):
+    # db is the directory (shard 0); the row itself goes to the user's home shard
     hashed_password = hash_password(user.password)
-    db_user = models.User(
-        first_name=user.first_name,
-        last_name=user.last_name,
-        email=user.email,
-        password_hash=hashed_password,
-        location=user.location,
-        home_gym=user.home_gym,
-        grade_style=user.grade_style, 
-    )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    shard = shards.pick_new_user_shard()
+    shard_db = db if shard == 0 else shards.session_for(shard)
+    registered = False
+    try:
+        db_user = models.User(
+            first_name=user.first_name,
+            last_name=user.last_name,
+            email=user.email,
+            password_hash=hashed_password,
+            location=user.location,
+            home_gym=user.home_gym,
+            grade_style=user.grade_style, 
+        )
+        shard_db.add(db_user)
+        shard_db.flush()
+        if not shards.register_user(db, db_user.id, shard, db_user.email):
+            raise HTTPException(status_code=400, detail="Email already registered")
+        # Claim the email first; the shard row follows
+        db.commit()
+        registered = True
+        shard_db.commit()
+        shard_db.refresh(db_user)
+        return db_user
+    except Exception:
+        shard_db.rollback()
+        db.rollback()
+        if registered and shard_db is not db:
+            db.execute(delete(models.UserShard).where(models.UserShard.user_id == db_user.id))
+            db.commit()
+        raise
+    finally:
+        if shard_db is not db:
+            shard_db.close()
+
+# Hot read statements, built once at import. SQLAlchemy's compiled cache is
+# keyed on statement structure, so reusing them skips both building the
+# query and compiling it; per-call values go in as bound parameters.
+# Accounts awaiting deletion can't sign in
+USER_BY_EMAIL = (
+    select(models.User)
+      .where(models.User.email == bindparam("email"), models.User.deleted_at.is_(None))
+      .limit(1)
+)
 
+USER_GYMS = select(models.Gym).where(
+    models.Gym.user_id == bindparam("user_id"),
+    models.Gym.deleted_at.is_(None),
+)
+
+USER_PROJECTS = (
+    select(models.Project)
+      .where(models.Project.user_id == bindparam("user_id"), models.Project.deleted_at.is_(None))
+      .order_by(models.Project.created_at.desc())
+)
+
+@tracer.start_as_current_span("crud.get_user_by_email")
 def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+    return db.execute(USER_BY_EMAIL, {"email": email}).scalars().first()
 
 def user_login(userLogin: schemas.UserLogin, db: Session):
     # Retrieve user by email
@@ -81,9 +130,8 @@ def update_user(db: Session, user_id: int, updates: dict):
     # Check if the email is being updated and ensure it's unique
     new_email = updates.get("email")
     if new_email and new_email != user.email:
-        existing_user = get_user_by_email(db, new_email)
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Email already in use")
+        # Uniqueness is global, so it is checked (and kept) in the directory
+        shards.change_email(user_id, new_email)
 
     # Update fields dynamically
     for key, value in updates.items():
@@ -134,32 +182,345 @@ def create_climb(
     db.refresh(db_climb)
     return db_climb
 
-def get_user_climbs(db: Session, user_id: int, filters: schemas.ClimbFilter, internal_grade_range: Optional[List[int]]):
-    query = db.query(models.Climb).filter(models.Climb.user_id == user_id)
+def _only(query, model, columns: Optional[Iterable[str]]):
+    # Sparse fieldsets: only SELECT the columns the response needs
+    if columns:
+        query = query.options(load_only(*(getattr(model, column) for column in columns)))
+    return query
+
+CLIMB_SORTS = {
+    schemas.ClimbSort.NEWEST: (models.Climb.created_at.desc(), models.Climb.id.desc()),
+    schemas.ClimbSort.OLDEST: (models.Climb.created_at.asc(), models.Climb.id.asc()),
+    schemas.ClimbSort.HARDEST: (models.Climb.internal_grade.desc(), models.Climb.created_at.desc()),
+    schemas.ClimbSort.EASIEST: (models.Climb.internal_grade.asc(), models.Climb.created_at.desc()),
+}
+
+# Everything a ClimbResponse is built from
+CLIMB_ROW_FIELDS = ("id", "internal_grade", "original_grade", "original_scale", "gym_id", "attempts", "created_at")
 
-    if filters.start_date:
-        query = query.filter(models.Climb.created_at >= filters.start_date)
-    if filters.end_date:
-        query = query.filter(models.Climb.created_at <= filters.end_date)
+@tracer.start_as_current_span("crud.get_user_climbs")
+def get_user_climbs(
+    db: Session,
+    user_id: int,
+    filters: schemas.ClimbFilter,
+    internal_grade_range: Optional[List[int]],
+    columns: Optional[Iterable[str]] = None,
+    internal_bounds: tuple[Optional[int], Optional[int]] = (None, None),
+    as_rows: bool = False,
+):
+    """
+    Every filter on climbs is a plain comparison on an indexed column (no
+    functions or casts), so Postgres can push it into
+    ix_climbs_user_id_created_at, ix_climbs_user_id_internal_grade,
+    ix_climbs_user_id_gym_id_created_at or the flashes partial index. The
+    one cast, ``internal_grade::int`` in the gym_label join, is only the
+    probe into the gym_grade_bands GiST index, after climbs are picked.
+
+    With ``as_rows`` only ``columns`` (default CLIMB_ROW_FIELDS) are
+    selected and plain row tuples come back: no Climb objects, no identity
+    map. Rows support attribute access, so serializers take either.
+    """
+    # Built as a lambda statement: each optional filter is its own cached
+    # fragment, so a repeat call only extracts bound values instead of
+    # rebuilding and recompiling the query. Closures read plain locals
+    # (not attributes) so the values are tracked as bound parameters.
+    columns = tuple(columns) if columns else None
+    if as_rows:
+        names = columns or CLIMB_ROW_FIELDS
+        attrs = [getattr(models.Climb, name) for name in names]
+        stmt = lambda_stmt(lambda: select(*attrs), track_on=[names], track_closure_variables=False)
+    else:
+        stmt = lambda_stmt(lambda: select(models.Climb))
+        if columns:
+            attrs = [getattr(models.Climb, column) for column in columns]
+            stmt = stmt.add_criteria(
+                lambda s: s.options(load_only(*attrs)),
+                track_on=[columns], track_closure_variables=False,
+            )
+    stmt += lambda s: s.where(
+        models.Climb.user_id == user_id,
+        models.Climb.deleted_at.is_(None),
+    )
+
+    # created_at bounds also prune the monthly climbs partitions
+    start_date, end_date = filters.start_date, filters.end_date
+    if start_date:
+        stmt += lambda s: s.where(models.Climb.created_at >= start_date)
+    if end_date:
+        stmt += lambda s: s.where(models.Climb.created_at <= end_date)
     if internal_grade_range:
-        query = query.filter(models.Climb.internal_grade.in_(internal_grade_range))
+        grades = list(internal_grade_range)
+        stmt += lambda s: s.where(models.Climb.internal_grade.in_(grades))
+
+    min_internal, max_internal = internal_bounds
+    if min_internal is not None:
+        stmt += lambda s: s.where(models.Climb.internal_grade >= min_internal)
+    if max_internal is not None:
+        stmt += lambda s: s.where(models.Climb.internal_grade <= max_internal)
 
-    return query.order_by(models.Climb.created_at.desc()).all()
+    gym_id, original_scale = filters.gym_id, filters.original_scale
+    if gym_id is not None:
+        stmt += lambda s: s.where(models.Climb.gym_id == gym_id)
+    if original_scale:
+        stmt += lambda s: s.where(models.Climb.original_scale == original_scale)
 
-def get_user_projects(db: Session, user_id: int):
-    return (
-        db.query(models.Project)
-          .filter(models.Project.user_id == user_id)
-          .order_by(models.Project.created_at.desc())
-          .all()
+    # A literal "attempts = 1", not a bound parameter: the planner can only
+    # use the partial flashes index when it sees the predicate's constant
+    min_attempts, max_attempts = filters.min_attempts, filters.max_attempts
+    if filters.flash_only:
+        stmt += lambda s: s.where(models.Climb.attempts == literal_column("1"))
+    if min_attempts is not None:
+        stmt += lambda s: s.where(models.Climb.attempts >= min_attempts)
+    if max_attempts is not None:
+        stmt += lambda s: s.where(models.Climb.attempts <= max_attempts)
+
+    gym_label = filters.gym_label
+    if gym_label:
+        # Band lookup per climb's gym goes through the GiST (gym_id, grades) index
+        stmt += lambda s: s.join(
+            models.GymGradeBand,
+            (models.GymGradeBand.gym_id == models.Climb.gym_id)
+            & (models.GymGradeBand.label == gym_label)
+            & models.GymGradeBand.grades.contains(cast(models.Climb.internal_grade, Integer)),
+        )
+
+    order = CLIMB_SORTS[filters.sort]
+    stmt = stmt.add_criteria(
+        lambda s: s.order_by(*order),
+        track_on=[filters.sort], track_closure_variables=False,
+    )
+    result = db.execute(stmt)
+    climbs = result.all() if as_rows else result.scalars().all()
+    tracing.get_current_span().set_attributes({"db.rows": len(climbs), "climbs.sort": filters.sort.value})
+    return climbs
+
+def get_average_internal_grade(
+    db: Session,
+    user_id: int,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> Optional[float]:
+    query = db.query(func.avg(models.Climb.internal_grade)).filter(
+        models.Climb.user_id == user_id,
+        models.Climb.deleted_at.is_(None),
     )
+    # Bounding created_at lets Postgres prune the climbs partitions
+    if start_date:
+        query = query.filter(models.Climb.created_at >= start_date)
+    if end_date:
+        query = query.filter(models.Climb.created_at <= end_date)
+    return query.scalar()
+
+@tracer.start_as_current_span("crud.get_average_grade")
+def get_average_grade(
+    db: Session,
+    user_id: int,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> dict:
+    def load():
+        user = db.query(models.User).get(user_id)
+        if not user:
+            raise HTTPException(404, "User not found")
+
+        avg_internal = get_average_internal_grade(db, user_id, start_date, end_date)
+        rounded_grade = None
+        if avg_internal is not None:
+            # Average on the internal scale, then show it in the user's grade style
+            rounded_grade = convert_internal_to_display(round(avg_internal), GradeStyle(user.grade_style))
+        return {"average_grade": rounded_grade}
+
+    cache_key = f"average_grade:{start_date}:{end_date}"
+    return cache.get_or_set(user_namespace(user_id), cache_key, load)
+
+@tracer.start_as_current_span("crud.get_user_projects")
+def get_user_projects(
+    db: Session,
+    user_id: int,
+    columns: Optional[Iterable[str]] = None,
+    as_rows: bool = False,
+):
+    if as_rows:
+        # Row tuples of just these columns (default: all), no Project objects
+        names = columns or [column.key for column in models.Project.__table__.columns]
+        stmt = USER_PROJECTS.with_only_columns(*(getattr(models.Project, name) for name in names))
+        projects = db.execute(stmt, {"user_id": user_id}).all()
+    else:
+        stmt = _only(USER_PROJECTS, models.Project, columns)
+        projects = db.execute(stmt, {"user_id": user_id}).scalars().all()
+    tracing.get_current_span().set_attribute("db.rows", len(projects))
+    return projects
 
 def create_gym(db: Session, gym: schemas.GymCreate, user_id: int):
-    db_gym = models.Gym(**gym.dict(), user_id=user_id)
+    # The user's row points at the catalog gym and only keeps bands that differ
+    ranges = [band.dict() for band in gym.grade_ranges or []]
+    if gym.catalog_id is not None:
+        entry = gym_catalog.get_entry(gym.catalog_id)
+        if not entry:
+            raise HTTPException(status_code=404, detail="Catalog gym not found")
+        catalog_id, shared = entry.id, entry.grade_ranges
+    else:
+        catalog_id, shared = gym_catalog.find_or_create(gym.name, ranges)
+
+    db_gym = models.Gym(
+        name=gym.name,
+        is_default=gym.is_default,
+        user_id=user_id,
+        catalog_id=catalog_id,
+        grade_ranges=gym_catalog.override(ranges, shared),
+    )
     db.add(db_gym)
+    db.flush()
+    sync_gym_bands(db, db_gym)
     db.commit()
     db.refresh(db_gym)
     return db_gym
 
-def get_user_gyms(db: Session, user_id: int):
-    return db.query(models.Gym).filter(models.Gym.user_id == user_id).all()
+def update_gym(db: Session, gym_id: int, user_id: int, updates: schemas.GymUpdate):
+    gym = (
+        db.query(models.Gym)
+          .filter(models.Gym.id == gym_id, models.Gym.user_id == user_id, models.Gym.deleted_at.is_(None))
+          .first()
+    )
+    if not gym:
+        raise HTTPException(status_code=404, detail="Gym not found")
+
+    before = ranges = gym.effective_grade_ranges
+    if updates.grade_ranges is not None:
+        ranges = [band.dict() for band in updates.grade_ranges]
+    if updates.is_default is not None:
+        gym.is_default = updates.is_default
+    if updates.name is not None:
+        # A rename to a different gym moves the row to that catalog entry
+        if gym_catalog.normalize_name(updates.name) != gym_catalog.normalize_name(gym.name):
+            gym.catalog_id, _ = gym_catalog.find_or_create(updates.name, ranges)
+        gym.name = updates.name
+
+    gym.grade_ranges = gym_catalog.override(ranges, gym_catalog.catalog_ranges(gym.catalog_id))
+    if gym.effective_grade_ranges != before:
+        sync_gym_bands(db, gym)
+
+    db.commit()
+    db.refresh(gym)
+    return gym
+
+def sync_gym_bands(db: Session, gym: models.Gym):
+    # Rewrite the normalized bands from the gym's effective ranges
+    db.execute(delete(models.GymGradeBand).where(models.GymGradeBand.gym_id == gym.id))
+    db.add_all([
+        models.GymGradeBand(
+            gym_id=gym.id,
+            label=band["label"],
+            grades=Range(band["lo"], band["hi"], bounds="[]"),
+        )
+        for band in gym.effective_grade_ranges
+    ])
+
+def gym_label_to_internal(db: Session, gym_id: int, label: str) -> int:
+    # Midpoint of the band, as conversion.label_to_internal does
+    value = (
+        db.query((func.lower(models.GymGradeBand.grades) + func.upper(models.GymGradeBand.grades) - 1) / 2)
+          .filter(models.GymGradeBand.gym_id == gym_id, models.GymGradeBand.label == label)
+          .scalar()
+    )
+    if value is None:
+        raise HTTPException(status_code=400, detail=f"Unknown custom label {label}")
+    return value
+
+@tracer.start_as_current_span("crud.get_user_gyms")
+def get_user_gyms(db: Session, user_id: int, columns: Optional[Iterable[str]] = None):
+    stmt = _only(USER_GYMS, models.Gym, columns)
+    gyms = db.execute(stmt, {"user_id": user_id}).scalars().all()
+    tracing.get_current_span().set_attribute("db.rows", len(gyms))
+    return gyms
+
+def trace_user(db: Session, user_id: int) -> None:
+    """
+    Tags a sampled request with the user and their climb count bucket, so
+    slow traces can be grouped by how much data the user has. Unsampled
+    requests skip the count.
+    """
+    if not tracing.is_recording():
+        return
+    def load():
+        return db.execute(
+            select(func.count()).select_from(models.Climb)
+              .where(models.Climb.user_id == user_id, models.Climb.deleted_at.is_(None))
+        ).scalar()
+    count = cache.get_or_set(user_namespace(user_id), "climb_count", load)
+    tracing.set_root_attributes({"enduser.id": user_id, "user.climb_count_bucket": tracing.climb_count_bucket(count)})
+
+def get_gym_ranges(db: Session, gym_id: int) -> list[dict]:
+    # Band tables are read for every gym-scale climb; share them across
+    # workers. Display stays on these cached ranges rather than a
+    # gym_grade_bands query, which would cost a round trip per request. Per gym only the source is cached, the bands once per catalog gym.
+    def load():
+        gym = db.query(models.Gym).get(gym_id)
+        return [gym.catalog_id, gym.grade_ranges] if gym else [None, None]
+    catalog_id, override = cache.get_or_set(gym_namespace(gym_id), "grade_source", load)
+    return override if override is not None else gym_catalog.catalog_ranges(catalog_id)
+
+
+def soft_delete(db: Session, model, item_id: int, user_id: int):
+    # Rows are tombstoned rather than removed so /sync can report the delete
+    item = (
+        db.query(model)
+          .filter(model.id == item_id, model.user_id == user_id, model.deleted_at.is_(None))
+          .first()
+    )
+    if not item:
+        raise HTTPException(status_code=404, detail="Not found")
+    item.deleted_at = func.now()
+    db.commit()
+    return {"message": "Deleted"}
+
+
+# -------------------------------------------------
+# Delta sync
+# -------------------------------------------------
+
+SYNC_MODELS = {
+    "climbs": models.Climb,
+    "gyms": models.Gym,
+    "projects": models.Project,
+}
+
+# Writes committed slightly after our snapshot can carry an earlier
+# updated_at; re-sending this window keeps them from being skipped.
+# Clients upsert by id, so the overlap is harmless.
+SYNC_OVERLAP_SECONDS = int(os.getenv("SYNC_OVERLAP_SECONDS", 5))
+
+
+def encode_sync_token(at: datetime) -> str:
+    micros = int(at.timestamp() * 1_000_000)
+    return base64.urlsafe_b64encode(str(micros).encode()).decode().rstrip("=")
+
+
+def decode_sync_token(token: str) -> datetime:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        micros = int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    return datetime.fromtimestamp(micros / 1_000_000, tz=timezone.utc)
+
+
+def get_sync_changes(db: Session, user_id: int, since: Optional[datetime]):
+    """
+    Returns ``(server_time, {kind: (changed_rows, deleted_ids)})``. Without
+    ``since`` every live row is returned (a full sync).
+    """
+    server_time = db.query(func.now()).scalar()
+    changes = {}
+    for kind, model in SYNC_MODELS.items():
+        query = db.query(model).filter(model.user_id == user_id)
+        if since is not None:
+            query = query.filter(model.updated_at > since - timedelta(seconds=SYNC_OVERLAP_SECONDS))
+        else:
+            query = query.filter(model.deleted_at.is_(None))
+        rows = query.all()
+        changes[kind] = (
+            [row for row in rows if row.deleted_at is None],
+            [row.id for row in rows if row.deleted_at is not None],
+        )
+    return server_time, changes
@@ -1,20 +1,330 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, make_url, text
+from sqlalchemy.exc import DBAPIError, OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from fastapi import HTTPException, Request
+from jose import jwt, JWTError
+from typing import Callable, Optional
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from .cache import cache, stale_read, user_namespace, gym_namespace
+from . import tracing
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+# Extra shards, numbered from 1; DATABASE_URL is shard 0 and the directory
+# (user_shards, token families, revocations). See app/shards.py.
+SHARD_URLS = [url.strip() for url in os.getenv("SHARD_URLS", "").split(",") if url.strip()]
+# How long workers trust a cached user -> shard mapping
+SHARD_MAP_TTL_SECONDS = float(os.getenv("SHARD_MAP_TTL_SECONDS", 10))
 
-engine = create_engine(DATABASE_URL)
+# Reads for a user stay on the primary this long after that user wrote
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 10))
+# Replica is skipped while it is further behind than this, or unreachable
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 5))
+REPLICA_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_CHECK_INTERVAL_SECONDS", 2))
+
+# Compiled-statement cache entries per engine. The hot crud queries are
+# reused statements, but every distinct filter combination is its own entry.
+SQLALCHEMY_QUERY_CACHE_SIZE = int(os.getenv("SQLALCHEMY_QUERY_CACHE_SIZE", 1200))
+# psycopg (v3, postgresql+psycopg://) prepares a statement server-side once
+# it has run this many times on a connection. Set to "off" behind a
+# transaction-mode pgbouncer. psycopg2 has no server-side prepare.
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "5")
+
+
+def engine_options(url: Optional[str], **options) -> dict:
+    options.setdefault("query_cache_size", SQLALCHEMY_QUERY_CACHE_SIZE)
+    if url and make_url(url).get_driver_name() == "psycopg":
+        threshold = None if DB_PREPARE_THRESHOLD.lower() == "off" else int(DB_PREPARE_THRESHOLD)
+        options["connect_args"] = {**options.get("connect_args", {}), "prepare_threshold": threshold}
+    return options
+
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-def get_db():
+replica_engine = (
+    create_engine(DATABASE_REPLICA_URL, **engine_options(
+        DATABASE_REPLICA_URL, pool_pre_ping=True, connect_args={"connect_timeout": 2},
+    ))
+    if DATABASE_REPLICA_URL else None
+)
+ReplicaSessionLocal = (
+    sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+    if replica_engine is not None else None
+)
+
+
+shard_engines = [engine] + [create_engine(url, **engine_options(url)) for url in SHARD_URLS]
+shard_sessions = [SessionLocal] + [
+    sessionmaker(autocommit=False, autoflush=False, bind=shard_engine)
+    for shard_engine in shard_engines[1:]
+]
+
+for shard, shard_engine in enumerate(shard_engines):
+    tracing.instrument_engine(shard_engine, shard)
+if replica_engine is not None:
+    tracing.instrument_engine(replica_engine, shard="replica")
+
+    @event.listens_for(replica_engine, "before_cursor_execute")
+    def _flag_replica_read(conn, cursor, statement, parameters, context, executemany):
+        # Values loaded from here aren't cached right after a write (app/cache.py)
+        stale_read.set(True)
+
+
+def shard_for_user(user_id: Optional[int]) -> int:
+    """
+    The shard holding a user's rows; shard 0 for anonymous or unmapped
+    users. 503s while app.shards is moving the user.
+    """
+    if user_id is None or len(shard_engines) == 1:
+        return 0
+
+    def load():
+        with engine.connect() as conn:
+            row = conn.execute(
+                text("SELECT shard, moving FROM user_shards WHERE user_id = :user_id"),
+                {"user_id": user_id},
+            ).first()
+        return [row.shard, row.moving] if row else [0, False]
+
+    shard, moving = cache.get_or_set("shards", user_id, load, ttl=SHARD_MAP_TTL_SECONDS)
+    if moving:
+        raise HTTPException(503, "Account is being moved, try again shortly", headers={"Retry-After": "5"})
+    return shard
+
+
+class LazySession:
+    """
+    Stands in for a Session. Nothing is set up until the first attribute
+    access: no shard or replica lookup, no Session, and no pooled
+    connection. Requests that are rejected early or answered from cache
+    never touch the pool.
+
+    ``release()`` ends the transaction and hands the connection back as
+    soon as a read-only route has run its last query. Objects already
+    loaded stay readable for serialization; a later query simply checks
+    out a connection again.
+    """
+
+    def __init__(self, factory: Callable[[], Session]):
+        self._factory = factory
+        self._session: Optional[Session] = None
+
+    @property
+    def session(self) -> Session:
+        if self._session is None:
+            self._session = self._factory()
+        return self._session
+
+    @property
+    def started(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def release(self) -> None:
+        if self._session is not None:
+            self._session.close()
+
+    close = release
+
+
+def get_db(request: Request):
+    """
+    Lazy session on the requesting user's shard. The user comes from the
+    (unverified) token or user_id param; the route's auth still checks it.
+    """
+    db = LazySession(lambda: shard_sessions[shard_for_user(request_user_id(request))]())
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_directory_db():
+    """Session on shard 0, for directory tables (users map, tokens)."""
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+# -------------------------------------------------
+# Read-your-writes tracking
+# -------------------------------------------------
+
+def mark_user_write(user_id: Optional[int]) -> None:
+    # Kept in the shared cache so every worker sees the write
+    if user_id is not None:
+        cache.set("writes", user_id, time.time(), ttl=READ_YOUR_WRITES_SECONDS)
+
+
+def wrote_recently(user_id: Optional[int]) -> bool:
+    return user_id is not None and cache.get("writes", user_id) is not None
+
+
+def _cache_namespaces(obj) -> set[str]:
+    kind = obj.__class__.__name__
+    owner = obj.id if kind == "User" else getattr(obj, "user_id", None)
+    namespaces = set()
+    if owner is not None:
+        namespaces.add(user_namespace(owner))
+    if kind == "Gym" and obj.id is not None:
+        namespaces.add(gym_namespace(obj.id))
+    return namespaces
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_written(session, flush_context):
+    written = session.info.setdefault("written", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        written |= _cache_namespaces(obj)
+
+
+def record_writes(namespaces) -> None:
+    """
+    Invalidates cached snapshots/stats and pins the writers to the primary.
+    Runs after every session commit; Core writes call it themselves.
+    """
+    for namespace in namespaces:
+        cache.invalidate(namespace)
+        if namespace.startswith("user:"):
+            mark_user_write(int(namespace.split(":", 1)[1]))
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _record_written(session):
+    record_writes(session.info.pop("written", ()))
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _forget_written(session):
+    session.info.pop("written", None)
+
+
+for _maker in shard_sessions[1:]:
+    event.listen(_maker, "after_flush", _collect_written)
+    event.listen(_maker, "after_commit", _record_written)
+    event.listen(_maker, "after_rollback", _forget_written)
+
+
+# -------------------------------------------------
+# Replica health
+# -------------------------------------------------
+
+REPLICA_LAG_SQL = text(
+    "SELECT CASE"
+    " WHEN NOT pg_is_in_recovery() THEN 0"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())"
+    " END"
+)
+
+
+class ReplicaHealth:
+    """
+    Caches whether the replica is usable. At most one request thread
+    re-checks it per interval; everyone else uses the last answer.
+    """
+
+    def __init__(self):
+        self.healthy = replica_engine is not None
+        self.lag_seconds: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def mark_down(self) -> None:
+        self.healthy = False
+        self._checked_at = time.monotonic()
+
+    def check(self) -> bool:
+        if replica_engine is None:
+            return False
+        if time.monotonic() - self._checked_at < REPLICA_CHECK_INTERVAL_SECONDS:
+            return self.healthy
+        if not self._lock.acquire(blocking=False):
+            return self.healthy
+        try:
+            with replica_engine.connect() as conn:
+                lag = conn.execute(REPLICA_LAG_SQL).scalar()
+            self.lag_seconds = float(lag or 0)
+            self.healthy = self.lag_seconds <= REPLICA_MAX_LAG_SECONDS
+        except DBAPIError:
+            self.lag_seconds = None
+            self.healthy = False
+        finally:
+            self._checked_at = time.monotonic()
+            self._lock.release()
+        return self.healthy
+
+
+replica_health = ReplicaHealth()
+
+
+def request_user_id(request: Request) -> Optional[int]:
+    """
+    Best-effort user id for routing only. The token signature is checked
+    by the route's own auth dependency, not here.
+    """
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            user_id = jwt.get_unverified_claims(authorization[7:]).get("id")
+            if user_id is not None:
+                return int(user_id)
+        except (JWTError, ValueError, TypeError):
+            pass
+    for param in ("user_id", "id"):
+        value = request.query_params.get(param)
+        if value and value.isdigit():
+            return int(value)
+    return None
+
+
+def get_read_db(request: Request):
+    """
+    Lazy session for read-only routes. Uses the replica unless it is
+    missing, lagging or down, or the user wrote recently (read-your-writes).
+    The replica mirrors shard 0 only; users on other shards read their
+    shard. The choice is made on first use, so cache hits skip it. When
+    the replica can't be reached the request falls back to the primary.
+    """
+    def open_session() -> Session:
+        user_id = request_user_id(request)
+        shard = shard_for_user(user_id)
+        use_replica = (
+            ReplicaSessionLocal is not None
+            and shard == 0
+            and not wrote_recently(user_id)
+            and replica_health.check()
+        )
+        if not use_replica:
+            return shard_sessions[shard]()
+        session = ReplicaSessionLocal()
+        try:
+            # Connect now, while the primary can still take over
+            session.connection()
+        except OperationalError:
+            session.close()
+            replica_health.mark_down()
+            return shard_sessions[shard]()
+        return session
+
+    db = LazySession(open_session)
+    try:
+        yield db
+    except OperationalError:
+        if db.started and db.session.bind is replica_engine:
+            replica_health.mark_down()
+        raise
+    finally:
+        db.close()
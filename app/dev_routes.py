@@ -1,14 +1,14 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from . import models
+from . import gym_catalog, models, shards
 from .utils import hash_password
-from .database import get_db
+from .database import get_db, get_directory_db
 
 router = APIRouter()
 
 @router.post("/seed/", status_code=status.HTTP_201_CREATED)
-def seed_data(db: Session = Depends(get_db)):
+def seed_data(db: Session = Depends(get_db), directory: Session = Depends(get_directory_db)):
     try:
         # -----------------------------
         # Users
@@ -44,10 +44,17 @@ def seed_data(db: Session = Depends(get_db)):
             ),
         ]
 
+        # No user on this request, so db is shard 0. Logins find users
+        # through the directory, so register them as crud.create_user does
+        # (this also fixes up users seeded before they were registered).
         for user in users:
             existing = db.query(models.User).filter_by(email=user.email).first()
             if not existing:
                 db.add(user)
+                db.flush()
+                existing = user
+            shards.register_user(directory, existing.id, 0, existing.email)
+        directory.commit()
         db.commit()
 
         ella = db.query(models.User).filter_by(email="ella@flashed.app").first()
@@ -75,7 +82,8 @@ def seed_data(db: Session = Depends(get_db)):
             for gym_name in gym_names:
                 exists = db.query(models.Gym).filter_by(user_id=user.id, name=gym_name).first()
                 if not exists:
-                    db.add(models.Gym(name=gym_name, user_id=user.id))
+                    catalog_id, _ = gym_catalog.find_or_create(gym_name)
+                    db.add(models.Gym(name=gym_name, user_id=user.id, catalog_id=catalog_id))
 
         # -----------------------------
         # Project
@@ -102,7 +110,9 @@ def seed_data(db: Session = Depends(get_db)):
 
     except IntegrityError:
         db.rollback()
+        directory.rollback()
         raise HTTPException(status_code=400, detail="Seed failed due to duplicate entries.")
     except Exception as e:
         db.rollback()
+        directory.rollback()
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
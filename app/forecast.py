@@ -0,0 +1,254 @@
+"""
+Grade progression forecasts.
+
+A nightly batch fits a trend to every active user's weekly level and
+stores the result in ``grade_forecasts``. ``/stats/forecast`` then reads
+one row by primary key.
+
+The weekly level is the FORECAST_PERCENTILE of that week's
+internal_grade. 1.0 means the week's max; the 0.9 default is less swayed
+by one lucky send. Only the last FORECAST_WEEKS weeks count. The trend
+is a Theil-Sen fit (median of pairwise slopes), which a few off weeks
+can't drag around the way they would a least-squares line.
+
+Users are fitted in batches of FORECAST_BATCH_USERS. Each batch is a
+(users x weeks) matrix with NaN for weeks without climbs, so a whole
+batch is scored with a handful of array operations. Batches are spread
+over a process pool while the parent streams the next ones from the
+database.
+
+    python -m app.forecast [--workers N]
+    python -m app.forecast benchmark [users]    # synthetic data, no DB
+"""
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from . import models
+from .conversion import TO_DISPLAY, GradeStyle, convert_internal_to_display
+from .database import shard_engines
+
+logger = logging.getLogger(__name__)
+
+FORECAST_WEEKS = int(os.getenv("FORECAST_WEEKS", 26))
+FORECAST_MIN_WEEKS = int(os.getenv("FORECAST_MIN_WEEKS", 4))
+FORECAST_PERCENTILE = float(os.getenv("FORECAST_PERCENTILE", 0.9))
+FORECAST_BATCH_USERS = int(os.getenv("FORECAST_BATCH_USERS", 2000))
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", os.cpu_count() or 1))
+
+# Week 0 is the current (Monday-based) week, 1 the one before, ...
+WEEKLY_LEVELS_SQL = text("""
+    SELECT user_id,
+           (date_trunc('week', now())::date - date_trunc('week', created_at)::date) / 7 AS weeks_ago,
+           percentile_cont(:percentile) WITHIN GROUP (ORDER BY internal_grade) AS level
+      FROM climbs
+     WHERE deleted_at IS NULL
+       AND created_at >= date_trunc('week', now()) - make_interval(weeks => :weeks - 1)
+     GROUP BY 1, 2
+     ORDER BY 1
+""")
+
+
+# -------------------------------------------------
+# Model
+# -------------------------------------------------
+
+_pairs = {}
+
+
+def _pair_indices(weeks: int) -> tuple[np.ndarray, np.ndarray]:
+    if weeks not in _pairs:
+        _pairs[weeks] = np.triu_indices(weeks, 1)
+    return _pairs[weeks]
+
+
+def fit_batch(levels: np.ndarray) -> dict:
+    """
+    ``levels`` is (users, weeks): column w is w weeks before the last,
+    oldest first, NaN where the user didn't climb. Returns per-user
+    arrays: ``level`` (the trend's value for the latest week),
+    ``slope`` (grades per week), ``spread`` (median absolute residual)
+    and ``weeks`` (weeks with data).
+    """
+    users, weeks = levels.shape
+    x = np.arange(weeks, dtype=float) - (weeks - 1)
+    i, j = _pair_indices(weeks)
+    # Every pair of weeks; pairs with a missing week are NaN and ignored
+    slopes = (levels[:, j] - levels[:, i]) / (j - i)
+    slope = np.nanmedian(slopes, axis=1)
+    intercept = np.nanmedian(levels - slope[:, None] * x, axis=1)
+    residuals = levels - (intercept[:, None] + slope[:, None] * x)
+    return {
+        "level": intercept,
+        "slope": slope,
+        "spread": np.nanmedian(np.abs(residuals), axis=1),
+        "weeks": np.count_nonzero(~np.isnan(levels), axis=1),
+    }
+
+
+def _score(user_ids: list[int], levels: np.ndarray) -> list[dict]:
+    # Runs in a pool process: numbers in, rows out, no database
+    fit = fit_batch(levels)
+    return [
+        {
+            "user_id": user_id,
+            "level": float(fit["level"][n]),
+            "slope_per_week": float(fit["slope"][n]),
+            "spread": float(fit["spread"][n]),
+            "weeks_of_data": int(fit["weeks"][n]),
+        }
+        for n, user_id in enumerate(user_ids)
+    ]
+
+
+# -------------------------------------------------
+# Nightly batch
+# -------------------------------------------------
+
+def _batches(conn, weeks: int = FORECAST_WEEKS):
+    """Yields (user_ids, levels matrix) for users with enough weeks of data."""
+    rows = conn.execution_options(yield_per=50_000).execute(
+        WEEKLY_LEVELS_SQL, {"percentile": FORECAST_PERCENTILE, "weeks": weeks},
+    )
+    user_ids, matrix = [], []
+    current, row_levels = None, None
+
+    def flush_user():
+        if current is not None and np.count_nonzero(~np.isnan(row_levels)) >= FORECAST_MIN_WEEKS:
+            user_ids.append(current)
+            matrix.append(row_levels)
+
+    for user_id, weeks_ago, level in rows:
+        if user_id != current:
+            flush_user()
+            if len(user_ids) >= FORECAST_BATCH_USERS:
+                yield user_ids, np.array(matrix)
+                user_ids, matrix = [], []
+            current, row_levels = user_id, np.full(weeks, np.nan)
+        if 0 <= weeks_ago < weeks:
+            row_levels[weeks - 1 - weeks_ago] = level
+    flush_user()
+    if user_ids:
+        yield user_ids, np.array(matrix)
+
+
+def _store(conn, rows: list[dict], computed_at: datetime) -> None:
+    statement = insert(models.GradeForecast)
+    statement = statement.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={
+            "level": statement.excluded.level,
+            "slope_per_week": statement.excluded.slope_per_week,
+            "spread": statement.excluded.spread,
+            "weeks_of_data": statement.excluded.weeks_of_data,
+            "computed_at": statement.excluded.computed_at,
+        },
+    )
+    conn.execute(statement, [{**row, "computed_at": computed_at} for row in rows])
+
+
+def run(workers: int = FORECAST_WORKERS) -> int:
+    scored = 0
+    computed_at = datetime.now(timezone.utc)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for shard, engine in enumerate(shard_engines):
+            with engine.connect() as source, engine.connect() as sink:
+                pending = []
+                for user_ids, levels in _batches(source):
+                    pending.append(pool.submit(_score, user_ids, levels))
+                    # Bounded: the reader stays at most a couple of batches ahead
+                    while len(pending) > 2 * workers:
+                        rows = pending.pop(0).result()
+                        _store(sink, rows, computed_at)
+                        sink.commit()
+                        scored += len(rows)
+                for future in pending:
+                    rows = future.result()
+                    _store(sink, rows, computed_at)
+                    sink.commit()
+                    scored += len(rows)
+            logger.info("forecasts: %s users scored through shard %s", scored, shard)
+    return scored
+
+
+# -------------------------------------------------
+# Reading
+# -------------------------------------------------
+
+def _next_grade(current: int, scale: GradeStyle) -> Optional[int]:
+    # The next internal value that shows as a different grade (V grades
+    # span several internal values)
+    shown = TO_DISPLAY[scale][current]
+    return next((value for value in sorted(TO_DISPLAY[scale]) if value > current and TO_DISPLAY[scale][value] != shown), None)
+
+
+def describe(forecast: models.GradeForecast, scale: GradeStyle, now: Optional[datetime] = None) -> dict:
+    """The stored trend, moved on to today and shown in ``scale``."""
+    now = now or datetime.now(timezone.utc)
+    weeks_since = (now - forecast.computed_at).total_seconds() / (7 * 86400)
+    level = forecast.level + forecast.slope_per_week * weeks_since
+    lowest, highest = min(TO_DISPLAY[scale]), max(TO_DISPLAY[scale])
+    current = min(max(int(np.floor(level)), lowest), highest)
+    next_internal = _next_grade(current, scale)
+
+    weeks_to_next = None
+    if next_internal is not None and forecast.slope_per_week > 0:
+        weeks_to_next = max((next_internal - level) / forecast.slope_per_week, 0.0)
+    return {
+        "current_grade": convert_internal_to_display(current, scale),
+        "next_grade": convert_internal_to_display(next_internal, scale) if next_internal is not None else None,
+        "trend_per_week": round(forecast.slope_per_week, 3),
+        "weeks_to_next": round(weeks_to_next, 1) if weeks_to_next is not None else None,
+        "eta": (now + timedelta(weeks=weeks_to_next)).date() if weeks_to_next is not None else None,
+        "weeks_of_data": forecast.weeks_of_data,
+        "computed_at": forecast.computed_at,
+    }
+
+
+# -------------------------------------------------
+# CLI
+# -------------------------------------------------
+
+def benchmark(users: int = 100_000, workers: int = FORECAST_WORKERS) -> None:
+    """Scores synthetic users through the same batches and pool, without a database."""
+    rng = np.random.default_rng(0)
+    levels = 4 + 0.05 * np.arange(FORECAST_WEEKS) + rng.normal(0, 0.8, (users, FORECAST_WEEKS))
+    levels[rng.random((users, FORECAST_WEEKS)) < 0.4] = np.nan
+    user_ids = list(range(users))
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_score, user_ids[n:n + FORECAST_BATCH_USERS], levels[n:n + FORECAST_BATCH_USERS])
+            for n in range(0, users, FORECAST_BATCH_USERS)
+        ]
+        scored = sum(len(future.result()) for future in futures)
+    elapsed = time.perf_counter() - start
+    print(f"{scored} users x {FORECAST_WEEKS} weeks on {workers} workers: {elapsed:.2f}s ({scored / elapsed:,.0f} users/s)")
+
+
+def main(argv: list[str]) -> None:
+    logging.basicConfig(level=logging.INFO)
+    workers = FORECAST_WORKERS
+    if "--workers" in argv:
+        index = argv.index("--workers")
+        workers = int(argv[index + 1])
+        del argv[index:index + 2]
+    if argv and argv[0] == "benchmark":
+        benchmark(int(argv[1]) if len(argv) > 1 else 100_000, workers)
+    elif not argv:
+        print(f"{run(workers)} forecasts updated")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
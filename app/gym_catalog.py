@@ -0,0 +1,250 @@
+"""
+Shared gym catalog.
+
+Every user used to keep a full copy of each gym they climb at, name and
+``grade_ranges`` included. ``gym_catalog`` holds one entry per real gym,
+matched on the normalized name (lower case, whitespace collapsed). A
+user's ``gyms`` row points at its entry through ``catalog_id`` and keeps
+its own display name. Its ``grade_ranges`` is NULL unless the user set
+bands that differ from the catalog's; it is a per-user override.
+
+The catalog lives in the directory (shard 0), next to ``user_shards``.
+``gyms.catalog_id`` is a plain indexed column with no foreign key, since
+the gyms can be on any shard. A gym's bands come from
+``catalog_ranges``, which is cached once per catalog entry rather than
+once per user's copy. The catalog's id also lets "who climbs here" be
+answered from the ``catalog_id`` index on each shard.
+
+``alembic upgrade head`` dedupes the gyms already in each database. With
+more than one shard, the extra shards end up with catalogs of their own.
+Once every shard is upgraded, and before the new code takes traffic,
+fold them into the directory's catalog:
+
+    python -m app.gym_catalog link
+
+Gyms the old code adds between the upgrade and the deploy have no
+``catalog_id``; run ``link`` once more after the deploy to catalog them.
+
+To change a catalog gym's bands for everyone who hasn't overridden them:
+
+    python -m app.gym_catalog set-ranges <catalog_id> <ranges.json>
+"""
+import json
+import logging
+import os
+import sys
+from typing import Optional
+
+from sqlalchemy import bindparam, select, text, update
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import cache, catalog_namespace, gym_namespace
+from .database import SessionLocal, shard_engines
+
+logger = logging.getLogger(__name__)
+
+# Climber counts fan out to every shard, so they are allowed to be stale
+CATALOG_STATS_TTL_SECONDS = int(os.getenv("CATALOG_STATS_TTL_SECONDS", 300))
+
+# Same rule as normalize_name, for SQL over the gyms table
+NORMALIZED_NAME_SQL = "btrim(regexp_replace(lower({column}), '\\s+', ' ', 'g'))"
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.lower().split())
+
+
+def override(ranges: Optional[list], shared: list) -> Optional[list]:
+    """What a user's gym stores: None unless its bands differ from the catalog's."""
+    if not ranges or ranges == shared:
+        return None
+    return ranges
+
+
+def find_or_create(name: str, grade_ranges: Optional[list] = None) -> tuple[int, list]:
+    """
+    The catalog entry for ``name``. The first user to add a gym seeds it
+    with their bands. Returns (catalog_id, the entry's grade_ranges).
+    """
+    normalized = normalize_name(name)
+    with SessionLocal() as directory:
+        directory.execute(
+            insert(models.GymCatalog)
+              .values(name=name.strip(), normalized_name=normalized, grade_ranges=grade_ranges or [])
+              .on_conflict_do_nothing(index_elements=["normalized_name"])
+        )
+        entry = directory.execute(
+            select(models.GymCatalog.id, models.GymCatalog.grade_ranges)
+              .where(models.GymCatalog.normalized_name == normalized)
+        ).one()
+        directory.commit()
+    return entry.id, entry.grade_ranges
+
+
+def get_entry(catalog_id: int) -> Optional[models.GymCatalog]:
+    with SessionLocal() as directory:
+        return directory.get(models.GymCatalog, catalog_id)
+
+
+def catalog_ranges(catalog_id: Optional[int]) -> list[dict]:
+    # One cache entry per real gym, however many users climb there
+    if catalog_id is None:
+        return []
+    def load():
+        with SessionLocal() as directory:
+            ranges = directory.execute(
+                select(models.GymCatalog.grade_ranges).where(models.GymCatalog.id == catalog_id)
+            ).scalar()
+        return ranges or []
+    return cache.get_or_set(catalog_namespace(catalog_id), "grade_ranges", load)
+
+
+def search(directory: Session, query: str, limit: int = 20) -> list[models.GymCatalog]:
+    # Prefix match on the text_pattern_ops index
+    pattern = normalize_name(query).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return directory.execute(
+        select(models.GymCatalog)
+          .where(models.GymCatalog.normalized_name.like(pattern))
+          .order_by(models.GymCatalog.normalized_name)
+          .limit(limit)
+    ).scalars().all()
+
+
+def climbers(catalog_id: int) -> int:
+    """Users with this gym, across every shard (one index lookup each)."""
+    def load():
+        total = 0
+        for engine in shard_engines:
+            with engine.connect() as conn:
+                total += conn.execute(text(
+                    "SELECT count(DISTINCT user_id) FROM gyms WHERE catalog_id = :catalog_id AND deleted_at IS NULL"
+                ), {"catalog_id": catalog_id}).scalar()
+        return total
+    return cache.get_or_set(catalog_namespace(catalog_id), "climbers", load, ttl=CATALOG_STATS_TTL_SECONDS)
+
+
+# -------------------------------------------------
+# Maintenance
+# -------------------------------------------------
+
+# Bands of the gyms that inherit the catalog's, rebuilt in one statement
+RESYNC_INHERITED_BANDS = [
+    text("""
+        DELETE FROM gym_grade_bands
+         WHERE gym_id IN (SELECT id FROM gyms WHERE catalog_id = :catalog_id AND grade_ranges IS NULL)
+    """),
+    text("""
+        INSERT INTO gym_grade_bands (gym_id, label, grades)
+        SELECT g.id, b.label, int4range(b.lo, b.hi, '[]')
+          FROM gyms g
+         CROSS JOIN jsonb_to_recordset(:ranges) AS b(label text, lo int, hi int)
+         WHERE g.catalog_id = :catalog_id AND g.grade_ranges IS NULL
+    """).bindparams(bindparam("ranges", type_=JSONB)),
+]
+
+
+def set_ranges(catalog_id: int, ranges: list[dict]) -> int:
+    """
+    Changes a catalog gym's bands, and the bands of every user's copy
+    that doesn't override them. Returns how many copies were updated.
+    """
+    with SessionLocal() as directory:
+        found = directory.execute(
+            update(models.GymCatalog).where(models.GymCatalog.id == catalog_id).values(grade_ranges=ranges)
+        ).rowcount
+        directory.commit()
+    if not found:
+        raise ValueError(f"No catalog gym {catalog_id}")
+
+    updated = 0
+    for shard, engine in enumerate(shard_engines):
+        with engine.begin() as conn:
+            # The cached per-gym source (catalog_id, override) is unchanged,
+            # so only the catalog's own entry needs invalidating
+            updated += conn.execute(text(
+                "SELECT count(*) FROM gyms WHERE catalog_id = :catalog_id AND grade_ranges IS NULL"
+            ), {"catalog_id": catalog_id}).scalar()
+            for statement in RESYNC_INHERITED_BANDS:
+                conn.execute(statement, {"catalog_id": catalog_id, "ranges": ranges})
+        logger.info("catalog gym %s: bands resynced on shard %s", catalog_id, shard)
+    cache.invalidate(catalog_namespace(catalog_id))
+    return updated
+
+
+# Matching on the name as well skips any gym already pointing at a
+# directory entry that happens to share the local id
+LINK_GYMS = text(f"""
+    UPDATE gyms
+       SET catalog_id = :catalog_id,
+           grade_ranges = CASE
+               WHEN coalesce(grade_ranges, :local_ranges) = :shared THEN NULL
+               ELSE coalesce(grade_ranges, :local_ranges)
+           END
+     WHERE catalog_id = :local_id
+       AND {NORMALIZED_NAME_SQL.format(column='name')} = :normalized
+    RETURNING id
+""").bindparams(bindparam("local_ranges", type_=JSONB), bindparam("shared", type_=JSONB))
+
+
+# Gyms added without a catalog entry, e.g. by the old code mid-deploy.
+# Their own bands stay the effective ones (kept unless they match).
+LINK_UNCATALOGED_GYM = text("""
+    UPDATE gyms SET catalog_id = :catalog_id, grade_ranges = :ranges
+     WHERE id = :id AND catalog_id IS NULL
+""").bindparams(bindparam("ranges", type_=JSONB(none_as_null=True)))
+
+
+def link() -> int:
+    """
+    Moves each extra shard's migration-built catalog into the directory's.
+    Gyms are re-pointed at the directory entry with the same normalized
+    name. Bands that only matched the shard's entry become overrides, so
+    no gym's effective bands change. Then, on every shard, gyms with no
+    catalog entry get one. Safe to run again.
+    """
+    linked = 0
+    for shard, engine in enumerate(shard_engines):
+        gym_ids = []
+        with engine.begin() as conn:
+            if shard != 0:
+                local = conn.execute(text("SELECT id, name, normalized_name, grade_ranges FROM gym_catalog")).all()
+                for local_id, name, normalized, ranges in local:
+                    catalog_id, shared = find_or_create(name, ranges)
+                    gym_ids += conn.execute(LINK_GYMS, {
+                        "catalog_id": catalog_id, "local_id": local_id, "normalized": normalized,
+                        "local_ranges": ranges, "shared": shared,
+                    }).scalars().all()
+                conn.execute(text("DELETE FROM gym_catalog"))
+                logger.info("shard %s: %s catalog entries folded into the directory", shard, len(local))
+
+            uncataloged = conn.execute(text("SELECT id, name, grade_ranges FROM gyms WHERE catalog_id IS NULL")).all()
+            for gym_id, name, ranges in uncataloged:
+                catalog_id, shared = find_or_create(name, ranges)
+                conn.execute(LINK_UNCATALOGED_GYM, {"id": gym_id, "catalog_id": catalog_id, "ranges": override(ranges, shared)})
+                gym_ids.append(gym_id)
+            if uncataloged:
+                logger.info("shard %s: %s uncataloged gyms linked", shard, len(uncataloged))
+        # Their cached (catalog_id, override) pairs point at the old ids
+        for gym_id in gym_ids:
+            cache.invalidate(gym_namespace(gym_id))
+        linked += len(gym_ids)
+    return linked
+
+
+def main(argv: list[str]) -> None:
+    logging.basicConfig(level=logging.INFO)
+    if argv == ["link"]:
+        print(f"{link()} gyms linked")
+    elif len(argv) == 3 and argv[0] == "set-ranges":
+        with open(argv[2]) as f:
+            ranges = json.load(f)
+        print(f"{set_ranges(int(argv[1]), ranges)} gyms updated")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,165 @@
+"""
+Liveness, readiness and warmup.
+
+* ``/healthz`` answers as long as the process is serving requests.
+* ``/readyz`` is 503 until the startup warmup has finished, and whenever
+  a database shard can't be reached. Its body reports the numbers
+  behind that: DB round-trip times, pool saturation, the queues in front
+  of the bcrypt routes, the cache and the replica.
+
+The warmup runs in a background thread at startup so ``/healthz`` is
+up straight away. It opens WARMUP_CONNECTIONS connections per engine at
+once and hands them back to the pool, so the first requests after a
+deploy don't each pay for a TCP + auth handshake. It also loads the
+bcrypt backend and pings the cache.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack
+from typing import Optional
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+
+from . import admission
+from .cache import cache
+from .database import replica_engine, replica_health, shard_engines
+from .revocation import revocations
+from .utils import hash_password
+
+logger = logging.getLogger(__name__)
+
+# Connections to open per engine during warmup; defaults to the pool size
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", 0))
+# Readiness fails if a shard's SELECT 1 takes longer than this
+READY_MAX_DB_SECONDS = float(os.getenv("READY_MAX_DB_SECONDS", 1))
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", 2))
+
+router = APIRouter()
+
+
+class WarmupState:
+    def __init__(self):
+        self.ready = False
+        self.started_at: Optional[float] = None
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+
+warmup_state = WarmupState()
+
+
+def _pool_stats(engine) -> dict:
+    pool = engine.pool
+    stats = {"class": type(pool).__name__}
+    # NullPool/StaticPool have no sizing
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    if "size" in stats and "checkedout" in stats:
+        capacity = stats["size"] + max(getattr(pool, "_max_overflow", 0), 0)
+        stats["saturation"] = round(stats["checkedout"] / capacity, 3) if capacity else None
+    return stats
+
+
+def _warm_engine(engine) -> int:
+    count = WARMUP_CONNECTIONS or getattr(engine.pool, "size", lambda: 1)()
+    # Hold them all at once so the pool really grows to ``count``
+    with ExitStack() as stack:
+        for _ in range(count):
+            conn = stack.enter_context(engine.connect())
+            conn.execute(text("SELECT 1"))
+    return count
+
+
+def warmup() -> bool:
+    if warmup_state.started_at is None:
+        warmup_state.started_at = time.monotonic()
+    try:
+        for shard, engine in enumerate(shard_engines):
+            opened = _warm_engine(engine)
+            logger.info("warmup: %s connections open on shard %s", opened, shard)
+        if replica_engine is not None:
+            try:
+                _warm_engine(replica_engine)
+            except Exception:
+                # Reads fall back to the primary; not a reason to stay unready
+                logger.warning("warmup: replica unreachable", exc_info=True)
+            replica_health.check()
+        # passlib picks and self-tests the bcrypt backend on first use
+        hash_password("warmup")
+        cache.ping()
+        warmup_state.ready = True
+        warmup_state.error = None
+    except Exception as e:
+        warmup_state.error = str(e).splitlines()[0]
+        logger.warning("warmup failed, retrying in %ss: %s", WARMUP_RETRY_SECONDS, warmup_state.error)
+    finally:
+        warmup_state.seconds = round(time.monotonic() - warmup_state.started_at, 3)
+    return warmup_state.ready
+
+
+def _warm_until_ready() -> None:
+    # A database that's still starting shouldn't leave the worker unready for good
+    while not warmup():
+        time.sleep(WARMUP_RETRY_SECONDS)
+
+
+def start_warmup() -> threading.Thread:
+    thread = threading.Thread(target=_warm_until_ready, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def _check_db(engine) -> dict:
+    start = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        return {"ok": False, "error": str(e).splitlines()[0]}
+    latency = time.perf_counter() - start
+    return {"ok": latency <= READY_MAX_DB_SECONDS, "latency_ms": round(latency * 1000, 2)}
+
+
+@router.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+def readyz():
+    shards = []
+    for shard, engine in enumerate(shard_engines):
+        shards.append({"shard": shard, **_check_db(engine), "pool": _pool_stats(engine)})
+
+    replica = None
+    if replica_engine is not None:
+        replica = {
+            "healthy": replica_health.check(),
+            "lag_seconds": replica_health.lag_seconds,
+            "pool": _pool_stats(replica_engine),
+        }
+
+    ready = warmup_state.ready and all(shard["ok"] for shard in shards)
+    body = {
+        "status": "ready" if ready else "not ready",
+        "warmup": {
+            "done": warmup_state.ready,
+            "seconds": warmup_state.seconds,
+            "error": warmup_state.error,
+        },
+        "database": shards,
+        "replica": replica,
+        # Queues in front of the bcrypt-heavy routes
+        "password_hashing": {route: limiter.stats() for route, limiter in admission.limiters.items()},
+        "cache": {
+            "reachable": cache.ping(),
+            "available": cache.available,
+            "revocation_list_loaded": revocations.rebuilt_at != float("-inf"),
+        },
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
@@ -0,0 +1,280 @@
+"""
+Logbook imports from CSV.
+
+The upload is streamed into ``climb_import_chunks`` on the user's shard,
+IMPORT_SPOOL_CHUNK_BYTES at a time (never held in memory whole), in the
+transaction that queues the ``import_climbs`` job. Any node's workers can
+run the job. It reads the file back chunk by chunk and row by
+row, validates and converts grades in chunks of IMPORT_CHUNK_ROWS, and
+COPYs each chunk into a temp staging table. Once the whole file is staged
+it merges the rows into ``climbs`` in the same transaction. An import
+either lands completely or not at all, and progress is written to its
+``climb_imports`` row after every chunk.
+
+Expected columns (header row, case-insensitive):
+
+    grade, scale            required; scale is VScale, Font or Gym
+    date                    optional ISO date/datetime, defaults to now
+    attempts                optional, defaults to 1
+    gym                     optional gym name; required for Gym-scale rows
+
+Re-importing the same dated rows is a no-op: a dated row matching an
+existing climb (same time, grade and scale) is counted as a duplicate.
+"""
+import csv
+import io
+import os
+from datetime import date, datetime, timezone
+from typing import BinaryIO, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, text, update
+from sqlalchemy.orm import Session
+
+from . import jobs, models, partitions
+from .cache import user_namespace
+from .conversion import GradeStyle, convert_grade_to_internal, label_to_internal
+from .database import record_writes
+
+IMPORT_SPOOL_CHUNK_BYTES = int(os.getenv("IMPORT_SPOOL_CHUNK_BYTES", 1024 * 1024))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", 50 * 1024 * 1024))
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", 5000))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", 100))
+
+REQUIRED_COLUMNS = {"grade", "scale"}
+SCALES = {GradeStyle.VSCALE.value, GradeStyle.FONT.value, "Gym"}
+
+STAGING_COLUMNS = ("line", "gym_id", "internal_grade", "original_grade", "original_scale", "attempts", "created_at")
+
+CREATE_STAGING_SQL = text("""
+    CREATE TEMP TABLE climb_import_staging (
+        line           integer,
+        gym_id         integer,
+        internal_grade double precision NOT NULL,
+        original_grade text NOT NULL,
+        original_scale varchar(50) NOT NULL,
+        attempts       integer NOT NULL,
+        created_at     timestamptz
+    ) ON COMMIT DROP
+""")
+
+# Dated rows that already exist are skipped so a re-upload is harmless;
+# the lookup rides ix_climbs_user_id_created_at.
+MERGE_SQL = text("""
+    INSERT INTO climbs (user_id, gym_id, internal_grade, original_grade, original_scale, attempts, created_at)
+    SELECT :user_id, s.gym_id, s.internal_grade, s.original_grade, s.original_scale, s.attempts,
+           COALESCE(s.created_at, now())
+      FROM climb_import_staging s
+     WHERE s.created_at IS NULL OR NOT EXISTS (
+            SELECT 1 FROM climbs c
+             WHERE c.user_id = :user_id
+               AND c.created_at = s.created_at
+               AND c.original_grade = s.original_grade
+               AND c.original_scale = s.original_scale
+               AND c.deleted_at IS NULL
+           )
+     ORDER BY s.line
+""")
+
+
+class ImportFileError(ValueError):
+    """A problem with the file as a whole (not a single row)."""
+
+
+READ_CHUNK_SQL = text("SELECT data FROM climb_import_chunks WHERE import_id = :import_id AND seq = :seq")
+
+
+def spool_upload(db: Session, import_id: int, upload: BinaryIO) -> int:
+    """
+    Stores an upload as the import's chunks, in the caller's transaction.
+    Returns an estimated row count (lines minus the header).
+    """
+    size = lines = seq = 0
+    while chunk := upload.read(IMPORT_SPOOL_CHUNK_BYTES):
+        size += len(chunk)
+        if size > IMPORT_MAX_BYTES:
+            raise HTTPException(413, f"Import files are limited to {IMPORT_MAX_BYTES} bytes")
+        lines += chunk.count(b"\n")
+        db.execute(insert(models.ClimbImportChunk).values(import_id=import_id, seq=seq, data=chunk))
+        seq += 1
+    if size == 0:
+        raise HTTPException(400, "Empty file")
+    return max(lines - 1, 0)
+
+
+def discard_upload(db: Session, import_id: int) -> None:
+    db.execute(delete(models.ClimbImportChunk).where(models.ClimbImportChunk.import_id == import_id))
+    db.commit()
+
+
+class ChunkReader(io.RawIOBase):
+    """An import's stored upload as a file, one chunk fetched at a time."""
+
+    def __init__(self, conn, import_id: int):
+        self.conn = conn
+        self.import_id = import_id
+        self.seq = 0
+        self.chunk = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.chunk:
+            data = self.conn.execute(READ_CHUNK_SQL, {"import_id": self.import_id, "seq": self.seq}).scalar()
+            if data is None:
+                return 0
+            self.chunk, self.seq = memoryview(bytes(data)), self.seq + 1
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+
+def _set_progress(db: Session, import_id: int, **values) -> None:
+    # Core UPDATE: progress writes shouldn't invalidate the user's caches
+    db.execute(update(models.ClimbImport).where(models.ClimbImport.id == import_id).values(**values))
+    db.commit()
+
+
+def _parse_date(value: str) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class RowConverter:
+    """Validates CSV rows and turns them into staging tuples."""
+
+    def __init__(self, gyms: list[models.Gym]):
+        # Plain values: the progress commits would expire the Gym objects
+        self.gyms = {gym.name.strip().lower(): (gym.id, gym.effective_grade_ranges) for gym in gyms}
+        self.months: set[date] = set()
+
+    def convert(self, line: int, row: dict) -> tuple:
+        grade = (row.get("grade") or "").strip()
+        scale = (row.get("scale") or "").strip()
+        if not grade:
+            raise ValueError("Missing grade")
+        if scale not in SCALES:
+            raise ValueError(f"Unknown scale '{scale}'")
+
+        gym_id, grade_ranges = None, []
+        gym_name = (row.get("gym") or "").strip()
+        if gym_name:
+            if gym_name.lower() not in self.gyms:
+                raise ValueError(f"Unknown gym '{gym_name}'")
+            gym_id, grade_ranges = self.gyms[gym_name.lower()]
+
+        if scale == "Gym":
+            if not grade_ranges:
+                raise ValueError("Gym-scale grades need a gym with grade ranges")
+            internal = label_to_internal(grade, grade_ranges)
+        else:
+            internal = convert_grade_to_internal(grade, GradeStyle(scale))
+
+        attempts = int(row.get("attempts") or 1)
+        if attempts < 1:
+            raise ValueError("attempts must be at least 1")
+
+        created_at = _parse_date((row.get("date") or "").strip())
+        if created_at is not None:
+            self.months.add(partitions.month_start(created_at.date()))
+
+        return (line, gym_id, internal, grade, scale, attempts, created_at)
+
+
+def _copy_chunk(conn, chunk: list[tuple]) -> None:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(chunk)
+    # Unquoted empty fields are NULL in COPY's csv format
+    sql = f"COPY climb_import_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    cursor = conn.connection.cursor()
+    try:
+        if conn.dialect.driver == "psycopg":
+            # psycopg 3 (postgresql+psycopg://) has no copy_expert
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+        else:
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+    finally:
+        cursor.close()
+
+
+def run_import(db: Session, import_id: int) -> dict:
+    record = db.get(models.ClimbImport, import_id)
+    if record is None:
+        return {"status": "missing"}
+    user_id = record.user_id
+    gyms = db.query(models.Gym).filter(models.Gym.user_id == user_id, models.Gym.deleted_at.is_(None)).all()
+    converter = RowConverter(gyms)
+    _set_progress(db, import_id, status="running")
+    # The job runs on the user's shard; COPY and merge go to the same one
+    engine = db.get_bind()
+
+    processed = error_count = 0
+    errors: list[dict] = []
+    try:
+        with engine.begin() as conn:
+            file = io.TextIOWrapper(io.BufferedReader(ChunkReader(conn, import_id)), encoding="utf-8-sig", newline="")
+            conn.execute(CREATE_STAGING_SQL)
+            reader = csv.DictReader(file)
+            reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+            missing = REQUIRED_COLUMNS - set(reader.fieldnames)
+            if missing:
+                raise ImportFileError(f"Missing columns: {', '.join(sorted(missing))}")
+
+            chunk: list[tuple] = []
+            for row in reader:
+                processed += 1
+                try:
+                    chunk.append(converter.convert(reader.line_num, row))
+                except ValueError as e:
+                    error_count += 1
+                    if len(errors) < IMPORT_MAX_ERRORS:
+                        errors.append({"line": reader.line_num, "error": str(e)})
+                if processed % IMPORT_CHUNK_ROWS == 0:
+                    _copy_chunk(conn, chunk)
+                    chunk = []
+                    _set_progress(db, import_id, processed_rows=processed, error_count=error_count)
+            if chunk:
+                _copy_chunk(conn, chunk)
+
+            # Back-dated rows go straight into their own month partitions
+            # rather than piling up in climbs_default
+            if converter.months:
+                partitions.ensure_month_partitions(engine, converter.months)
+
+            staged = conn.execute(text("SELECT count(*) FROM climb_import_staging")).scalar()
+            imported = conn.execute(MERGE_SQL, {"user_id": user_id}).rowcount
+            if imported:
+                jobs.enqueue(
+                    conn, "refresh_user_stats", {"user_id": user_id},
+                    dedupe_key=f"refresh_user_stats:{user_id}",
+                )
+    except Exception as e:
+        db.rollback()
+        _set_progress(
+            db, import_id, status="failed", processed_rows=processed, error_count=error_count + 1,
+            errors=errors + [{"line": None, "error": str(e)}], finished_at=datetime.now(timezone.utc),
+        )
+        if isinstance(e, ImportFileError):
+            return {"status": "failed", "error": str(e)}
+        raise
+
+    if imported:
+        record_writes([user_namespace(user_id)])
+    summary = {
+        "processed_rows": processed,
+        "imported_rows": imported,
+        "duplicate_rows": staged - imported,
+        "error_count": error_count,
+    }
+    _set_progress(
+        db, import_id, status="done", errors=errors, finished_at=datetime.now(timezone.utc), **summary,
+    )
+    return {"status": "done", **summary}
@@ -0,0 +1,294 @@
+"""
+Postgres-backed background jobs.
+
+Write routes enqueue follow-up work in their own transaction, so a job
+exists if and only if the write committed. Workers claim jobs with
+``FOR UPDATE SKIP LOCKED``: any number of them can poll the same table
+without blocking each other or running a job twice.
+
+Handlers are registered with ``@job("kind")`` (see app/tasks.py) and get
+their own session plus the job payload. A failing job is retried with
+exponential backoff until ``max_attempts``, then marked ``failed``. Jobs
+left ``running`` by a crashed worker are re-queued after JOB_LEASE_SECONDS.
+A job that would go back in the queue while another queued job has the
+same ``dedupe_key`` is marked ``superseded`` instead: the queued one does
+the same work, and only one of them may be queued at a time.
+
+With several shards (app/shards.py) each shard has its own jobs table,
+written in the same transaction as the rows that queued the job; workers
+poll every shard in turn.
+
+Workers run as threads inside each API process (JOBS_IN_PROCESS_WORKERS,
+0 to disable) and/or separately:
+
+    python -m app.jobs [--workers N]
+"""
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import traceback
+from typing import Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import shard_sessions
+
+logger = logging.getLogger(__name__)
+
+JOBS_IN_PROCESS_WORKERS = int(os.getenv("JOBS_IN_PROCESS_WORKERS", 1))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", 1))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 300))
+JOB_MAX_BACKOFF_SECONDS = int(os.getenv("JOB_MAX_BACKOFF_SECONDS", 3600))
+
+handlers: dict[str, Callable[[Session, dict], Optional[dict]]] = {}
+default_max_attempts: dict[str, int] = {}
+
+
+def job(kind: str, max_attempts: int = 5):
+    def register(func):
+        handlers[kind] = func
+        default_max_attempts[kind] = max_attempts
+        return func
+    return register
+
+
+def enqueue(
+    db: Session,
+    kind: str,
+    payload: Optional[dict] = None,
+    dedupe_key: Optional[str] = None,
+    delay_seconds: float = 0,
+    max_attempts: Optional[int] = None,
+) -> Optional[int]:
+    """
+    Adds a job to the caller's transaction; it becomes visible to workers
+    when the caller commits. Returns the job id, or None when a queued job
+    with the same ``dedupe_key`` already exists.
+    """
+    values = {
+        "kind": kind,
+        "payload": payload or {},
+        "status": "queued",
+        "dedupe_key": dedupe_key,
+        "max_attempts": max_attempts or default_max_attempts.get(kind, 5),
+    }
+    if delay_seconds:
+        values["run_after"] = text("now() + make_interval(secs => :delay)").bindparams(delay=delay_seconds)
+    statement = insert(models.Job).values(**values)
+    if dedupe_key is not None:
+        statement = statement.on_conflict_do_nothing(
+            index_elements=["dedupe_key"],
+            index_where=text("status = 'queued' AND dedupe_key IS NOT NULL"),
+        )
+    return db.execute(statement.returning(models.Job.id)).scalar()
+
+
+CLAIM_SQL = text("""
+    UPDATE jobs
+       SET status = 'running', attempts = attempts + 1, locked_at = now(), locked_by = :worker
+     WHERE id = (
+            SELECT id FROM jobs
+             WHERE status = 'queued' AND run_after <= now()
+             ORDER BY run_after
+             LIMIT 1
+             FOR UPDATE SKIP LOCKED
+           )
+ RETURNING id, kind, payload, attempts, max_attempts
+""")
+
+STALE_SQL = text("""
+    SELECT id FROM jobs
+     WHERE status = 'running' AND locked_at < now() - make_interval(secs => :lease)
+     ORDER BY id
+       FOR UPDATE SKIP LOCKED
+""")
+
+REQUEUE_SQL = text("""
+    UPDATE jobs
+       SET status = 'queued', last_error = coalesce(:error, last_error), locked_at = NULL, locked_by = NULL,
+           run_after = now() + make_interval(secs => :backoff)
+     WHERE id = :id
+""")
+
+SUPERSEDE_SQL = text("""
+    UPDATE jobs
+       SET status = 'superseded', last_error = coalesce(:error, last_error), locked_at = NULL, locked_by = NULL,
+           finished_at = now()
+     WHERE id = :id
+""")
+
+
+def _finish(sessions, job_id: int, result: Optional[dict]) -> None:
+    with sessions() as db:
+        db.execute(text(
+            "UPDATE jobs SET status = 'done', result = CAST(:result AS jsonb), "
+            "finished_at = now(), locked_at = NULL, locked_by = NULL WHERE id = :id"
+        ), {"id": job_id, "result": _json(result)})
+        db.commit()
+
+
+def _requeue(db: Session, job_id: int, backoff: float = 0, error: Optional[str] = None) -> str:
+    """
+    Puts a job back in the queue, in the caller's transaction. If a job with
+    the same dedupe_key was queued meanwhile, ix_jobs_dedupe_key refuses the
+    update and this one is marked superseded. Returns the new status.
+    """
+    params = {"id": job_id, "backoff": backoff, "error": error}
+    try:
+        # A savepoint, so the conflict doesn't abort the caller's other rows
+        with db.begin_nested():
+            db.execute(REQUEUE_SQL, params)
+        return "queued"
+    except IntegrityError:
+        db.execute(SUPERSEDE_SQL, params)
+        return "superseded"
+
+
+def _fail(sessions, job_id: int, attempts: int, max_attempts: int, error: str) -> None:
+    error = error[-4000:]
+    with sessions() as db:
+        if attempts < max_attempts:
+            _requeue(db, job_id, backoff=min(JOB_MAX_BACKOFF_SECONDS, 2 ** attempts), error=error)
+        else:
+            db.execute(text(
+                "UPDATE jobs SET status = 'failed', last_error = :error, locked_at = NULL, locked_by = NULL, "
+                "finished_at = now() WHERE id = :id"
+            ), {"id": job_id, "error": error})
+        db.commit()
+
+
+def _json(value) -> Optional[str]:
+    return None if value is None else json.dumps(value)
+
+
+_shard_turns = itertools.count()
+
+
+def run_one(worker_id: str) -> bool:
+    """Claims and runs a single job. Returns False when every queue is empty."""
+    # Start from a different shard each time so one busy shard can't starve the rest
+    start = next(_shard_turns) % len(shard_sessions)
+    order = shard_sessions[start:] + shard_sessions[:start]
+    return any(_run_one(sessions, worker_id) for sessions in order)
+
+
+def _run_one(sessions, worker_id: str) -> bool:
+    with sessions() as db:
+        claimed = db.execute(CLAIM_SQL, {"worker": worker_id}).first()
+        db.commit()
+    if claimed is None:
+        return False
+
+    handler = handlers.get(claimed.kind)
+    if handler is None:
+        _fail(sessions, claimed.id, claimed.max_attempts, claimed.max_attempts, f"No handler for job kind '{claimed.kind}'")
+        return True
+
+    try:
+        # The handler's session is on the shard the job was queued on
+        with sessions() as db:
+            result = handler(db, claimed.payload)
+            db.commit()
+    except Exception:
+        logger.exception("job %s (%s) failed", claimed.id, claimed.kind)
+        _fail(sessions, claimed.id, claimed.attempts, claimed.max_attempts, traceback.format_exc())
+    else:
+        _finish(sessions, claimed.id, result)
+    return True
+
+
+def requeue_stale() -> int:
+    count = 0
+    for sessions in shard_sessions:
+        with sessions() as db:
+            # One at a time, so a dedupe conflict only supersedes its own job
+            for job_id in db.execute(STALE_SQL, {"lease": JOB_LEASE_SECONDS}).scalars().all():
+                _requeue(db, job_id)
+                count += 1
+            db.commit()
+    return count
+
+
+class Worker(threading.Thread):
+    def __init__(self, index: int = 0):
+        super().__init__(name=f"job-worker-{index}", daemon=True)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                ran = run_one(self.worker_id)
+            except Exception:
+                logger.exception("job worker %s could not poll", self.worker_id)
+                ran = False
+            if not ran:
+                self.stopping.wait(JOB_POLL_INTERVAL_SECONDS)
+
+    def stop(self):
+        self.stopping.set()
+
+
+class _Reaper(Worker):
+    def run(self):
+        while not self.stopping.wait(JOB_LEASE_SECONDS / 2):
+            try:
+                requeue_stale()
+            except Exception:
+                logger.exception("could not requeue stale jobs")
+
+
+_workers: list[Worker] = []
+
+
+def start_workers(count: int = JOBS_IN_PROCESS_WORKERS) -> list[Worker]:
+    # Registers the handlers
+    from . import tasks  # noqa: F401
+
+    if count <= 0:
+        return []
+    for index in range(count):
+        _workers.append(Worker(index))
+    _workers.append(_Reaper(count))
+    for worker in _workers:
+        worker.start()
+    return _workers
+
+
+def stop_workers(timeout: float = 10) -> None:
+    for worker in _workers:
+        worker.stop()
+    for worker in _workers:
+        worker.join(timeout)
+    _workers.clear()
+
+
+def main(argv: list[str]) -> None:
+    logging.basicConfig(level=logging.INFO)
+    count = 1
+    if "--workers" in argv:
+        count = int(argv[argv.index("--workers") + 1])
+
+    start_workers(count)
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+    logger.info("running %d job worker(s)", count)
+    stopped.wait()
+    stop_workers()
+
+
+if __name__ == "__main__":
+    # Go through the package module so handlers registered by app.tasks
+    # land in the same registry the workers read.
+    from app import jobs
+    jobs.main(sys.argv[1:])
@@ -1,8 +1,9 @@
-from fastapi import FastAPI, HTTPException, Depends, Body, Security, Request
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, HTTPException, Depends, Body, Security, Request, UploadFile, File, Query
+from sqlalchemy.orm import Session, joinedload
 from passlib.hash import bcrypt
-from . import models, schemas, crud, dev_routes
-from .database import engine, Base, get_db
+from . import models, schemas, crud, dev_routes, profiling, accounts, forecast, partitions, admission, jobs, coalescer, imports, revocation, shards, health, tracing, gym_catalog
+from .revocation import revocations
+from .database import shard_engines, shard_for_user, Base, get_db, get_read_db, get_directory_db
 from dotenv import load_dotenv
 import os
 from datetime import timedelta, datetime 
@@ -12,14 +13,24 @@ from jose.exceptions import JWTError
 from fastapi.security import OAuth2PasswordBearer
 from .utils import verify_password, hash_password, format_for_display
 from typing import List, Optional
-from sqlalchemy import func, case, cast, Integer
+from sqlalchemy import func, case, cast, Integer, select
 from .auth import get_current_user
-from .conversion import convert_internal_to_display, convert_grade_to_internal, GradeStyle, internal_to_label
+from .cache import cache, user_namespace
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, FileResponse
+from .compression import CompressionMiddleware
+from .conversion import convert_internal_to_display, convert_internals_to_display, convert_grade_to_internal, GradeStyle, internal_to_label, label_to_internal, grade_to_internal_range
 
 
 app = FastAPI()
+app.add_middleware(CompressionMiddleware)
+app.include_router(health.router)
+# Added last so it wraps everything, compression included
+app.add_middleware(tracing.TracingMiddleware)
+tracer = tracing.get_tracer(__name__)
 
-Base.metadata.create_all(bind=engine)
+for shard_engine in shard_engines:
+    Base.metadata.create_all(bind=shard_engine)
 
 ALGORITHM = os.getenv("ALGORITHM")
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -30,6 +41,32 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 if os.getenv("ENV") != "production":
     app.include_router(dev_routes.router)
+    app.include_router(profiling.router)
+    app.add_middleware(profiling.ProfileRequestMiddleware)
+
+@app.on_event("startup")
+def ensure_partitions():
+    # Make sure upcoming months have a climbs partition before traffic arrives
+    for shard_engine in shard_engines:
+        partitions.ensure_climbs_partitions(shard_engine)
+
+@app.on_event("startup")
+def start_job_workers():
+    jobs.start_workers()
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    jobs.stop_workers()
+
+@app.on_event("startup")
+def load_revocations():
+    # Fill the revoked-token filter before the first authed request
+    revocations.sync(force=True)
+
+@app.on_event("startup")
+def start_warmup():
+    # /readyz stays 503 until pools are filled
+    health.start_warmup()
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -53,87 +90,136 @@ def create_refresh_token(data: dict, expires_delta: timedelta = None):
 
 def verify_access_token(token: str = Depends(oauth2_scheme)):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with tracer.start_as_current_span("jwt.decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         user_id: int = payload.get("id")  
-        if username is None or user_id is None:
+        if username is None or user_id is None or payload.get("type") == "refresh":
             raise HTTPException(status_code=401, detail="Invalid authentication token")
-        return {"email": username, "id": user_id}
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication token")
+    # In-memory filter first; the database only sees possible matches
+    with tracer.start_as_current_span("auth.revocation_check"):
+        revoked = revocation.is_revoked(payload)
+    if revoked:
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    tracing.set_root_attributes({"enduser.id": user_id})
+    return {"email": username, "id": user_id, "jti": payload.get("jti"), "fam": payload.get("fam")}
 
 def verify_refresh_token(token: str):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with tracer.start_as_current_span("jwt.decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         user_id: int = payload.get("id")  
-        if username is None or user_id is None:
+        if username is None or user_id is None or payload.get("type") == "access":
             raise HTTPException(status_code=401, detail="Invalid refresh token")
-        return {"email": username, "id": user_id}
+        return {"email": username, "id": user_id, "jti": payload.get("jti"), "fam": payload.get("fam")}
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
 
+def issue_tokens(email: str, user_id: int, family_id: str, refresh_jti: str) -> dict:
+    # Access tokens get their own jti but share the family, so revoking
+    # the family also cuts off access tokens already handed out
+    claims = {"sub": email, "id": user_id, "fam": family_id}
+    with tracer.start_as_current_span("jwt.encode"):
+        access_token = create_access_token(
+            data={**claims, "jti": revocation.new_token_id(), "type": "access"},
+            expires_delta=timedelta(minutes=int(ACCESS_TOKEN_EXPIRE_MINUTES)),
+        )
+        refresh_token = create_refresh_token(
+            data={**claims, "jti": refresh_jti, "type": "refresh"},
+            expires_delta=timedelta(minutes=int(REFRESH_TOKEN_EXPIRE_MINUTES)),
+        )
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+
+
+# Sparse fieldsets
+
+# Response fields computed from other columns
+DERIVED_FIELDS = {
+    "grade": ("internal_grade", "original_scale", "gym_id"),
+    "grade_ranges": ("grade_ranges", "catalog_id"),
+}
+
+# Response fields read from a different attribute than the column
+SPARSE_ATTRIBUTES = {
+    "grade_ranges": "effective_grade_ranges",
+}
+
+def parse_fields(fields: Optional[str], schema) -> Optional[set]:
+    """
+    Parses a ``fields=a,b,c`` query value against a response schema.
+    ``id`` is always included so clients can key the rows.
+    """
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(schema.model_fields)
+    if unknown:
+        raise HTTPException(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+    return requested | {"id"}
+
+def columns_for(fields: Optional[set], model) -> Optional[list]:
+    if fields is None:
+        return None
+    columns = set()
+    for name in fields:
+        columns.update(DERIVED_FIELDS.get(name, (name,)))
+    return [name for name in columns if name in model.__table__.columns]
+
+@tracer.start_as_current_span("serialize")
+def sparse_response(rows, fields: set) -> JSONResponse:
+    return JSONResponse(jsonable_encoder([
+        {name: getattr(row, SPARSE_ATTRIBUTES.get(name, name)) for name in fields} for row in rows
+    ]))
 
 
 # Routes
 
-@app.post("/users/", response_model=schemas.UserResponse)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    existing_user = db.query(models.User).filter(models.User.email == user.email).first()
-    if existing_user:
+@app.post("/users/", response_model=schemas.UserResponse, dependencies=[Depends(admission.guard("signup"))])
+def create_user(user: schemas.UserCreate, db: Session = Depends(get_directory_db)):
+    if shards.shard_for_email(db, user.email) is not None:
         raise HTTPException(status_code=400, detail="Email already registered")
     return crud.create_user(db=db, user=user)
 
-@app.post("/login/")
-def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
-    db_user = crud.authenticate_user(db, user.email, user.password)
+@app.post("/login/", dependencies=[Depends(admission.guard("login"))])
+def login(user: schemas.UserLogin, db: Session = Depends(get_directory_db)):
+    # The directory knows which shard to check the password on
+    with shards.session_for(shards.shard_for_email(db, user.email) or 0) as user_db:
+        db_user = crud.authenticate_user(user_db, user.email, user.password)
     if not db_user:
         raise HTTPException(status_code=401, detail="Invalid email or password")
-    
-    access_token_expires = timedelta(minutes=int(ACCESS_TOKEN_EXPIRE_MINUTES))
-    access_token = create_access_token(
-        data={"sub": db_user.email, "id": db_user.id},
-        expires_delta=access_token_expires
-    )
-    
-    refresh_token_expires = timedelta(minutes=int(REFRESH_TOKEN_EXPIRE_MINUTES))
-    refresh_token = create_refresh_token(
-        data={"sub": db_user.email, "id": db_user.id},
-        expires_delta=refresh_token_expires
-    )
-    
-    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+    family_id, refresh_jti = revocation.start_family(db, db_user.id)
+    db.commit()
+    return issue_tokens(db_user.email, db_user.id, family_id, refresh_jti)
 
 
 @app.post("/refresh-token/")
-def refresh_token(refresh_token: str = Body(...), db: Session = Depends(get_db)):
+def refresh_token(refresh_token: str = Body(...), db: Session = Depends(get_directory_db)):
     if not refresh_token:
         raise HTTPException(status_code=400, detail="Refresh token is required.")
 
-    try:
-        # Verify the refresh token
-        token_data = verify_refresh_token(refresh_token)
-
-        # Issue new access token
-        expires_delta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        new_access_token = create_access_token(
-            data={"sub": token_data["email"], "id": token_data["id"]},
-            expires_delta=expires_delta,
-        )
-
-        # Rotate the refresh token
-        new_refresh_token = create_refresh_token(
-            data={"sub": token_data["email"], "id": token_data["id"]},
-            expires_delta=timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES),
-        )
+    token_data = verify_refresh_token(refresh_token)
+    # Rotates the family's refresh jti; an old token revokes the family
+    family_id, refresh_jti = revocation.rotate(db, token_data, refresh_token)
+    db.commit()
+    return issue_tokens(token_data["email"], token_data["id"], family_id, refresh_jti)
 
-        return {
-            "access_token": new_access_token,
-            "refresh_token": new_refresh_token,
-        }
 
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid or expired refresh token.")
+@app.post("/logout/")
+def logout(token: dict = Depends(verify_access_token), db: Session = Depends(get_directory_db)):
+    """
+    Ends this login: the refresh token and every access token issued in
+    its family stop working.
+    """
+    if token["fam"]:
+        revocation.revoke_family(db, token["fam"], token["id"], "logout")
+        db.commit()
+        revocations.add(token["fam"])
+    return {"message": "Logged out"}
 
 
 @app.get("/protected-route/")
@@ -141,12 +227,31 @@ def protected_route(token: str = Depends(verify_access_token)):
     return {"message": f"Hello, {token}"}
 
 @app.get("/get_user/", response_model=UserResponse)
-def get_user(id: str, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == id).first()
+def get_user(id: int, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    selected = parse_fields(fields, UserResponse)
+    # The snapshot is served from cache, so fields only trims the payload
+    user = user_snapshot_for(db, id)
+    db.release()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    if selected is not None:
+        return JSONResponse({name: user[name] for name in selected})
     return user
 
+def user_snapshot_for(db: Session, user_id: int) -> Optional[dict]:
+    def load_snapshot():
+        # Gyms come back with the user in one query
+        user = db.get(models.User, user_id, options=[joinedload(models.User.active_gyms)])
+        if not user:
+            return None
+        # Built from the columns: from_orm would read user.gyms, lazy-loading
+        # every gym (deleted ones too) only to throw them away
+        values = {name: getattr(user, name) for name in UserResponse.__fields__ if name != "gyms"}
+        response = UserResponse(**values, gyms=[schemas.GymResponse.from_orm(gym) for gym in user.active_gyms])
+        return jsonable_encoder(response)
+
+    return cache.get_or_set(user_namespace(user_id), "snapshot", load_snapshot)
+
 @app.post("/update_user/", response_model=UserResponse)
 def update_user(
     user_id: int = Body(...),
@@ -156,11 +261,12 @@ def update_user(
     updated_user = crud.update_user(db, user_id=user_id, updates=updates)
     return updated_user
 
-@app.post("/change_password/", response_model=dict)
+@app.post("/change_password/", response_model=dict, dependencies=[Depends(admission.guard("change_password"))])
 def change_password(
     data: schemas.ChangePasswordSchema,
     token: dict = Security(verify_access_token),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    directory: Session = Depends(get_directory_db),
 ):
 
     #Get the user from the db
@@ -182,6 +288,11 @@ def change_password(
     user.password_hash = hashed_new_password
     db.commit()
     db.refresh(user)
+    # Sign out every other device; this session keeps going
+    revoked = revocation.revoke_user_families(directory, user_id, "password", keep=token.get("fam"))
+    directory.commit()
+    for family_id in revoked:
+        revocations.add(family_id)
 
 
     return {"message": "Password updated successfully"}
@@ -196,39 +307,68 @@ def add_climb(
     if token.get("id") != user_id:
         raise HTTPException(status_code=403, detail="Not authorized.")
 
-    # Load the gym to get its grade_ranges
+    # Load the gym to get its bands
     gym = db.query(models.Gym).filter(
         models.Gym.id == climb.gym_id,
-        models.Gym.user_id == user_id
+        models.Gym.user_id == user_id,
+        models.Gym.deleted_at.is_(None),
     ).first()
     if not gym:
         raise HTTPException(status_code=404, detail="Gym not found")
 
     # Decide how to convert the grade
-    if climb.scale == "Gym" and gym.grade_ranges:
-        internal_grade = label_to_internal(climb.grade, gym.grade_ranges)
+    if climb.scale == "Gym" and gym.effective_grade_ranges:
+        internal_grade = crud.gym_label_to_internal(db, gym.id, climb.grade)
     else:
         internal_grade = convert_grade_to_internal(climb.grade, GradeStyle(climb.scale))
 
-    db_climb = models.Climb(
+    values = dict(
         user_id=user_id,
         gym_id=climb.gym_id,
         internal_grade=internal_grade,
         original_grade=climb.grade,
         original_scale=climb.scale,
-        attempts=climb.attempts
+        attempts=climb.attempts,
+    )
+    if coalescer.CLIMB_GROUP_COMMIT:
+        # Hand the connection back before waiting on the batch
+        db.close()
+        try:
+            row = coalescer.climb_coalescer(shard_for_user(user_id)).submit(values)
+        except coalescer.GroupCommitTimeout:
+            # Withdrawn unwritten, so a retry can't duplicate it
+            raise HTTPException(status_code=503, detail="Busy, try again", headers={"Retry-After": "1"})
+        except coalescer.GroupCommitPending:
+            # It may still commit: tell the client to look for it rather than resend
+            return JSONResponse(status_code=202, content={
+                "detail": "Climb is still being saved; check /get_climbs/ before sending it again",
+                "status": "pending",
+            })
+    else:
+        db_climb = models.Climb(**values)
+        db.add(db_climb)
+        # Stats are recomputed after the response, in the same transaction as the climb
+        jobs.enqueue(db, "refresh_user_stats", {"user_id": user_id}, dedupe_key=f"refresh_user_stats:{user_id}")
+        db.commit()
+        db.refresh(db_climb)
+        row = {"id": db_climb.id, "created_at": db_climb.created_at}
+
+    return schemas.ClimbResponse(
+        id=row["id"],
+        grade=climb.grade,
+        original_grade=climb.grade,
+        original_scale=climb.scale,
+        attempts=climb.attempts,
+        created_at=row["created_at"],
     )
-    db.add(db_climb)
-    db.commit()
-    db.refresh(db_climb)
-    return db_climb
 
 
 @app.post("/get_climbs/", response_model=List[schemas.ClimbResponse])
 def get_climbs(
     user_id: int,
     filters: schemas.ClimbFilter,
-    db: Session = Depends(get_db),
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db),
     token: dict = Depends(verify_access_token)
 ):
     if token.get("id") != user_id:
@@ -238,81 +378,122 @@ def get_climbs(
     user = db.query(models.User).get(user_id)
     if not user:
         raise HTTPException(404, "User not found")
+    crud.trace_user(db, user_id)
 
-    # Convert requested grade_range filter into internal ints
+    # Convert requested grade filters into internal ints
+    scale = filters.grade_scale or GradeStyle(user.grade_style)
     internal_grade_range = None
-    if filters.grade_range:
-        try:
+    min_internal = max_internal = None
+    try:
+        if filters.grade_range:
             internal_grade_range = [
-                convert_grade_to_internal(g, GradeStyle(user.grade_style))
+                convert_grade_to_internal(g, scale)
                 for g in filters.grade_range
             ]
-        except ValueError as e:
-            raise HTTPException(400, str(e))
-
-    # Fetch climbs (filtered by date + internal_grade_range)
-    climbs = crud.get_user_climbs(db, user_id, filters, internal_grade_range)
-
-    # Build response using the shared helper
-    user_pref = GradeStyle(user.grade_style)
-    result = []
-    for climb in climbs:
-        # load gym_ranges if this climb used a gym scale
-        gym_ranges = None
-        if climb.original_scale == "Gym" and climb.gym_id:
-            gym = db.query(models.Gym).get(climb.gym_id)
-            gym_ranges = gym.grade_ranges if gym else None
-
-        display = format_for_display(
-            internal_grade = climb.internal_grade,
-            original_scale = climb.original_scale,
-            gym_ranges     = gym_ranges or [],
-            user_pref      = user_pref,
-        )
+        if filters.min_grade:
+            min_internal = grade_to_internal_range(filters.min_grade, scale)[0]
+        if filters.max_grade:
+            max_internal = grade_to_internal_range(filters.max_grade, scale)[1]
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if min_internal is not None and max_internal is not None and min_internal > max_internal:
+        raise HTTPException(400, "min_grade is harder than max_grade")
+
+    # Fetch climbs (filtered by date + internal_grade_range) as plain rows
+    # of just the columns the response is built from
+    selected = parse_fields(fields, schemas.ClimbResponse) or set(schemas.ClimbResponse.model_fields)
+    climbs = crud.get_user_climbs(
+        db, user_id, filters, internal_grade_range, columns_for(selected, models.Climb),
+        internal_bounds=(min_internal, max_internal), as_rows=True,
+    )
 
-        result.append(
-            schemas.ClimbResponse(
-                id              = climb.id,
-                grade           = display,
-                original_grade  = climb.original_grade,
-                original_scale  = climb.original_scale,
-                attempts        = climb.attempts,
-                created_at      = climb.created_at,
-            )
+    # Dicts go straight to the encoder, skipping per-row model validation
+    with tracer.start_as_current_span("build_climb_responses", {"rows": len(climbs)}):
+        rows = build_climb_responses(db, climbs, GradeStyle(user.grade_style), selected)
+    db.release()
+    with tracer.start_as_current_span("serialize", {"rows": len(rows)}):
+        return JSONResponse(jsonable_encoder(rows))
+
+
+def display_grades(db: Session, climbs, user_pref: GradeStyle) -> list[str]:
+    """
+    Display grades for a whole result set: one batch conversion for the
+    plain grades, then the (few) gym-scale climbs redone against their
+    gym's bands.
+    """
+    grades = convert_internals_to_display([climb.internal_grade for climb in climbs], user_pref)
+    gym_ranges = {}
+    for index, climb in enumerate(climbs):
+        if climb.original_scale == "Gym" and climb.gym_id:
+            if climb.gym_id not in gym_ranges:
+                gym_ranges[climb.gym_id] = crud.get_gym_ranges(db, climb.gym_id)
+            if gym_ranges[climb.gym_id]:
+                grades[index] = format_for_display(
+                    internal_grade = climb.internal_grade,
+                    original_scale = climb.original_scale,
+                    gym_ranges     = gym_ranges[climb.gym_id],
+                    user_pref      = user_pref,
+                )
+    return grades
+
+
+def build_climb_responses(db: Session, climbs, user_pref: GradeStyle, fields: Optional[set] = None):
+    """
+    Builds ClimbResponse objects, or plain dicts holding only ``fields``
+    when a sparse fieldset was requested. ``climbs`` can be Climb objects
+    or rows from ``get_user_climbs(..., as_rows=True)``.
+    """
+    climbs = list(climbs)
+    grades = [None] * len(climbs)
+    if fields is None or "grade" in fields:
+        grades = display_grades(db, climbs, user_pref)
+
+    if fields is not None:
+        return [
+            {name: display if name == "grade" else getattr(climb, name) for name in fields}
+            for climb, display in zip(climbs, grades)
+        ]
+
+    return [
+        schemas.ClimbResponse(
+            id              = climb.id,
+            grade           = display,
+            original_grade  = climb.original_grade,
+            original_scale  = climb.original_scale,
+            attempts        = climb.attempts,
+            created_at      = climb.created_at,
         )
-
-    return result
-
-
+        for climb, display in zip(climbs, grades)
+    ]
 
 
 @app.post("/average_grade/")
 def average_grade(
     request: schemas.AverageGradeRequest,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     token: dict = Depends(verify_access_token)
 ):
-    user_id = token.get("id")
-    query = db.query(models.Climb).filter(models.Climb.user_id == user_id)
-    
-    if request.start_date:
-        query = query.filter(models.Climb.created_at >= request.start_date)
-    if request.end_date:
-        query = query.filter(models.Climb.created_at <= request.end_date)
-    
-    # Convert V-grade strings to numeric values
-    grade_numeric = case(
-        (models.Climb.grade.like('V%'), cast(func.substr(models.Climb.grade, 2), Integer)),
-        else_=None
-    )
-    
-    avg_grade = query.with_entities(func.avg(grade_numeric)).scalar()
-    
-    # Round the average to the nearest whole number
-    rounded_grade = round(avg_grade) if avg_grade is not None else 0
-    
-    # todo: take in grade style, convert font scale grades - how to average 8a, 8b+, 8c etc
-    return {"average_grade": rounded_grade}
+    crud.trace_user(db, token.get("id"))
+    stats = crud.get_average_grade(db, token.get("id"), request.start_date, request.end_date)
+    db.release()
+    return stats
+
+
+@app.get("/stats/forecast", response_model=schemas.GradeForecastResponse)
+def grade_forecast(
+    db: Session = Depends(get_read_db),
+    token: dict = Depends(verify_access_token),
+):
+    """When the user should reach their next grade, from the nightly trend (app/forecast.py)."""
+    row = db.execute(
+        select(models.GradeForecast, models.User.grade_style)
+          .join(models.User, models.User.id == models.GradeForecast.user_id)
+          .where(models.GradeForecast.user_id == token["id"])
+    ).first()
+    db.release()
+    if row is None:
+        raise HTTPException(404, "No forecast yet: log a few weeks of climbs")
+    return forecast.describe(row[0], GradeStyle(row[1]))
 
 
 @app.get(
@@ -320,14 +501,15 @@ def average_grade(
     response_model=List[schemas.ProjectResponse],
 )
 def read_projects(
-    db: Session = Depends(get_db),
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db),
     token_data: dict = Depends(verify_access_token),
 ):
     user_id = token_data["id"]
-    projects = crud.get_user_projects(db, user_id)
-    if projects is None:
-        raise HTTPException(status_code=404, detail="No projects found")
-    return projects
+    selected = parse_fields(fields, schemas.ProjectResponse) or set(schemas.ProjectResponse.model_fields)
+    projects = crud.get_user_projects(db, user_id, columns_for(selected, models.Project), as_rows=True)
+    db.release()
+    return sparse_response(projects, selected)
 
 @app.post("/add_gym/", response_model=schemas.GymResponse)
 def create_gym_for_user(
@@ -337,9 +519,261 @@ def create_gym_for_user(
 ):
     return crud.create_gym(db, gym, current_user.id)
 
+@app.post("/update_gym/", response_model=schemas.GymResponse)
+def update_gym_for_user(
+    gym_id: int,
+    updates: schemas.GymUpdate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    return crud.update_gym(db, gym_id, current_user.id, updates)
+
 @app.get("/get_gyms/", response_model=List[schemas.GymResponse])
 def read_user_gyms(
-    db: Session = Depends(get_db),
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    return crud.get_user_gyms(db, current_user.id)
+    selected = parse_fields(fields, schemas.GymResponse)
+    gyms = crud.get_user_gyms(db, current_user.id, columns_for(selected, models.Gym))
+    db.release()
+    if selected is not None:
+        return sparse_response(gyms, selected)
+    return gyms
+
+@app.get("/gym_catalog/", response_model=List[schemas.GymCatalogResponse])
+def search_gym_catalog(
+    q: str = Query(..., min_length=2),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_directory_db),
+    token: dict = Depends(verify_access_token),
+):
+    # Shared gyms to pick from before adding one (pass its id as catalog_id)
+    return gym_catalog.search(db, q, limit)
+
+@app.get("/gym_catalog/{catalog_id}", response_model=schemas.GymCatalogResponse)
+def read_catalog_gym(
+    catalog_id: int,
+    db: Session = Depends(get_directory_db),
+    token: dict = Depends(verify_access_token),
+):
+    entry = db.get(models.GymCatalog, catalog_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Catalog gym not found")
+    response = schemas.GymCatalogResponse.from_orm(entry)
+    response.climbers = gym_catalog.climbers(catalog_id)
+    return response
+
+
+@app.post("/delete_climb/")
+def delete_climb(
+    climb_id: int,
+    db: Session = Depends(get_db),
+    token: dict = Depends(verify_access_token),
+):
+    return crud.soft_delete(db, models.Climb, climb_id, token["id"])
+
+@app.post("/delete_gym/")
+def delete_gym(
+    gym_id: int,
+    db: Session = Depends(get_db),
+    token: dict = Depends(verify_access_token),
+):
+    return crud.soft_delete(db, models.Gym, gym_id, token["id"])
+
+@app.post("/delete_project/")
+def delete_project(
+    project_id: int,
+    db: Session = Depends(get_db),
+    token: dict = Depends(verify_access_token),
+):
+    return crud.soft_delete(db, models.Project, project_id, token["id"])
+
+
+@app.post("/import_climbs/", response_model=schemas.ClimbImportResponse, status_code=202)
+def import_climbs(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    token: dict = Depends(verify_access_token),
+):
+    """
+    Queues a CSV logbook import (columns described in app/imports.py).
+    Poll /imports/{id} for progress.
+    """
+    record = models.ClimbImport(user_id=token["id"], filename=file.filename, status="queued")
+    db.add(record)
+    db.flush()
+    # Stored with the record and the job, so any node's workers can run it
+    record.total_rows = imports.spool_upload(db, record.id, file.file)
+    record.job_id = jobs.enqueue(db, "import_climbs", {"import_id": record.id})
+    db.commit()
+    db.refresh(record)
+    return record
+
+@app.get("/imports/{import_id}", response_model=schemas.ClimbImportResponse)
+def import_status(
+    import_id: int,
+    db: Session = Depends(get_db),
+    token: dict = Depends(verify_access_token),
+):
+    # Primary, not the replica: progress is written by the job as it goes
+    record = db.query(models.ClimbImport).filter(
+        models.ClimbImport.id == import_id,
+        models.ClimbImport.user_id == token["id"],
+    ).first()
+    if not record:
+        raise HTTPException(404, "Import not found")
+    return record
+
+
+@app.post("/delete_account/", status_code=202, dependencies=[Depends(admission.guard("delete_account"))])
+def delete_account(
+    data: schemas.DeleteAccountRequest,
+    token: dict = Security(verify_access_token),
+    db: Session = Depends(get_db),
+    directory: Session = Depends(get_directory_db),
+):
+    """
+    Signs the user out everywhere and queues removal of all their data
+    (see app/accounts.py). Export first if they want a copy.
+    """
+    user = db.get(models.User, token["id"])
+    if not user or user.deleted_at is not None:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not verify_password(data.password, user.password_hash):
+        raise HTTPException(status_code=400, detail="Invalid password")
+    accounts.request_deletion(db, directory, user)
+    return {"message": "Account deletion started"}
+
+@app.post("/account_exports/", response_model=schemas.AccountExportResponse, status_code=202)
+def request_account_export(
+    db: Session = Depends(get_db),
+    token: dict = Depends(verify_access_token),
+):
+    record = models.AccountExport(user_id=token["id"], status="queued")
+    db.add(record)
+    db.flush()
+    record.job_id = jobs.enqueue(
+        db, "export_account", {"export_id": record.id}, dedupe_key=f"export_account:{token['id']}",
+    )
+    if record.job_id is None:
+        raise HTTPException(status_code=409, detail="An export is already queued")
+    db.commit()
+    db.refresh(record)
+    return record
+
+def _account_export(db: Session, export_id: int, user_id: int) -> models.AccountExport:
+    record = db.query(models.AccountExport).filter(
+        models.AccountExport.id == export_id,
+        models.AccountExport.user_id == user_id,
+    ).first()
+    if not record:
+        raise HTTPException(404, "Export not found")
+    return record
+
+@app.get("/account_exports/{export_id}", response_model=schemas.AccountExportResponse)
+def account_export_status(
+    export_id: int,
+    db: Session = Depends(get_db),
+    token: dict = Depends(verify_access_token),
+):
+    return _account_export(db, export_id, token["id"])
+
+@app.get("/account_exports/{export_id}/download")
+def download_account_export(
+    export_id: int,
+    db: Session = Depends(get_db),
+    token: dict = Depends(verify_access_token),
+):
+    record = _account_export(db, export_id, token["id"])
+    if record.status != "done" or not record.path:
+        raise HTTPException(409, f"Export is {record.status}")
+    path = record.path
+    db.release()
+    # Already gzip; the compression middleware leaves it alone
+    return FileResponse(path, media_type="application/gzip", filename=f"flashed-export-{export_id}.jsonl.gz")
+
+
+@app.get("/sync", response_model=schemas.SyncResponse)
+def sync(
+    since: Optional[str] = None,
+    db: Session = Depends(get_db),
+    token: dict = Depends(verify_access_token),
+):
+    # Runs on the primary: a lagging replica could hand out a token that
+    # is ahead of the rows it returned.
+    user_id = token["id"]
+    user = db.query(models.User).get(user_id)
+    if not user:
+        raise HTTPException(404, "User not found")
+
+    since_at = crud.decode_sync_token(since) if since else None
+    server_time, changes = crud.get_sync_changes(db, user_id, since_at)
+
+    climbs, deleted_climbs = changes["climbs"]
+    gyms, deleted_gyms = changes["gyms"]
+    projects, deleted_projects = changes["projects"]
+    return schemas.SyncResponse(
+        token=crud.encode_sync_token(server_time),
+        full=since_at is None,
+        climbs=build_climb_responses(db, climbs, GradeStyle(user.grade_style)),
+        gyms=[schemas.GymResponse.from_orm(gym) for gym in gyms],
+        projects=[schemas.ProjectResponse.from_orm(project) for project in projects],
+        deleted=schemas.SyncDeleted(
+            climbs=deleted_climbs,
+            gyms=deleted_gyms,
+            projects=deleted_projects,
+        ),
+    )
+
+
+BOOTSTRAP_SECTIONS = ("user", "gyms", "projects", "climbs", "average_grade")
+
+@app.get(
+    "/bootstrap",
+    response_model=schemas.BootstrapResponse,
+    response_model_exclude_unset=True,
+)
+def bootstrap(
+    include: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    token: dict = Depends(verify_access_token),
+):
+    """
+    Everything the app needs on launch in one round trip: one token decode,
+    one session, one user load. ``include`` is a comma separated subset of
+    BOOTSTRAP_SECTIONS (default: all). The sections run one after another
+    on the same connection; psycopg2 sessions can't run statements
+    concurrently, and most sections are cache hits anyway.
+    """
+    sections = BOOTSTRAP_SECTIONS
+    if include:
+        sections = tuple(part.strip() for part in include.split(",") if part.strip())
+        unknown = set(sections) - set(BOOTSTRAP_SECTIONS)
+        if unknown:
+            raise HTTPException(400, f"Unknown sections: {', '.join(sorted(unknown))}")
+
+    user_id = token["id"]
+    user = db.query(models.User).get(user_id)
+    if not user:
+        raise HTTPException(404, "User not found")
+    crud.trace_user(db, user_id)
+
+    payload = {}
+    if "user" in sections:
+        payload["user"] = user_snapshot_for(db, user_id)
+    if "gyms" in sections:
+        payload["gyms"] = [schemas.GymResponse.from_orm(gym) for gym in crud.get_user_gyms(db, user_id)]
+    if "projects" in sections:
+        payload["projects"] = [
+            schemas.ProjectResponse.from_orm(project) for project in crud.get_user_projects(db, user_id)
+        ]
+    if "climbs" in sections:
+        climbs = crud.get_user_climbs(db, user_id, schemas.ClimbFilter(), None, as_rows=True)
+        with tracer.start_as_current_span("build_climb_responses", {"rows": len(climbs)}):
+            payload["climbs"] = build_climb_responses(db, climbs, GradeStyle(user.grade_style))
+    if "average_grade" in sections:
+        payload["average_grade"] = crud.get_average_grade(db, user_id)["average_grade"]
+    db.release()
+    with tracer.start_as_current_span("serialize"):
+        return schemas.BootstrapResponse(**payload)
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, func, ForeignKey, Boolean, Float
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, func, ForeignKey, Boolean, Float, Index, LargeBinary, text
+from sqlalchemy import DDL, event
 from sqlalchemy.orm import relationship
 from .database import Base
-from sqlalchemy.dialects.postgresql import JSONB, ARRAY
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY, INT4RANGE
 
 
 class User(Base):
@@ -21,35 +22,62 @@ class User(Base):
     onboarding_complete = Column(Boolean, default=False, nullable=False)
     auth_provider = Column(String(20), default='email', nullable=False)
     notifications_enabled = Column(Boolean, default=True, nullable=False)
-    climbs = relationship("Climb", back_populates="user")
-    gyms = relationship("Gym", back_populates="user", cascade="all, delete-orphan")
+    # Set when deletion is requested; app.accounts removes the rows
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
+    # passive_deletes: deleting a User never loads its children; the
+    # foreign keys cascade in the database. Accounts are removed in batches
+    # by app.accounts.delete_account instead.
+    climbs = relationship("Climb", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    gyms = relationship("Gym", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    active_gyms = relationship(
+        "Gym",
+        primaryjoin="and_(User.id == Gym.user_id, Gym.deleted_at.is_(None))",
+        viewonly=True,
+    )
     projects = relationship(
         "Project",
         back_populates="user",
         cascade="all, delete-orphan",
+        passive_deletes=True,
     )
 
 
 class Climb(Base):
     __tablename__ = "climbs"
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    gym_id = Column(Integer, ForeignKey("gyms.id"), nullable=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    gym_id = Column(Integer, ForeignKey("gyms.id"), nullable=True, index=True)
     internal_grade = Column(Float, nullable=False, index=True)
     original_grade = Column(String, nullable=False)
     original_scale = Column(String(50), nullable=False)
     attempts = Column(Integer)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Partition key, so it has to be part of the primary key
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
     user = relationship("User", back_populates="climbs")
     gym  = relationship("Gym", foreign_keys=[gym_id])
 
+    __table_args__ = (
+        Index("ix_climbs_user_id_created_at", "user_id", "created_at"),
+        Index(
+            "ix_climbs_user_id_flashes", "user_id", "created_at",
+            postgresql_where=text("attempts = 1"),
+        ),
+        Index("ix_climbs_user_id_updated_at", "user_id", "updated_at"),
+        Index("ix_climbs_user_id_internal_grade", "user_id", "internal_grade"),
+        Index("ix_climbs_user_id_gym_id_created_at", "user_id", "gym_id", "created_at"),
+        # Monthly partitions are managed by app.partitions
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
 
 class Project(Base):
     __tablename__ = "projects"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     is_active = Column(Boolean, nullable=False, default=True)
     created_at = Column(
         DateTime(timezone=True), server_default=func.now(), nullable=False
@@ -59,21 +87,249 @@ class Project(Base):
     notes = Column(ARRAY(Text), nullable=False, default=list)
     moves = Column(JSONB, nullable=False, default=list)
     sessions = Column(JSONB, nullable=False, default=list)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
     user = relationship("User", back_populates="projects")
 
+    __table_args__ = (
+        Index("ix_projects_user_id_created_at", "user_id", "created_at"),
+        Index("ix_projects_user_id_updated_at", "user_id", "updated_at"),
+    )
+
 class Gym(Base):
     __tablename__ = "gyms"
 
     id            = Column(Integer, primary_key=True, index=True)
     name          = Column(String(100), nullable=False)
-    user_id       = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id       = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     created_at    = Column(DateTime(timezone=True), server_default=func.now())
     is_default    = Column(Boolean, default=False)
+    # gym_catalog is in the directory (shard 0), so no foreign key
+    catalog_id    = Column(Integer, nullable=True, index=True)
     grade_ranges  = Column(
-        JSONB,
-        nullable=False,
-        default=list,
-        doc="List of {label, lo, hi} objects defining this gym’s custom bands"
+        JSONB(none_as_null=True),
+        nullable=True,
+        doc="This user's own {label, lo, hi} bands; NULL uses the catalog gym's"
+    )
+    updated_at    = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    deleted_at    = Column(DateTime(timezone=True), nullable=True)
+
+    user = relationship("User", back_populates="gyms")
+    # Normalized copy of effective_grade_ranges, kept in sync by crud.sync_gym_bands
+    bands = relationship(
+        "GymGradeBand",
+        back_populates="gym",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    __table_args__ = (
+        Index("ix_gyms_user_id_updated_at", "user_id", "updated_at"),
+    )
+
+    @property
+    def effective_grade_ranges(self) -> list:
+        # The user's override, else the catalog gym's (cached per catalog entry)
+        if self.grade_ranges is not None:
+            return self.grade_ranges
+        from .gym_catalog import catalog_ranges
+        return catalog_ranges(self.catalog_id)
+
+
+class GymCatalog(Base):
+    """One row per real gym, shared by every user's ``gyms`` row for it."""
+    __tablename__ = "gym_catalog"
+
+    id              = Column(Integer, primary_key=True)
+    name            = Column(String(100), nullable=False)
+    # Lower case, whitespace collapsed (gym_catalog.normalize_name)
+    normalized_name = Column(String(100), nullable=False, unique=True)
+    grade_ranges    = Column(JSONB, nullable=False, default=list)
+    created_at      = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at      = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    __table_args__ = (
+        # Prefix search (LIKE 'abc%') whatever the database collation
+        Index(
+            "ix_gym_catalog_normalized_name_pattern", "normalized_name",
+            postgresql_ops={"normalized_name": "text_pattern_ops"},
+        ),
     )
 
-    user = relationship("User", back_populates="gyms")
\ No newline at end of file
+
+class GymGradeBand(Base):
+    __tablename__ = "gym_grade_bands"
+
+    id      = Column(Integer, primary_key=True)
+    gym_id  = Column(Integer, ForeignKey("gyms.id", ondelete="CASCADE"), nullable=False)
+    label   = Column(String(100), nullable=False)
+    # Inclusive [lo, hi] band on the internal grade scale
+    grades  = Column(INT4RANGE, nullable=False)
+
+    gym = relationship("Gym", back_populates="bands")
+
+    __table_args__ = (
+        # "which band at this gym contains grade X" (needs btree_gist)
+        Index("ix_gym_grade_bands_gym_id_grades", "gym_id", "grades", postgresql_using="gist"),
+        Index("ix_gym_grade_bands_gym_id_label", "gym_id", "label"),
+    )
+
+
+event.listen(
+    GymGradeBand.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS btree_gist"),
+)
+
+
+class Job(Base):
+    """
+    Durable background job queue, claimed with FOR UPDATE SKIP LOCKED
+    (see app/jobs.py).
+    """
+    __tablename__ = "jobs"
+
+    id           = Column(BigInteger, primary_key=True)
+    kind         = Column(String(100), nullable=False)
+    payload      = Column(JSONB, nullable=False, default=dict)
+    status       = Column(String(20), nullable=False, default="queued")
+    attempts     = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    # At most one queued job per key, so repeated writes don't pile up work
+    dedupe_key   = Column(String(200), nullable=True)
+    run_after    = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    locked_at    = Column(DateTime(timezone=True), nullable=True)
+    locked_by    = Column(String(100), nullable=True)
+    last_error   = Column(Text, nullable=True)
+    result       = Column(JSONB, nullable=True)
+    created_at   = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    finished_at  = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_runnable", "run_after", postgresql_where=text("status = 'queued'")),
+        Index(
+            "ix_jobs_dedupe_key", "dedupe_key", unique=True,
+            postgresql_where=text("status = 'queued' AND dedupe_key IS NOT NULL"),
+        ),
+    )
+
+
+class ClimbImport(Base):
+    """
+    One CSV logbook upload and its progress (see app/imports.py).
+    """
+    __tablename__ = "climb_imports"
+
+    id             = Column(Integer, primary_key=True)
+    user_id        = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    job_id         = Column(BigInteger, nullable=True)
+    filename       = Column(String(255), nullable=True)
+    status         = Column(String(20), nullable=False, default="queued")
+    # Estimated from the line count when the upload is spooled
+    total_rows     = Column(Integer, nullable=False, default=0)
+    processed_rows = Column(Integer, nullable=False, default=0)
+    imported_rows  = Column(Integer, nullable=False, default=0)
+    duplicate_rows = Column(Integer, nullable=False, default=0)
+    error_count    = Column(Integer, nullable=False, default=0)
+    # First IMPORT_MAX_ERRORS bad rows: [{"line": n, "error": "..."}]
+    errors         = Column(JSONB, nullable=False, default=list)
+    created_at     = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    finished_at    = Column(DateTime(timezone=True), nullable=True)
+
+
+class ClimbImportChunk(Base):
+    """
+    The uploaded file of a queued import, in order, until its job has run.
+    Kept in the database so whichever node claims the job can read it.
+    """
+    __tablename__ = "climb_import_chunks"
+
+    import_id = Column(Integer, ForeignKey("climb_imports.id", ondelete="CASCADE"), primary_key=True)
+    seq       = Column(Integer, primary_key=True, autoincrement=False)
+    data      = Column(LargeBinary, nullable=False)
+
+
+class AccountExport(Base):
+    """
+    A full-account archive (gzip JSON lines) built by the export_account
+    job (see app/accounts.py).
+    """
+    __tablename__ = "account_exports"
+
+    id          = Column(Integer, primary_key=True)
+    user_id     = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    job_id      = Column(BigInteger, nullable=True)
+    status      = Column(String(20), nullable=False, default="queued")
+    # Cleared once the file has expired and been removed
+    path        = Column(String(500), nullable=True)
+    size_bytes  = Column(BigInteger, nullable=True)
+    row_counts  = Column(JSONB, nullable=False, default=dict)
+    error       = Column(Text, nullable=True)
+    created_at  = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    expires_at  = Column(DateTime(timezone=True), nullable=True)
+
+
+class GradeForecast(Base):
+    """
+    Latest grade trend per user, rewritten nightly by app.forecast. Levels
+    are on the internal grade scale.
+    """
+    __tablename__ = "grade_forecasts"
+
+    user_id        = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, autoincrement=False)
+    # Trend value for the week of computed_at
+    level          = Column(Float, nullable=False)
+    slope_per_week = Column(Float, nullable=False)
+    # Median absolute residual around the trend
+    spread         = Column(Float, nullable=False)
+    weeks_of_data  = Column(Integer, nullable=False)
+    computed_at    = Column(DateTime(timezone=True), nullable=False)
+
+
+class RefreshTokenFamily(Base):
+    """
+    One login session's chain of refresh tokens; only ``current_jti`` is
+    still valid (see app/revocation.py).
+    """
+    __tablename__ = "refresh_token_families"
+
+    id          = Column(String(32), primary_key=True)
+    # Directory table: users themselves may live on another shard
+    user_id     = Column(Integer, ForeignKey("user_shards.user_id", ondelete="CASCADE"), nullable=False, index=True)
+    current_jti = Column(String(32), nullable=False)
+    created_at  = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    rotated_at  = Column(DateTime(timezone=True), nullable=True)
+    revoked_at  = Column(DateTime(timezone=True), nullable=True)
+
+
+class RevokedToken(Base):
+    """
+    Revoked token families / jtis. Workers sync it into their Bloom filter
+    by ``id``, so it only ever grows between prunes of expired rows.
+    """
+    __tablename__ = "revoked_tokens"
+
+    id         = Column(BigInteger, primary_key=True)
+    token_key  = Column(String(80), nullable=False, unique=True)
+    user_id    = Column(Integer, nullable=True)
+    reason     = Column(String(20), nullable=False)
+    # Past this, every token the entry covers has expired anyway
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class UserShard(Base):
+    """
+    Directory of which shard holds each user's rows (see app/shards.py).
+    Lives on shard 0; ``email`` is here so logins and uniqueness checks
+    don't have to ask every shard.
+    """
+    __tablename__ = "user_shards"
+
+    user_id    = Column(Integer, primary_key=True, autoincrement=False)
+    shard      = Column(Integer, nullable=False, default=0)
+    email      = Column(String(100), nullable=False, unique=True)
+    # Set while app.shards moves the user; their requests get a 503
+    moving     = Column(Boolean, nullable=False, default=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
@@ -0,0 +1,157 @@
+"""
+Maintenance for the month-partitioned ``climbs`` table.
+
+Partitions are named ``climbs_pYYYY_MM`` and cover ``[month, next month)``
+on ``created_at``. A ``climbs_default`` partition catches anything outside
+the created range (e.g. back-dated imports); creating the partition for
+that month later moves those rows across.
+
+Run from cron / a deploy hook:
+
+    python -m app.partitions ensure [months_ahead]
+    python -m app.partitions detach 2024-01 [--drop]
+"""
+import os
+import sys
+from datetime import date, datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+MONTHS_AHEAD = int(os.getenv("CLIMBS_PARTITION_MONTHS_AHEAD", 3))
+LOCK_TIMEOUT = os.getenv("CLIMBS_PARTITION_LOCK_TIMEOUT", "5s")
+
+# Serialises partition DDL between workers that start at the same time
+_ADVISORY_LOCK_KEY = 0x636C696D  # "clim"
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + (month.month - 1) + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"climbs_p{month:%Y_%m}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    return bool(conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('climbs')"
+    )).scalar())
+
+
+def _exists(conn: Connection, name: str) -> bool:
+    return conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None
+
+
+def create_default_partition(conn: Connection) -> None:
+    conn.execute(text("CREATE TABLE IF NOT EXISTS climbs_default PARTITION OF climbs DEFAULT"))
+
+
+def create_month_partition(conn: Connection, month: date) -> bool:
+    """
+    Creates the partition for ``month`` if it is missing, moving any rows
+    for that month out of the default partition first. Returns True when a
+    partition was created.
+    """
+    month = month_start(month)
+    name = partition_name(month)
+    if _exists(conn, name):
+        return False
+
+    lo, hi = month, add_months(month, 1)
+    conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+    conn.execute(text(f"CREATE TABLE {name} (LIKE climbs INCLUDING DEFAULTS)"))
+    # The CHECK lets ATTACH skip its validation scan
+    conn.execute(text(
+        f"ALTER TABLE {name} ADD CONSTRAINT {name}_range "
+        f"CHECK (created_at >= '{lo}' AND created_at < '{hi}')"
+    ))
+    if _exists(conn, "climbs_default"):
+        conn.execute(text(
+            f"WITH moved AS ("
+            f"  DELETE FROM climbs_default"
+            f"  WHERE created_at >= '{lo}' AND created_at < '{hi}'"
+            f"  RETURNING *"
+            f") INSERT INTO {name} SELECT * FROM moved"
+        ))
+    conn.execute(text(
+        f"ALTER TABLE climbs ATTACH PARTITION {name} FOR VALUES FROM ('{lo}') TO ('{hi}')"
+    ))
+    conn.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_range"))
+    return True
+
+
+def ensure_climbs_partitions(engine: Engine, months_ahead: int = MONTHS_AHEAD) -> list[str]:
+    """
+    Makes sure the current month and the next ``months_ahead`` months have
+    their own partitions. Safe to call from every worker on startup.
+    """
+    current = month_start(datetime.utcnow().date())
+    return ensure_month_partitions(engine, [add_months(current, offset) for offset in range(months_ahead + 1)])
+
+
+def ensure_month_partitions(engine: Engine, months: Iterable[date]) -> list[str]:
+    """
+    Creates the partitions for ``months`` that are missing, e.g. the past
+    months a back-dated import is about to write into.
+    """
+    created = []
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return created
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+        create_default_partition(conn)
+        for month in sorted({month_start(month) for month in months}):
+            if create_month_partition(conn, month):
+                created.append(partition_name(month))
+    return created
+
+
+def _attached(conn: Connection, name: str) -> bool:
+    return conn.execute(text(
+        "SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:name) AND inhparent = to_regclass('climbs')"
+    ), {"name": name}).first() is not None
+
+
+def detach_climbs_partition(engine: Engine, month: date, drop: bool = False) -> Optional[str]:
+    """
+    Detaches an old month so it can be archived (pg_dump the table) or
+    dropped. Detaching only touches catalog entries, so it holds the parent
+    lock briefly and never rewrites rows. CONCURRENTLY is not an option
+    while a default partition exists. Returns None if the month isn't
+    attached (a shard with no climbs then, or already detached).
+    """
+    name = partition_name(month_start(month))
+    with engine.begin() as conn:
+        if not _attached(conn, name):
+            return None
+        conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+        conn.execute(text(f"ALTER TABLE climbs DETACH PARTITION {name}"))
+        if drop:
+            conn.execute(text(f"DROP TABLE {name}"))
+    return name
+
+
+if __name__ == "__main__":
+    from .database import shard_engines
+
+    args = sys.argv[1:]
+    if args and args[0] == "ensure":
+        ahead = int(args[1]) if len(args) > 1 else MONTHS_AHEAD
+        for shard, shard_engine in enumerate(shard_engines):
+            for name in ensure_climbs_partitions(shard_engine, ahead):
+                print(f"shard {shard}: created {name}")
+    elif len(args) >= 2 and args[0] == "detach":
+        month = datetime.strptime(args[1], "%Y-%m").date()
+        for shard, shard_engine in enumerate(shard_engines):
+            name = detach_climbs_partition(shard_engine, month, drop='--drop' in args)
+            print(f"shard {shard}: {f'detached {name}' if name else 'nothing to detach'}")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,212 @@
+"""
+On-demand sampling profiler (dev/ops only, mounted with dev_routes).
+
+A background thread reads every thread's stack with
+``sys._current_frames()`` each PROFILER_INTERVAL_MS and counts identical
+stacks. Nothing is hooked into the code being profiled, so overhead is
+one stack walk per thread per tick.
+
+Two ways to run it:
+
+* ``GET /debug/profile?seconds=10`` samples the whole worker for that
+  long and returns the result.
+* Send any request with ``X-Profile: 1``. The worker is sampled while
+  that request runs, and the response carries ``X-Profile-Id``. Fetch
+  the result from ``GET /debug/profile/{id}``. Other requests running
+  at the same time show up too.
+
+``format=collapsed`` (default) gives the ``a;b;c 12`` lines that
+flamegraph.pl, speedscope and most flame graph viewers read.
+``format=speedscope`` gives speedscope's JSON. Idle threads (waiting on
+a lock, queue or selector) are left out unless ``include_idle=true``.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", 10))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", 60))
+# Per-request profiles kept for /debug/profile/{id}
+PROFILER_KEEP = int(os.getenv("PROFILER_KEEP", 20))
+
+# A thread whose innermost Python frame is in one of these is just waiting
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _frame_path(code) -> str:
+    path = code.co_filename
+    return os.path.relpath(path, _ROOT) if path.startswith(_ROOT) else path
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({_frame_path(code)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    def __init__(self, interval_ms: float = PROFILER_INTERVAL_MS, include_idle: bool = False):
+        self.interval = interval_ms / 1000
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> "Sampler":
+        self.started_at = time.monotonic()
+        self._thread.start()
+        return self
+
+    def stop(self) -> "Sampler":
+        self._stop.set()
+        self._thread.join()
+        self.stopped_at = time.monotonic()
+        return self
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if not self.include_idle and frame.f_code.co_filename.endswith(IDLE_FILES):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        lines = [
+            ";".join(_frame_name(code) for code in stack) + f" {count}"
+            for stack, count in self.stacks.most_common()
+        ]
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self, name: str = "flashed_api") -> dict:
+        frames, index = [], {}
+        samples, weights = [], []
+        interval_ms = self.interval * 1000
+        for stack, count in self.stacks.most_common():
+            sample = []
+            for code in stack:
+                if code not in index:
+                    index[code] = len(frames)
+                    frames.append({
+                        "name": code.co_name,
+                        "file": _frame_path(code),
+                        "line": code.co_firstlineno,
+                    })
+                sample.append(index[code])
+            samples.append(sample)
+            weights.append(count * interval_ms)
+        total = sum(weights)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "flashed_api",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+def render(sampler: Sampler, format: str, name: str = "flashed_api"):
+    if format == "speedscope":
+        return JSONResponse(sampler.speedscope(name))
+    return PlainTextResponse(sampler.collapsed())
+
+
+# Finished per-request profiles, oldest first
+_profiles: "OrderedDict[str, tuple[str, Sampler]]" = OrderedDict()
+_profiles_lock = threading.Lock()
+
+
+def _keep(profile_id: str, name: str, sampler: Sampler) -> None:
+    with _profiles_lock:
+        _profiles[profile_id] = (name, sampler)
+        while len(_profiles) > PROFILER_KEEP:
+            _profiles.popitem(last=False)
+
+
+class ProfileRequestMiddleware:
+    """Samples the worker for the duration of requests sent with ``X-Profile: 1``."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or dict(scope.get("headers") or []).get(b"x-profile") not in (b"1", b"true"):
+            await self.app(scope, receive, send)
+            return
+
+        name = f"{scope['method']} {scope['path']}"
+        profile_id = uuid.uuid4().hex[:12]
+        sampler = Sampler().start()
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                # The body is still to come; sampling keeps going until the end
+                headers = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _keep(profile_id, name, sampler.stop())
+
+
+router = APIRouter(prefix="/debug")
+
+
+@router.get("/profile")
+async def profile_worker(
+    seconds: float = Query(10, gt=0),
+    interval_ms: float = Query(PROFILER_INTERVAL_MS, ge=1),
+    format: str = Query("collapsed", pattern="^(collapsed|speedscope)$"),
+    include_idle: bool = False,
+):
+    if seconds > PROFILER_MAX_SECONDS:
+        raise HTTPException(400, f"seconds is limited to {PROFILER_MAX_SECONDS}")
+    # Sleeping here leaves the event loop and threadpool free for the
+    # traffic being profiled
+    sampler = Sampler(interval_ms, include_idle).start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        sampler.stop()
+    return render(sampler, format, f"worker {os.getpid()} for {seconds}s")
+
+
+@router.get("/profile/{profile_id}")
+def profile_result(
+    profile_id: str,
+    format: str = Query("collapsed", pattern="^(collapsed|speedscope)$"),
+):
+    with _profiles_lock:
+        entry = _profiles.get(profile_id)
+    if entry is None:
+        raise HTTPException(404, "Profile not found (it may have been evicted)")
+    name, sampler = entry
+    return render(sampler, format, name)
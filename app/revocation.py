@@ -0,0 +1,234 @@
+"""
+Refresh-token families and token revocation.
+
+Every login starts a *family*: a row holding the ``jti`` of the one
+refresh token in it that is still valid. Refreshing rotates that jti, so
+presenting an older refresh token from the family means it was copied.
+That reuse revokes the whole family, which logs out both the thief and
+the real client. Tokens carry ``jti`` and ``fam`` claims.
+
+Revoked families (logout, reuse, password change) go into
+``revoked_tokens``. Each worker mirrors that table into an in-memory
+Bloom filter, topped up incrementally by id every
+REVOCATION_SYNC_SECONDS and rebuilt from scratch (dropping expired
+entries) every REVOCATION_REBUILD_SECONDS. A token check is then a few
+hash lookups. The database is only asked on a filter hit, which is a
+real revocation or a rare false positive.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+REFRESH_TOKEN_EXPIRE_MINUTES = int(os.getenv("REFRESH_TOKEN_EXPIRE_MINUTES", 10080))
+# 2**20 bits is 128 KiB per worker: ~1% false positives at 100k entries
+REVOCATION_BLOOM_BITS = int(os.getenv("REVOCATION_BLOOM_BITS", 2 ** 20))
+REVOCATION_BLOOM_HASHES = int(os.getenv("REVOCATION_BLOOM_HASHES", 7))
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", 5))
+REVOCATION_REBUILD_SECONDS = float(os.getenv("REVOCATION_REBUILD_SECONDS", 3600))
+# Ids are handed out before commit, so a slow transaction can commit a
+# lower id after a sync has moved past it; re-read this many ids back.
+REVOCATION_SYNC_OVERLAP = int(os.getenv("REVOCATION_SYNC_OVERLAP", 1000))
+
+
+def new_token_id() -> str:
+    return uuid.uuid4().hex
+
+
+class BloomFilter:
+    def __init__(self, bits: int = REVOCATION_BLOOM_BITS, hashes: int = REVOCATION_BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+
+    def _positions(self, key: str):
+        # Double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self.array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationList:
+    def __init__(self):
+        self.filter = BloomFilter()
+        self.last_id = 0
+        self.synced_at = float("-inf")
+        self.rebuilt_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def add(self, key: str) -> None:
+        # Visible in this worker straight away; others pick it up on sync
+        with self._lock:
+            self.filter.add(key)
+
+    def sync(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self.synced_at < REVOCATION_SYNC_SECONDS:
+            return
+        # One thread syncs; the rest carry on with the current filter
+        if not self._lock.acquire(blocking=force):
+            return
+        try:
+            with SessionLocal() as db:
+                if force or now - self.rebuilt_at >= REVOCATION_REBUILD_SECONDS:
+                    self._rebuild(db)
+                    self.rebuilt_at = now
+                else:
+                    self._catch_up(db)
+            self.synced_at = now
+        except Exception:
+            # Keep serving with what we have; DB checks still back every hit
+            logger.exception("could not sync the token revocation list")
+            self.synced_at = now
+        finally:
+            self._lock.release()
+
+    def _rebuild(self, db: Session) -> None:
+        db.execute(text("DELETE FROM revoked_tokens WHERE expires_at < now()"))
+        db.commit()
+        fresh = BloomFilter()
+        last_id = 0
+        for row_id, key in db.execute(select(models.RevokedToken.id, models.RevokedToken.token_key)):
+            fresh.add(key)
+            last_id = max(last_id, row_id)
+        self.filter, self.last_id = fresh, last_id
+
+    def _catch_up(self, db: Session) -> None:
+        rows = db.execute(
+            select(models.RevokedToken.id, models.RevokedToken.token_key)
+              .where(models.RevokedToken.id > self.last_id - REVOCATION_SYNC_OVERLAP)
+        ).all()
+        for row_id, key in rows:
+            self.filter.add(key)
+            self.last_id = max(self.last_id, row_id)
+
+    def is_revoked(self, *keys: Optional[str]) -> bool:
+        keys = [key for key in keys if key]
+        if not keys:
+            return False
+        self.sync()
+        if not any(key in self.filter for key in keys):
+            return False
+        with SessionLocal() as db:
+            return db.execute(
+                select(models.RevokedToken.id).where(models.RevokedToken.token_key.in_(keys)).limit(1)
+            ).first() is not None
+
+
+revocations = RevocationList()
+
+
+def is_revoked(claims: dict) -> bool:
+    return revocations.is_revoked(claims.get("jti"), claims.get("fam"))
+
+
+# -------------------------------------------------
+# Families
+# -------------------------------------------------
+
+# Core statements throughout: token bookkeeping shouldn't count as a user
+# write (cache invalidation, read-your-writes pinning).
+
+def _revoke(db: Session, key: str, user_id: Optional[int], reason: str) -> bool:
+    expires_at = datetime.now(timezone.utc) + timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)
+    inserted = db.execute(
+        insert(models.RevokedToken)
+          .values(token_key=key, user_id=user_id, reason=reason, expires_at=expires_at)
+          .on_conflict_do_nothing(index_elements=["token_key"])
+          .returning(models.RevokedToken.id)
+    ).scalar()
+    return inserted is not None
+
+
+def start_family(db: Session, user_id: int) -> tuple[str, str]:
+    """Starts a family for a new login. Returns (family id, refresh jti)."""
+    family_id, jti = new_token_id(), new_token_id()
+    db.execute(insert(models.RefreshTokenFamily).values(id=family_id, user_id=user_id, current_jti=jti))
+    return family_id, jti
+
+
+def rotate(db: Session, claims: dict, token: str) -> tuple[str, str]:
+    """
+    Validates a refresh token's place in its family and rotates it.
+    Returns (family id, new refresh jti); the caller commits.
+    """
+    family_id = claims.get("fam")
+    if family_id is None:
+        # Issued before families existed: honour it once, then it's burnt
+        legacy_key = "legacy:" + hashlib.sha256(token.encode()).hexdigest()
+        if not _revoke(db, legacy_key, claims["id"], "rotated"):
+            raise HTTPException(status_code=401, detail="Invalid or expired refresh token.")
+        return start_family(db, claims["id"])
+
+    family = db.execute(
+        select(models.RefreshTokenFamily).where(models.RefreshTokenFamily.id == family_id).with_for_update()
+    ).scalars().first()
+    if family is None or family.revoked_at is not None:
+        raise HTTPException(status_code=401, detail="Invalid or expired refresh token.")
+
+    if family.current_jti != claims.get("jti"):
+        # An already-rotated token came back: assume it leaked
+        revoke_family(db, family_id, family.user_id, "reuse")
+        db.commit()
+        revocations.add(family_id)
+        logger.warning("refresh token reuse detected for user %s, family %s", family.user_id, family_id)
+        raise HTTPException(status_code=401, detail="Refresh token reuse detected; please sign in again.")
+
+    jti = new_token_id()
+    db.execute(
+        update(models.RefreshTokenFamily)
+          .where(models.RefreshTokenFamily.id == family_id)
+          .values(current_jti=jti, rotated_at=datetime.now(timezone.utc))
+    )
+    return family_id, jti
+
+
+def revoke_family(db: Session, family_id: str, user_id: Optional[int], reason: str) -> None:
+    db.execute(
+        update(models.RefreshTokenFamily)
+          .where(models.RefreshTokenFamily.id == family_id, models.RefreshTokenFamily.revoked_at.is_(None))
+          .values(revoked_at=datetime.now(timezone.utc))
+    )
+    _revoke(db, family_id, user_id, reason)
+
+
+def revoke_user_families(db: Session, user_id: int, reason: str, keep: Optional[str] = None) -> list[str]:
+    """
+    Revokes every live family for a user except ``keep``, e.g. signing out
+    the other devices after a password change.
+    """
+    family_ids = db.execute(
+        update(models.RefreshTokenFamily)
+          .where(
+              models.RefreshTokenFamily.user_id == user_id,
+              models.RefreshTokenFamily.revoked_at.is_(None),
+              models.RefreshTokenFamily.id != (keep or ""),
+          )
+          .values(revoked_at=datetime.now(timezone.utc))
+          .returning(models.RefreshTokenFamily.id)
+    ).scalars().all()
+    for family_id in family_ids:
+        _revoke(db, family_id, user_id, reason)
+    return family_ids
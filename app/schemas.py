@@ -1,23 +1,51 @@
-from pydantic import BaseModel, EmailStr
-from datetime import datetime
+from pydantic import AliasChoices, BaseModel, EmailStr, Field
+from datetime import date, datetime
 from typing import List, Optional, Any, Dict
+from enum import Enum
+from .conversion import GradeStyle
 
 
 # ---------------------------
 # Gym schemas
 # ---------------------------
 
+class GradeBand(BaseModel):
+    label: str
+    lo: int
+    hi: int
+
 class GymBase(BaseModel):
     name: str
     is_default: Optional[bool] = False
-    grade_ranges: Optional[List[Dict[str, int]]] = []   # ← NEW
+    grade_ranges: Optional[List[GradeBand]] = []
 
 class GymCreate(GymBase):
-    pass
+    # From /gym_catalog/; otherwise the gym is matched by name
+    catalog_id: Optional[int] = None
+
+class GymUpdate(BaseModel):
+    name: Optional[str] = None
+    is_default: Optional[bool] = None
+    # [] drops this user's bands and goes back to the catalog gym's
+    grade_ranges: Optional[List[GradeBand]] = None
 
 class GymResponse(GymBase):
     id: int
     created_at: datetime
+    catalog_id: Optional[int] = None
+    # The bands in effect: the user's own, else the catalog gym's
+    grade_ranges: Optional[List[GradeBand]] = Field(
+        [], validation_alias=AliasChoices("effective_grade_ranges", "grade_ranges"),
+    )
+
+    class Config:
+        orm_mode = True
+
+class GymCatalogResponse(BaseModel):
+    id: int
+    name: str
+    grade_ranges: List[GradeBand] = []
+    climbers: Optional[int] = None
 
     class Config:
         orm_mode = True
@@ -104,10 +132,28 @@ class ClimbResponse(ClimbBase):
     class Config:
         orm_mode = True
 
+class ClimbSort(str, Enum):
+    NEWEST = "newest"
+    OLDEST = "oldest"
+    HARDEST = "hardest"
+    EASIEST = "easiest"
+
 class ClimbFilter(BaseModel):
     start_date: Optional[datetime] = None
     end_date: Optional[datetime] = None
     grade_range: Optional[List[str]] = None
+    # Inclusive grade bounds, in grade_scale (defaults to the user's style)
+    min_grade: Optional[str] = None
+    max_grade: Optional[str] = None
+    grade_scale: Optional[GradeStyle] = None
+    gym_id: Optional[int] = None
+    # A gym band label, e.g. "Green circuit", matched against each climb's gym
+    gym_label: Optional[str] = None
+    original_scale: Optional[str] = None
+    flash_only: bool = False
+    min_attempts: Optional[int] = None
+    max_attempts: Optional[int] = None
+    sort: ClimbSort = ClimbSort.NEWEST
 
 class AverageGradeRequest(BaseModel):
     start_date: Optional[datetime] = None
@@ -131,3 +177,90 @@ class ProjectResponse(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+# ---------------------------
+# Sync schemas
+# ---------------------------
+
+class SyncDeleted(BaseModel):
+    climbs: List[int] = []
+    gyms: List[int] = []
+    projects: List[int] = []
+
+class SyncResponse(BaseModel):
+    token: str
+    full: bool
+    climbs: List[ClimbResponse] = []
+    gyms: List[GymResponse] = []
+    projects: List[ProjectResponse] = []
+    deleted: SyncDeleted
+
+
+# ---------------------------
+# Bootstrap schemas
+# ---------------------------
+
+class BootstrapResponse(BaseModel):
+    user: Optional[UserResponse] = None
+    gyms: Optional[List[GymResponse]] = None
+    projects: Optional[List[ProjectResponse]] = None
+    climbs: Optional[List[ClimbResponse]] = None
+    average_grade: Optional[str] = None
+
+
+# ---------------------------
+# Import schemas
+# ---------------------------
+
+class ClimbImportResponse(BaseModel):
+    id: int
+    filename: Optional[str] = None
+    status: str
+    total_rows: int
+    processed_rows: int
+    imported_rows: int
+    duplicate_rows: int
+    error_count: int
+    errors: List[dict[str, Any]] = []
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+
+# ---------------------------
+# Forecast schemas
+# ---------------------------
+
+class GradeForecastResponse(BaseModel):
+    current_grade: str
+    next_grade: Optional[str] = None
+    # Internal grade steps per week; <= 0 means no ETA
+    trend_per_week: float
+    weeks_to_next: Optional[float] = None
+    eta: Optional[date] = None
+    weeks_of_data: int
+    computed_at: datetime
+
+
+# ---------------------------
+# Account schemas
+# ---------------------------
+
+class DeleteAccountRequest(BaseModel):
+    password: str
+
+class AccountExportResponse(BaseModel):
+    id: int
+    status: str
+    size_bytes: Optional[int] = None
+    row_counts: dict[str, int] = {}
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
@@ -0,0 +1,281 @@
+"""
+User-id sharding.
+
+Every user's rows (users, gyms, gym_grade_bands, projects, climbs,
+climb_imports and their upload chunks, account_exports, grade_forecasts)
+live on one shard, and jobs are queued and run on the shard of the write
+that queued them. Shard 0 is DATABASE_URL;
+SHARD_URLS adds shards 1..N. Shard 0 also holds the directory:
+``user_shards`` maps user_id -> shard (plus the email, so logins and
+uniqueness checks go to one place), next to the token tables and the
+shared gym_catalog (see app/gym_catalog.py).
+
+``get_db`` in app/database.py routes each request to the user's shard.
+Every shard has the full schema: run ``alembic upgrade head`` against
+each URL. Then give each shard its own id space, once, before it takes
+writes, so a user's rows keep their ids when they move:
+
+    python -m app.shards init-sequences
+
+This sets each shard's id sequences to step by SHARD_ID_STRIDE from an
+offset equal to the shard number.
+
+Moving a user:
+
+    python -m app.shards move <user_id> <shard>
+    python -m app.shards where <user_id>
+
+The move flags the user as moving, so their requests get a 503 for a few
+seconds while in-flight work drains. It then copies their rows in one
+target transaction, flips the directory entry and deletes the source
+rows. The user's queued jobs are re-queued on the target in the same
+transaction. While one of their jobs is running the move is refused;
+run it again once the job has finished. Everyone else is unaffected.
+"""
+import logging
+import os
+import random
+import sys
+import time
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from . import models, partitions
+from .cache import cache, user_namespace
+from .database import (
+    SHARD_MAP_TTL_SECONDS, SessionLocal, engine, record_writes, shard_engines, shard_sessions,
+)
+
+logger = logging.getLogger(__name__)
+
+# Room for this many shards; ids on shard n are n (mod stride)
+SHARD_ID_STRIDE = int(os.getenv("SHARD_ID_STRIDE", 64))
+# Shards that take new signups (comma separated), default all
+SHARD_NEW_USERS = [int(shard) for shard in os.getenv("SHARD_NEW_USERS", "").split(",") if shard.strip()]
+# Extra wait after the map TTL for requests that already had a session
+SHARD_MOVE_DRAIN_SECONDS = float(os.getenv("SHARD_MOVE_DRAIN_SECONDS", 2))
+SHARD_MOVE_BATCH_ROWS = int(os.getenv("SHARD_MOVE_BATCH_ROWS", 1000))
+
+# Per-user tables in foreign-key order; bands hang off the user's gyms
+USER_TABLES = [
+    (models.User.__table__, "id = :user_id"),
+    (models.Gym.__table__, "user_id = :user_id"),
+    (models.GymGradeBand.__table__, "gym_id IN (SELECT id FROM gyms WHERE user_id = :user_id)"),
+    (models.Project.__table__, "user_id = :user_id"),
+    (models.Climb.__table__, "user_id = :user_id"),
+    (models.ClimbImport.__table__, "user_id = :user_id"),
+    (models.ClimbImportChunk.__table__, "import_id IN (SELECT id FROM climb_imports WHERE user_id = :user_id)"),
+    (models.AccountExport.__table__, "user_id = :user_id"),
+    (models.GradeForecast.__table__, "user_id = :user_id"),
+]
+
+# The user's jobs: queued with their user_id, or for one of their imports/exports
+USER_JOBS_WHERE = """
+    (payload->>'user_id' = CAST(:user_id AS text)
+     OR id IN (SELECT job_id FROM climb_imports WHERE user_id = :user_id
+               UNION ALL
+               SELECT job_id FROM account_exports WHERE user_id = :user_id))
+"""
+
+
+def session_for(shard: int) -> Session:
+    return shard_sessions[shard]()
+
+
+def pick_new_user_shard() -> int:
+    return random.choice(SHARD_NEW_USERS or range(len(shard_engines)))
+
+
+def shard_for_email(directory: Session, email: str) -> Optional[int]:
+    return directory.execute(
+        select(models.UserShard.shard).where(models.UserShard.email == email)
+    ).scalar()
+
+
+def register_user(directory: Session, user_id: int, shard: int, email: str) -> bool:
+    """Claims ``email`` for a new user. False when it is already taken."""
+    return directory.execute(
+        pg_insert(models.UserShard)
+          .values(user_id=user_id, shard=shard, email=email)
+          .on_conflict_do_nothing(index_elements=["email"])
+          .returning(models.UserShard.user_id)
+    ).scalar() is not None
+
+
+def change_email(user_id: int, email: str) -> None:
+    with SessionLocal() as directory:
+        taken = directory.execute(
+            select(models.UserShard.user_id)
+              .where(models.UserShard.email == email, models.UserShard.user_id != user_id)
+        ).first()
+        if taken:
+            raise HTTPException(status_code=400, detail="Email already in use")
+        directory.execute(
+            update(models.UserShard).where(models.UserShard.user_id == user_id).values(email=email)
+        )
+        directory.commit()
+
+
+# -------------------------------------------------
+# Id sequences
+# -------------------------------------------------
+
+def init_sequences() -> None:
+    """
+    Restarts every per-user table's id sequence on shard n at the first
+    value above all existing ids (on any shard) that is n mod the stride.
+    Tables keyed on something else (grade_forecasts on user_id) have no
+    sequence to set.
+    """
+    tables = [table.name for table, _ in USER_TABLES if "id" in table.c]
+    highest = {name: 0 for name in tables}
+    for shard_engine in shard_engines:
+        with shard_engine.connect() as conn:
+            for name in tables:
+                highest[name] = max(highest[name], conn.execute(text(f"SELECT coalesce(max(id), 0) FROM {name}")).scalar())
+
+    for shard, shard_engine in enumerate(shard_engines):
+        with shard_engine.begin() as conn:
+            for name in tables:
+                sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": name}).scalar()
+                if sequence is None:
+                    continue
+                start = highest[name] + 1
+                start += (shard - start) % SHARD_ID_STRIDE
+                conn.execute(text(f"ALTER SEQUENCE {sequence} INCREMENT BY {SHARD_ID_STRIDE} RESTART WITH {start}"))
+                print(f"shard {shard}: {sequence} from {start} by {SHARD_ID_STRIDE}")
+
+
+# -------------------------------------------------
+# Moving users
+# -------------------------------------------------
+
+def _set_moving(user_id: int, moving: bool, shard: Optional[int] = None) -> None:
+    values = {"moving": moving}
+    if shard is not None:
+        values["shard"] = shard
+    with engine.begin() as conn:
+        conn.execute(update(models.UserShard).where(models.UserShard.user_id == user_id).values(**values))
+    cache.delete("shards", user_id)
+
+
+def _move_jobs(src, dst, user_id: int) -> int:
+    """
+    Re-queues the user's queued jobs on the target, where their rows will
+    be, and deletes them from the source when ``src`` commits. Raises if
+    one of their jobs is running: it may still write to the source.
+    """
+    params = {"user_id": user_id}
+    # Locked, so a worker can't claim them meanwhile (claims skip locked rows)
+    queued = src.execute(text(
+        f"SELECT * FROM jobs WHERE status = 'queued' AND {USER_JOBS_WHERE} ORDER BY id FOR UPDATE"
+    ), params).mappings().all()
+    running = src.execute(text(
+        f"SELECT count(*) FROM jobs WHERE status = 'running' AND {USER_JOBS_WHERE}"
+    ), params).scalar()
+    if running:
+        raise RuntimeError(f"User {user_id} has {running} running job(s); move them once they finish")
+
+    for job in queued:
+        job_id = dst.execute(
+            pg_insert(models.Job)
+              .values({column: job[column] for column in (
+                  "kind", "payload", "status", "attempts", "max_attempts", "dedupe_key",
+                  "run_after", "last_error", "created_at",
+              )})
+              .on_conflict_do_nothing(
+                  index_elements=["dedupe_key"],
+                  index_where=text("status = 'queued' AND dedupe_key IS NOT NULL"),
+              )
+              .returning(models.Job.id)
+        ).scalar()
+        # Job ids aren't kept (jobs has no per-shard id space)
+        for table in (models.ClimbImport, models.AccountExport):
+            dst.execute(
+                update(table).where(table.user_id == user_id, table.job_id == job["id"]).values(job_id=job_id)
+            )
+    if queued:
+        src.execute(delete(models.Job).where(models.Job.id.in_([job["id"] for job in queued])))
+    return len(queued)
+
+
+def move_user(user_id: int, target: int) -> dict:
+    with engine.connect() as conn:
+        source = conn.execute(
+            select(models.UserShard.shard).where(models.UserShard.user_id == user_id)
+        ).scalar()
+    if source is None:
+        raise ValueError(f"User {user_id} is not in user_shards")
+    if not 0 <= target < len(shard_engines):
+        raise ValueError(f"No shard {target}")
+    if source == target:
+        return {"user_id": user_id, "shard": target, "rows": 0}
+
+    source_engine, target_engine = shard_engines[source], shard_engines[target]
+    params = {"user_id": user_id}
+
+    # Stop routing to the source, then let cached mappings and running
+    # requests run out before reading a stable copy
+    _set_moving(user_id, True)
+    time.sleep(SHARD_MAP_TTL_SECONDS + SHARD_MOVE_DRAIN_SECONDS)
+
+    copied = moved_jobs = 0
+    try:
+        with source_engine.connect() as conn:
+            months = conn.execute(text(
+                "SELECT DISTINCT date_trunc('month', created_at)::date FROM climbs WHERE user_id = :user_id"
+            ), params).scalars().all()
+        partitions.ensure_month_partitions(target_engine, months)
+
+        # The target commits first; the source's jobs go only if it did
+        with source_engine.begin() as src, target_engine.begin() as dst:
+            for table, where in USER_TABLES:
+                # Streamed on this statement only: set on the connection,
+                # the DELETE in _move_jobs would go through a cursor too
+                rows = src.execute(
+                    select(table).where(text(where)).execution_options(yield_per=SHARD_MOVE_BATCH_ROWS), params,
+                )
+                for batch in rows.partitions():
+                    dst.execute(insert(table), [dict(row._mapping) for row in batch])
+                    copied += len(batch)
+            moved_jobs = _move_jobs(src, dst, user_id)
+    except Exception:
+        _set_moving(user_id, False)
+        raise
+
+    _set_moving(user_id, False, shard=target)
+    record_writes([user_namespace(user_id)])
+
+    # The target is authoritative from here; a failure below only leaves
+    # unreachable rows on the source, so log it rather than undo the move
+    try:
+        with source_engine.begin() as conn:
+            for table, where in reversed(USER_TABLES):
+                conn.execute(delete(table).where(text(where)), params)
+    except Exception:
+        logger.exception("user %s moved to shard %s but source rows on shard %s remain", user_id, target, source)
+
+    return {"user_id": user_id, "from": source, "shard": target, "rows": copied, "jobs": moved_jobs}
+
+
+def main(argv: list[str]) -> None:
+    logging.basicConfig(level=logging.INFO)
+    if argv and argv[0] == "init-sequences":
+        init_sequences()
+    elif len(argv) == 3 and argv[0] == "move":
+        print(move_user(int(argv[1]), int(argv[2])))
+    elif len(argv) == 2 and argv[0] == "where":
+        with SessionLocal() as directory:
+            entry = directory.get(models.UserShard, int(argv[1]))
+            print(f"shard {entry.shard}{' (moving)' if entry.moving else ''}" if entry else "not mapped (shard 0)")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
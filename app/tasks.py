@@ -0,0 +1,37 @@
+"""
+Background job handlers. Each one receives its own session and the job
+payload; whatever it returns is stored on the job row as ``result``.
+"""
+from sqlalchemy.orm import Session
+
+from . import accounts, crud, imports
+from .jobs import job
+
+
+@job("refresh_user_stats")
+def refresh_user_stats(db: Session, payload: dict):
+    # The write already invalidated the user's cache namespace; recompute
+    # the all-time stats here so the next read is a cache hit.
+    stats = crud.get_average_grade(db, payload["user_id"])
+    return stats
+
+
+@job("import_climbs", max_attempts=1)
+def import_climbs(db: Session, payload: dict):
+    # Not retried: the merge is all-or-nothing, and the stored upload goes
+    # away with the attempt either way.
+    try:
+        return imports.run_import(db, payload["import_id"])
+    finally:
+        imports.discard_upload(db, payload["import_id"])
+
+
+@job("delete_account", max_attempts=10)
+def delete_account(db: Session, payload: dict):
+    # Idempotent: a retry picks up whatever rows are left
+    return accounts.delete_account(db, payload["user_id"])
+
+
+@job("export_account", max_attempts=1)
+def export_account(db: Session, payload: dict):
+    return accounts.run_export(db, payload["export_id"])
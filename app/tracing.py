@@ -0,0 +1,358 @@
+"""
+Request tracing without a collector.
+
+A small tracer with the same shape as the OpenTelemetry API::
+
+    tracer = tracing.get_tracer(__name__)
+
+    with tracer.start_as_current_span("crud.get_user_climbs") as span:
+        ...
+        span.set_attribute("db.rows", len(rows))
+
+``start_as_current_span`` also works as a decorator. Switching to the
+real SDK later means swapping ``get_tracer`` for
+``opentelemetry.trace.get_tracer``.
+
+TracingMiddleware opens a root span per request. A request is sampled
+with probability TRACE_SAMPLE_RATE. A W3C ``traceparent`` header lends
+the request its trace id; its sampled flag is only obeyed with
+TRACE_TRUST_TRACEPARENT=true (set it behind a gateway that controls the
+header, not where clients can force traces). TRACE_SAMPLE_RATE=0 turns
+tracing off whatever the header says. Unsampled requests get a no-op
+span, so instrumented code costs a contextvar lookup.
+``instrument_engine`` adds a span per SQL statement.
+
+Finished spans are queued and a background thread writes them, one JSON
+object per line, either to stderr (TRACE_EXPORTER=console) or appended to
+TRACE_FILE (TRACE_EXPORTER=file).
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Fraction of requests traced; 0 turns tracing off
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+# Obey the sampled flag of incoming traceparent headers
+TRACE_TRUST_TRACEPARENT = os.getenv("TRACE_TRUST_TRACEPARENT", "false").lower() == "true"
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "console")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+# SQL text is cut to this many characters on db spans
+TRACE_STATEMENT_CHARS = int(os.getenv("TRACE_STATEMENT_CHARS", 500))
+# Finished spans waiting for the writer thread; more are dropped
+TRACE_EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", 10_000))
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Optional[dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = "OK"
+        self.events: list[dict] = []
+        self.start_time = time.time_ns()
+        self.end_time: Optional[int] = None
+
+    def is_recording(self) -> bool:
+        return self.end_time is None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: dict) -> None:
+        self.attributes.update(attributes)
+
+    def set_status(self, status: str, description: Optional[str] = None) -> None:
+        self.status = status
+        if description:
+            self.attributes["status.description"] = description
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.events.append({
+            "name": "exception",
+            "time": time.time_ns(),
+            "attributes": {"exception.type": type(exc).__name__, "exception.message": str(exc)},
+        })
+
+    def end(self) -> None:
+        if self.end_time is None:
+            self.end_time = time.time_ns()
+            exporter.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration_ms": round((self.end_time - self.start_time) / 1e6, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+            "events": self.events,
+        }
+
+
+class NonRecordingSpan:
+    """Stands in for a span on unsampled requests; every call is a no-op."""
+
+    trace_id = span_id = None
+
+    def is_recording(self) -> bool:
+        return False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: dict) -> None:
+        pass
+
+    def set_status(self, status: str, description: Optional[str] = None) -> None:
+        pass
+
+    def record_exception(self, exc: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+INVALID_SPAN = NonRecordingSpan()
+
+_current_span: ContextVar = ContextVar("current_span", default=INVALID_SPAN)
+_root_span: ContextVar = ContextVar("root_span", default=INVALID_SPAN)
+
+
+def get_current_span():
+    return _current_span.get()
+
+
+def set_root_attributes(attributes: dict) -> None:
+    """Tags the whole request (its root span), wherever the caller is nested."""
+    _root_span.get().set_attributes(attributes)
+
+
+def is_recording() -> bool:
+    return _current_span.get().is_recording()
+
+
+class Exporter:
+    """
+    ``export`` only queues the span: spans end on the event loop (the
+    root span in TracingMiddleware), which must not wait on a file. A
+    daemon thread writes whatever has queued up in one go. When the queue
+    is full, spans are dropped and the count is logged.
+    """
+
+    def __init__(self, kind: str = TRACE_EXPORTER, path: str = TRACE_FILE, max_queue: int = TRACE_EXPORT_QUEUE_SIZE):
+        self.kind = kind
+        self.path = path
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, batch: list[dict]) -> None:
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            logger.warning("dropped %s spans: the export queue was full", dropped)
+        lines = "".join(json.dumps(span, default=str) + "\n" for span in batch)
+        try:
+            if self.kind == "file":
+                with open(self.path, "a") as out:
+                    out.write(lines)
+            else:
+                sys.stderr.write(lines)
+        except OSError:
+            logger.exception("could not export %s spans", len(batch))
+
+    def flush(self, timeout: float = 5) -> None:
+        """Waits (up to ``timeout``) for the queued spans to be written."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+exporter = Exporter()
+
+
+class Tracer:
+    def __init__(self, name: str):
+        self.name = name
+
+    def start_span(self, name: str, attributes: Optional[dict] = None, parent=None):
+        parent = parent if parent is not None else _current_span.get()
+        # Only spans under a sampled root are recorded
+        if not parent.is_recording():
+            return INVALID_SPAN
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+
+    @contextmanager
+    def start_as_current_span(self, name: str, attributes: Optional[dict] = None):
+        span = self.start_span(name, attributes)
+        if span is INVALID_SPAN:
+            yield span
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            span.set_status("ERROR", str(e))
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+
+def get_tracer(name: str) -> Tracer:
+    return Tracer(name)
+
+
+def _parse_traceparent(header: str) -> Optional[tuple[str, str, bool]]:
+    # version-traceid-parentid-flags
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+def start_root_span(name: str, traceparent: Optional[str] = None, attributes: Optional[dict] = None):
+    """Starts a request's root span, or returns INVALID_SPAN if it isn't sampled."""
+    if TRACE_SAMPLE_RATE <= 0:
+        return INVALID_SPAN
+    parent = _parse_traceparent(traceparent) if traceparent else None
+    trace_id, parent_id, parent_sampled = parent or (None, None, False)
+    sampled = (TRACE_TRUST_TRACEPARENT and parent_sampled) or random.random() < TRACE_SAMPLE_RATE
+    if not sampled:
+        return INVALID_SPAN
+    return Span(name, trace_id or f"{random.getrandbits(128):032x}", parent_id, attributes)
+
+
+def climb_count_bucket(count: int) -> str:
+    """Order of magnitude, e.g. 0, 1+, 10+, 100+, 1000+."""
+    return "0" if count <= 0 else f"{10 ** (len(str(count)) - 1)}+"
+
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(b"traceparent")
+        span = start_root_span(
+            f"{scope['method']} {scope['path']}",
+            traceparent.decode("latin-1") if traceparent else None,
+            {"http.method": scope["method"], "http.target": scope["path"]},
+        )
+        if span is INVALID_SPAN:
+            await self.app(scope, receive, send)
+            return
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+                if message["status"] >= 500:
+                    span.set_status("ERROR")
+            await send(message)
+
+        token, root_token = _current_span.set(span), _root_span.set(span)
+        try:
+            await self.app(scope, receive, traced_send)
+        except BaseException as e:
+            span.record_exception(e)
+            span.set_status("ERROR", str(e))
+            raise
+        finally:
+            _current_span.reset(token)
+            _root_span.reset(root_token)
+            # The router fills in the matched route template
+            route = scope.get("route")
+            if route is not None and getattr(route, "path", None):
+                span.name = f"{scope['method']} {route.path}"
+                span.set_attribute("http.route", route.path)
+            span.end()
+
+
+def instrument_engine(engine, shard=None) -> None:
+    """One ``db.query`` span per statement, on sampled requests only."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = _tracer.start_span("db.query", {
+            "db.system": "postgresql",
+            "db.statement": statement[:TRACE_STATEMENT_CHARS],
+            "db.shard": shard,
+        })
+        if span is not INVALID_SPAN:
+            conn.info.setdefault("trace_spans", []).append(span)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("trace_spans")
+        if spans:
+            span = spans.pop()
+            span.set_attribute("db.rows", cursor.rowcount)
+            span.end()
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        spans = context.connection.info.get("trace_spans") if context.connection is not None else None
+        if spans:
+            span = spans.pop()
+            span.record_exception(context.original_exception)
+            span.set_status("ERROR", str(context.original_exception))
+            span.end()
+
+
+_tracer = get_tracer(__name__)
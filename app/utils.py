@@ -1,6 +1,9 @@
 from passlib.context import CryptContext
 from enum import Enum
 from .conversion import convert_internal_to_display
+from . import tracing
+
+tracer = tracing.get_tracer(__name__)
 
 
 class GradeStyle(str, Enum):
@@ -9,9 +12,11 @@ class GradeStyle(str, Enum):
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+@tracer.start_as_current_span("bcrypt.hash")
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
+@tracer.start_as_current_span("bcrypt.verify")
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
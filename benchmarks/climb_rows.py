@@ -0,0 +1,138 @@
+"""
+Memory and throughput of the /get_climbs/ read path: ORM objects vs rows.
+
+Builds the response body for one user's climbs both ways, in a fresh
+Session each time as a request would:
+
+* orm:  Climb objects through the identity map, a ClimbResponse model
+        per row with its grade formatted one at a time (the old path)
+* rows: ``get_user_climbs(..., as_rows=True)`` column tuples, grades
+        converted in one batch, plain dicts (what the route does now)
+
+Both end in jsonable_encoder. It reports the tracemalloc peak per 10k
+rows and rows per second over --repeat runs.
+
+The climbs belong to a benchmark user, bench-rows@flashed.app, who is
+created with --rows climbs on first use against DATABASE_URL. Remove the
+user with --cleanup.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.climb_rows --rows 10000
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import text
+
+from app import crud, models, schemas, shards
+from app.conversion import GradeStyle, convert_internals_to_display
+from app.database import SessionLocal
+from app.utils import format_for_display
+
+BENCH_EMAIL = "bench-rows@flashed.app"
+
+FILL_CLIMBS = text("""
+    INSERT INTO climbs (user_id, internal_grade, original_grade, original_scale, attempts, created_at)
+    SELECT :user_id, n % 20, 'V' || (n % 10), 'VScale', 1 + n % 4, now() - make_interval(mins => n)
+      FROM generate_series(1, :rows) AS n
+""")
+
+
+def bench_user(rows: int) -> int:
+    with SessionLocal() as db:
+        user = crud.get_user_by_email(db, BENCH_EMAIL)
+        if user is not None:
+            return user.id
+        user = models.User(
+            first_name="Bench", last_name="Rows", email=BENCH_EMAIL, password_hash="x",
+            location="Nowhere", grade_style=GradeStyle.VSCALE.value,
+        )
+        db.add(user)
+        db.flush()
+        shards.register_user(db, user.id, 0, BENCH_EMAIL)
+        db.execute(FILL_CLIMBS, {"user_id": user.id, "rows": rows})
+        db.commit()
+        return user.id
+
+
+def cleanup() -> None:
+    with SessionLocal() as db:
+        user = crud.get_user_by_email(db, BENCH_EMAIL)
+        if user is not None:
+            db.execute(text("DELETE FROM climbs WHERE user_id = :id"), {"id": user.id})
+            db.execute(text("DELETE FROM users WHERE id = :id"), {"id": user.id})
+            db.execute(text("DELETE FROM user_shards WHERE user_id = :id"), {"id": user.id})
+            db.commit()
+
+
+def orm_path(user_id: int) -> list:
+    with SessionLocal() as db:
+        climbs = crud.get_user_climbs(db, user_id, schemas.ClimbFilter(), None)
+        return jsonable_encoder([
+            schemas.ClimbResponse(
+                id=climb.id,
+                grade=format_for_display(
+                    internal_grade=climb.internal_grade,
+                    original_scale=climb.original_scale,
+                    gym_ranges=[],
+                    user_pref=GradeStyle.VSCALE,
+                ),
+                original_grade=climb.original_grade,
+                original_scale=climb.original_scale,
+                attempts=climb.attempts,
+                created_at=climb.created_at,
+            )
+            for climb in climbs
+        ])
+
+
+def rows_path(user_id: int) -> list:
+    fields = set(schemas.ClimbResponse.model_fields)
+    with SessionLocal() as db:
+        climbs = crud.get_user_climbs(db, user_id, schemas.ClimbFilter(), None, as_rows=True)
+        grades = convert_internals_to_display([climb.internal_grade for climb in climbs], GradeStyle.VSCALE)
+        return jsonable_encoder([
+            {name: grade if name == "grade" else getattr(climb, name) for name in fields}
+            for climb, grade in zip(climbs, grades)
+        ])
+
+
+def measure(path, user_id: int, repeat: int) -> tuple[int, float, float]:
+    """(rows, peak bytes per 10k rows, rows per second)"""
+    path(user_id)  # warm caches and the pool
+    tracemalloc.start()
+    body = path(user_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del body
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        rows = len(path(user_id))
+    elapsed = time.perf_counter() - started
+    return rows, peak / rows * 10_000, rows * repeat / elapsed
+
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cleanup", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.cleanup:
+        cleanup()
+        return
+
+    user_id = bench_user(args.rows)
+    results = {name: measure(path, user_id, args.repeat) for name, path in (("orm", orm_path), ("rows", rows_path))}
+    for name, (rows, per_10k, rate) in results.items():
+        print(f"{name:5} {rows} rows: peak {per_10k / 2**20:.1f} MiB per 10k rows, {rate:,.0f} rows/s")
+    orm, rows = results["orm"], results["rows"]
+    print(f"rows vs orm: {orm[1] / rows[1]:.1f}x less memory, {rows[2] / orm[2]:.1f}x the throughput")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,89 @@
+"""
+Helpers shared by the HTTP benchmarks. Standard library only, so they run
+from any machine that can reach the server:
+
+    python -m benchmarks.<name> --url http://localhost:8000 ...
+
+They log in as a seeded user (POST /seed/ on a dev server).
+"""
+import base64
+import http.client
+import json
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+DEFAULT_URL = "http://localhost:8000"
+DEFAULT_EMAIL = "ella@flashed.app"
+DEFAULT_PASSWORD = "password123"
+
+
+class Client:
+    """One keep-alive connection; make one per thread."""
+
+    def __init__(self, base_url: str, timeout: float = 30):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.token: Optional[str] = None
+        self._conn: Optional[http.client.HTTPConnection] = None
+
+    def request(self, method: str, path: str, body=None, headers: Optional[dict] = None) -> tuple[int, float, dict, bytes]:
+        """Returns (status, seconds, headers, body); status 0 for a connection error."""
+        headers = dict(headers or {})
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        start = time.perf_counter()
+        try:
+            if self._conn is None:
+                self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._conn.request(method, path, payload, headers)
+            response = self._conn.getresponse()
+            data = response.read()
+            return response.status, time.perf_counter() - start, dict(response.getheaders()), data
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return 0, time.perf_counter() - start, {}, b""
+
+    def login(self, email: str, password: str) -> "Client":
+        for _ in range(10):
+            status, _, headers, data = self.request("POST", "/login/", {"email": email, "password": password})
+            if status not in (429, 503):
+                break
+            # Admission control turned us away; wait as told
+            time.sleep(float({k.lower(): v for k, v in headers.items()}.get("retry-after", 1)))
+        if status != 200:
+            raise SystemExit(f"login as {email} failed ({status}); seed the server with POST /seed/")
+        self.token = json.loads(data)["access_token"]
+        return self
+
+    @property
+    def user_id(self) -> int:
+        # Read from the token's claims; no need to verify it here
+        claims = self.token.split(".")[1]
+        return json.loads(base64.urlsafe_b64decode(claims + "=" * (-len(claims) % 4)))["id"]
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def percentile(samples: list[float], p: float) -> float:
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def summary(samples: list[float]) -> str:
+    ms = [s * 1000 for s in samples]
+    return (
+        f"n={len(ms)} p50={percentile(ms, 50):.1f}ms p95={percentile(ms, 95):.1f}ms "
+        f"p99={percentile(ms, 99):.1f}ms max={max(ms, default=float('nan')):.1f}ms"
+    )
@@ -0,0 +1,107 @@
+"""
+Climb inserts from many clients at once (group commit, app/coalescer.py).
+
+--clients threads POST /add_climb/ as fast as they can for --seconds, all
+as one seeded user, and the script reports throughput and latency. Run it
+against the server twice, with CLIMB_GROUP_COMMIT=false and then true.
+With group commit on, throughput should go up while p99 rises by no more
+than about GROUP_COMMIT_MAX_WAIT_MS.
+
+Any 202 (a batch still being written at the timeout) or 503 (withdrawn,
+safe to retry) is counted. The number of climbs the user ended up with
+is checked against the responses. Exits 1 if a 200 went unwritten or
+more rows were written than could be accounted for.
+
+It adds real climbs, so point it at a dev server:
+
+    python -m benchmarks.group_commit --url http://localhost:8000 --clients 200
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import Counter
+
+from .common import DEFAULT_EMAIL, DEFAULT_PASSWORD, DEFAULT_URL, Client, summary
+
+
+def climb_count(client: Client) -> int:
+    status, _, _, data = client.request(
+        "POST", f"/get_climbs/?user_id={client.user_id}&fields=id", {},
+    )
+    if status != 200:
+        raise SystemExit(f"could not count climbs ({status})")
+    return len(json.loads(data))
+
+
+def first_gym_id(client: Client) -> int:
+    status, _, _, data = client.request("GET", "/get_gyms/")
+    gyms = json.loads(data) if status == 200 else []
+    if not gyms:
+        raise SystemExit("the user has no gyms; seed the server with POST /seed/")
+    return gyms[0]["id"]
+
+
+def insert_loop(client: Client, path: str, body: dict, stop: threading.Event, samples: list, statuses: Counter) -> None:
+    while not stop.is_set():
+        status, seconds, headers, _ = client.request("POST", path, body)
+        statuses[status] += 1
+        if status == 200:
+            samples.append(seconds)
+        elif status == 503:
+            time.sleep(float({k.lower(): v for k, v in headers.items()}.get("retry-after", 1)))
+
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--email", default=DEFAULT_EMAIL)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=15)
+    args = parser.parse_args(argv)
+
+    owner = Client(args.url).login(args.email, args.password)
+    path = f"/add_climb/?user_id={owner.user_id}"
+    body = {"gym_id": first_gym_id(owner), "grade": "V3", "scale": "VScale", "attempts": 2}
+    before = climb_count(owner)
+
+    stop = threading.Event()
+    samples: list[float] = []
+    statuses = Counter()
+    clients = []
+    for _ in range(args.clients):
+        client = Client(args.url)
+        client.token = owner.token
+        clients.append(client)
+    threads = [
+        threading.Thread(target=insert_loop, args=(client, path, body, stop, samples, statuses))
+        for client in clients
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.clients} clients, {elapsed:.1f}s")
+    print(f"inserts:  {statuses[200] / elapsed:.0f}/s, {summary(samples)}")
+    print(f"statuses: {dict(sorted(statuses.items()))}")
+
+    # 202s may still be landing, and get_climbs may read from a replica
+    time.sleep(1)
+    written = climb_count(owner) - before
+    print(f"climbs written: {written} (200s: {statuses[200]}, 202s: {statuses[202]})")
+    # A dropped connection (status 0) may or may not have been written
+    ok = statuses[200] <= written <= statuses[200] + statuses[202] + statuses[0]
+    if not ok:
+        print("written climbs don't match the responses")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,100 @@
+"""
+Login storm vs cheap reads (admission control, app/admission.py).
+
+Readers poll GET /get_gyms/ for --seconds to get a baseline. Then they
+keep polling while --storm-clients threads hammer POST /login/. Read
+latency should stay flat: the logins are capped by the concurrency limit
+and turned away with 429/503 + Retry-After instead of queueing on the
+threadpool. Exits 1 if the storm's read p99 exceeds --max-ratio times
+the baseline.
+
+Each storm client sends its own X-Forwarded-For. Run the server with
+TRUST_FORWARDED_FOR=true to exercise the concurrency limit and queue.
+Otherwise every client shares one token bucket and most get 429s.
+
+    python -m benchmarks.login_storm --url http://localhost:8000 --storm-clients 200
+"""
+import argparse
+import sys
+import threading
+import time
+from collections import Counter
+
+from .common import DEFAULT_EMAIL, DEFAULT_PASSWORD, DEFAULT_URL, Client, percentile, summary
+
+
+def read_loop(client: Client, stop: threading.Event, samples: list[float], errors: Counter) -> None:
+    while not stop.is_set():
+        status, seconds, _, _ = client.request("GET", "/get_gyms/")
+        if status == 200:
+            samples.append(seconds)
+        else:
+            errors[status] += 1
+
+
+def login_loop(client: Client, n: int, args, stop: threading.Event, statuses: Counter, missing_retry_after: list) -> None:
+    body = {"email": args.email, "password": args.password}
+    headers = {"X-Forwarded-For": f"10.0.{n // 250}.{n % 250 + 1}"}
+    while not stop.is_set():
+        status, _, response_headers, _ = client.request("POST", "/login/", body, headers)
+        statuses[status] += 1
+        if status in (429, 503):
+            retry_after = {k.lower(): v for k, v in response_headers.items()}.get("retry-after")
+            if retry_after is None:
+                missing_retry_after.append(status)
+            else:
+                # Back off the way a well-behaved client would, briefly
+                time.sleep(min(float(retry_after), 0.2))
+
+
+def run_phase(args, storm: bool) -> tuple[list[float], Counter, Counter, list]:
+    stop = threading.Event()
+    samples: list[float] = []
+    read_errors, login_statuses = Counter(), Counter()
+    missing_retry_after: list = []
+    threads = [
+        threading.Thread(target=read_loop, args=(Client(args.url).login(args.email, args.password), stop, samples, read_errors))
+        for _ in range(args.readers)
+    ]
+    if storm:
+        threads += [
+            threading.Thread(target=login_loop, args=(Client(args.url), n, args, stop, login_statuses, missing_retry_after))
+            for n in range(args.storm_clients)
+        ]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return samples, read_errors, login_statuses, missing_retry_after
+
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--email", default=DEFAULT_EMAIL)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--storm-clients", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--max-ratio", type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    baseline, _, _, _ = run_phase(args, storm=False)
+    print(f"baseline reads: {summary(baseline)}")
+    during, read_errors, logins, missing = run_phase(args, storm=True)
+    print(f"storm reads:    {summary(during)}")
+    if read_errors:
+        print(f"read errors:    {dict(read_errors)}")
+    print(f"login statuses: {dict(sorted(logins.items()))}")
+    if missing:
+        print(f"{len(missing)} rejections without Retry-After")
+
+    ratio = percentile(during, 99) / percentile(baseline, 99) if baseline and during else float("inf")
+    print(f"read p99 ratio: {ratio:.2f} (limit {args.max_ratio})")
+    sys.exit(0 if ratio <= args.max_ratio and not missing else 1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,98 @@
+"""
+Per-request Python overhead of the hot crud reads (app/crud.py).
+
+Runs each hot read --calls times against DATABASE_URL, as a seeded user,
+each call in a fresh Session the way a request gets one, three ways:
+
+* current:  the prebuilt / lambda statements crud runs now
+* rebuilt:  the old ``db.query(...)`` chain, built again on every call
+            (SQLAlchemy still finds its compiled form in the cache)
+* uncached: the rebuilt chain with the compiled cache off, so every
+            call also compiles the SQL
+
+CPU time is this process's own (building, cache keys, compiling, loading
+rows); wall time adds the round trip to Postgres.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.statement_cache --calls 2000
+"""
+import argparse
+import sys
+import time
+
+from app import crud, models, schemas
+from app.database import SessionLocal
+
+from .common import DEFAULT_EMAIL
+
+
+def rebuilt_queries(email: str, user_id: int) -> dict:
+    """The queries as they were written before the statements were prebuilt."""
+    return {
+        "get_user_by_email": lambda db: db.query(models.User).filter(
+            models.User.email == email, models.User.deleted_at.is_(None),
+        ).first(),
+        "get_user_gyms": lambda db: db.query(models.Gym).filter(
+            models.Gym.user_id == user_id, models.Gym.deleted_at.is_(None),
+        ).all(),
+        "get_user_projects": lambda db: db.query(models.Project).filter(
+            models.Project.user_id == user_id, models.Project.deleted_at.is_(None),
+        ).order_by(models.Project.created_at.desc()).all(),
+        "get_user_climbs": lambda db: db.query(models.Climb).filter(
+            models.Climb.user_id == user_id, models.Climb.deleted_at.is_(None),
+        ).order_by(*crud.CLIMB_SORTS[schemas.ClimbSort.NEWEST]).all(),
+    }
+
+
+def current_queries(email: str, user_id: int) -> dict:
+    filters = schemas.ClimbFilter()
+    return {
+        "get_user_by_email": lambda db: crud.get_user_by_email(db, email),
+        "get_user_gyms": lambda db: crud.get_user_gyms(db, user_id),
+        "get_user_projects": lambda db: crud.get_user_projects(db, user_id),
+        "get_user_climbs": lambda db: crud.get_user_climbs(db, user_id, filters, None),
+    }
+
+
+def time_calls(query, calls: int, cached: bool = True) -> tuple[float, float]:
+    """Mean (cpu, wall) seconds per call."""
+    options = {} if cached else {"compiled_cache": None}
+    # Warm the pool and the compiled cache
+    for _ in range(min(calls, 50)):
+        with SessionLocal() as db:
+            db.connection(execution_options=options)
+            query(db)
+    cpu, wall = time.process_time(), time.perf_counter()
+    for _ in range(calls):
+        with SessionLocal() as db:
+            db.connection(execution_options=options)
+            query(db)
+    return (time.process_time() - cpu) / calls, (time.perf_counter() - wall) / calls
+
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--email", default=DEFAULT_EMAIL)
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as db:
+        user = crud.get_user_by_email(db, args.email)
+    if user is None:
+        raise SystemExit(f"no user {args.email}; seed the database with POST /seed/")
+
+    current = current_queries(args.email, user.id)
+    rebuilt = rebuilt_queries(args.email, user.id)
+    print(f"{args.calls} calls each, microseconds per call (cpu / wall)")
+    print(f"{'':20} {'current':>15} {'rebuilt':>15} {'uncached':>15}")
+    for name in current:
+        runs = [
+            time_calls(current[name], args.calls),
+            time_calls(rebuilt[name], args.calls),
+            time_calls(rebuilt[name], args.calls, cached=False),
+        ]
+        cells = " ".join(f"{cpu * 1e6:>7.0f} / {wall * 1e6:<5.0f}" for cpu, wall in runs)
+        print(f"{name:20} {cells}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,395 @@
+"""
+Helpers for migrations that have to run against a live, full-size table.
+
+Plain ``op.add_column(..., nullable=False)``, ``op.create_index`` and a
+one-statement ``UPDATE`` backfill each hold a lock for as long as the
+table takes to rewrite, scan or update. These helpers break that work
+into short steps:
+
+* ``backfill``: UPDATE in primary-key ranges, one short transaction per
+  batch. Batch size adapts to BACKFILL_TARGET_SECONDS, with a pause
+  between batches. Progress is checkpointed in
+  ``online_migration_checkpoints``, so a rerun resumes where it stopped
+  (or, once finished, only covers rows added since).
+* ``create_index`` / ``drop_index``: ``CONCURRENTLY``. On a partitioned
+  table, each partition is built concurrently and attached. An invalid
+  index left by a failed earlier build is dropped and rebuilt.
+* ``add_check_constraint`` / ``add_foreign_key``: added ``NOT VALID``
+  (only a brief lock), then ``VALIDATE``d, which scans without blocking
+  writes. ``replace_foreign_key`` swaps a key for one with another
+  ``ON DELETE`` action the same way.
+* ``set_not_null``: a validated ``IS NOT NULL`` check first, so
+  ``SET NOT NULL`` can skip its full-table scan.
+* ``ddl``: one DDL statement under a short ``lock_timeout``, retried. It
+  never queues behind a long transaction while blocking everyone behind it.
+
+All of them expect a connection in autocommit mode. In a revision::
+
+    from migrations import online
+
+    def upgrade() -> None:
+        op.add_column('climbs', sa.Column('grade_band', sa.Integer(), nullable=True))
+        with op.get_context().autocommit_block():
+            conn = op.get_bind()
+            online.backfill(
+                conn, 'climbs_grade_band', 'climbs',
+                set_sql="grade_band = floor(internal_grade)::int",
+                where="grade_band IS NULL",
+            )
+            online.create_index(conn, 'ix_climbs_user_id_grade_band', 'climbs', '(user_id, grade_band)')
+            online.set_not_null(conn, 'climbs', 'grade_band')
+
+Backfill SETs must be idempotent (guard them with ``where``): a batch
+can run twice if the process dies between the batch and its checkpoint.
+"""
+import logging
+import os
+import time
+from typing import Optional
+
+import sqlalchemy as sa
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger("alembic.online")
+
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", 5000))
+BACKFILL_MAX_BATCH_SIZE = int(os.getenv("BACKFILL_MAX_BATCH_SIZE", 50000))
+# Batch size is adjusted so each UPDATE takes about this long
+BACKFILL_TARGET_SECONDS = float(os.getenv("BACKFILL_TARGET_SECONDS", 0.2))
+# Pause between batches, for autovacuum, replicas and live traffic
+BACKFILL_SLEEP_SECONDS = float(os.getenv("BACKFILL_SLEEP_SECONDS", 0.05))
+DDL_LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "2s")
+DDL_ATTEMPTS = int(os.getenv("MIGRATION_DDL_ATTEMPTS", 10))
+
+LOCK_NOT_AVAILABLE = "55P03"
+QUERY_CANCELED = "57014"
+
+CHECKPOINT_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS online_migration_checkpoints (
+        name        text PRIMARY KEY,
+        last_key    bigint NOT NULL,
+        rows        bigint NOT NULL DEFAULT 0,
+        finished    boolean NOT NULL DEFAULT false,
+        updated_at  timestamptz NOT NULL DEFAULT now()
+    )
+"""
+
+
+def _pgcode(error: DBAPIError) -> Optional[str]:
+    return getattr(error.orig, "pgcode", None)
+
+
+def _check_autocommit(conn) -> None:
+    if not conn.connection.dbapi_connection.autocommit:
+        raise RuntimeError("online helpers need an autocommit connection (op.get_context().autocommit_block())")
+
+
+# -------------------------------------------------
+# DDL with short lock waits
+# -------------------------------------------------
+
+def ddl(conn, sql: str, lock_timeout: str = DDL_LOCK_TIMEOUT, attempts: int = DDL_ATTEMPTS) -> None:
+    """
+    Runs one DDL statement, giving up on the lock after ``lock_timeout``
+    and retrying with backoff, rather than waiting in the lock queue where
+    every query on the table would pile up behind it.
+    """
+    for attempt in range(1, attempts + 1):
+        conn.execute(sa.text(f"SET lock_timeout = '{lock_timeout}'"))
+        try:
+            conn.execute(sa.text(sql))
+            return
+        except DBAPIError as e:
+            if _pgcode(e) != LOCK_NOT_AVAILABLE or attempt == attempts:
+                raise
+            wait = min(2 ** attempt * 0.1, 10)
+            logger.info("lock not available for %r, retry %s in %.1fs", sql[:80], attempt, wait)
+            time.sleep(wait)
+        finally:
+            conn.execute(sa.text("RESET lock_timeout"))
+
+
+# -------------------------------------------------
+# Batched backfills
+# -------------------------------------------------
+
+def _checkpoint(conn, name: str) -> tuple[Optional[int], int, bool]:
+    conn.execute(sa.text(CHECKPOINT_TABLE_SQL))
+    row = conn.execute(sa.text(
+        "SELECT last_key, rows, finished FROM online_migration_checkpoints WHERE name = :name"
+    ), {"name": name}).first()
+    return (row.last_key, row.rows, row.finished) if row else (None, 0, False)
+
+
+def _save_checkpoint(conn, name: str, last_key: int, rows: int, finished: bool = False) -> None:
+    conn.execute(sa.text("""
+        INSERT INTO online_migration_checkpoints (name, last_key, rows, finished)
+        VALUES (:name, :last_key, :rows, :finished)
+        ON CONFLICT (name) DO UPDATE
+           SET last_key = excluded.last_key, rows = excluded.rows,
+               finished = excluded.finished, updated_at = now()
+    """), {"name": name, "last_key": last_key, "rows": rows, "finished": finished})
+
+
+def backfill(
+    conn,
+    name: str,
+    table: str,
+    set_sql: str,
+    where: Optional[str] = None,
+    key: str = "id",
+    params: Optional[dict] = None,
+    batch_size: int = BACKFILL_BATCH_SIZE,
+    sleep: float = BACKFILL_SLEEP_SECONDS,
+    target_seconds: float = BACKFILL_TARGET_SECONDS,
+) -> int:
+    """
+    ``UPDATE table SET set_sql WHERE where`` in ``key`` ranges, each
+    range its own transaction. ``name`` identifies the checkpoint. Returns
+    the rows updated by this run.
+
+    Before finishing, ``max(key)`` is read again and any rows inserted
+    meanwhile are covered too. Rows the old application code inserts
+    after that (for instance between ``alembic upgrade`` and the deploy of
+    code that writes the new columns) are not. Run the backfill again
+    once the new code is live. A rerun starts after the last key it
+    covered, so it only touches those rows. ``key`` must increase for new
+    rows, as a serial id does.
+    """
+    _check_autocommit(conn)
+    last_key, total, _ = _checkpoint(conn, name)
+
+    bounds = conn.execute(sa.text(f"SELECT min({key}), max({key}) FROM {table}")).first()
+    if bounds[0] is None:
+        _save_checkpoint(conn, name, last_key or 0, total, finished=True)
+        return 0
+    low = bounds[0] if last_key is None else last_key + 1
+    high = bounds[1]
+
+    statement = sa.text(
+        f"UPDATE {table} SET {set_sql} WHERE {key} >= :low AND {key} < :high"
+        + (f" AND ({where})" if where else "")
+    )
+    updated = 0
+    size = batch_size
+    # Each UPDATE commits on its own. One that can't get its row locks
+    # quickly backs off instead of stalling the writers queued behind it.
+    conn.execute(sa.text(f"SET lock_timeout = '{DDL_LOCK_TIMEOUT}'"))
+    try:
+        while low <= high:
+            start = time.monotonic()
+            try:
+                result = conn.execute(statement, {**(params or {}), "low": low, "high": low + size})
+            except DBAPIError as e:
+                if _pgcode(e) not in (LOCK_NOT_AVAILABLE, QUERY_CANCELED):
+                    raise
+                size = max(size // 2, 1)
+                logger.info("backfill %s: batch at %s timed out, retrying with %s", name, low, size)
+                time.sleep(max(sleep, 1))
+                continue
+            elapsed = time.monotonic() - start
+
+            updated += result.rowcount
+            total += result.rowcount
+            # Past the last key seen, rows may have arrived after the UPDATE
+            low = min(low + size, high + 1)
+            _save_checkpoint(conn, name, low - 1, total)
+            logger.info("backfill %s: %s rows, up to %s=%s of %s", name, total, key, low - 1, high)
+
+            # Aim each batch at target_seconds
+            if elapsed < target_seconds / 2:
+                size = min(size * 2, BACKFILL_MAX_BATCH_SIZE)
+            elif elapsed > target_seconds * 2:
+                size = max(size // 2, 1)
+            if low > high:
+                # Carry on over rows inserted while this ran
+                high = conn.execute(sa.text(f"SELECT max({key}) FROM {table}")).scalar() or high
+            if low <= high:
+                time.sleep(sleep)
+    finally:
+        conn.execute(sa.text("RESET lock_timeout"))
+
+    _save_checkpoint(conn, name, max(low - 1, last_key or 0), total, finished=True)
+    return updated
+
+
+def reset_backfill(conn, name: str) -> None:
+    """Forgets a checkpoint, e.g. in a downgrade, so the backfill runs again."""
+    conn.execute(sa.text(CHECKPOINT_TABLE_SQL))
+    conn.execute(sa.text("DELETE FROM online_migration_checkpoints WHERE name = :name"), {"name": name})
+
+
+# -------------------------------------------------
+# Indexes
+# -------------------------------------------------
+
+def _index_valid(conn, name: str) -> Optional[bool]:
+    return conn.execute(sa.text(
+        "SELECT i.indisvalid FROM pg_index i WHERE i.indexrelid = to_regclass(:name)"
+    ), {"name": name}).scalar()
+
+
+def _partitions(conn, table: str) -> list[str]:
+    return conn.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+    ), {"table": table}).scalars().all()
+
+
+def _is_partitioned(conn, table: str) -> bool:
+    return conn.execute(sa.text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"
+    ), {"table": table}).scalar() or False
+
+
+def _create_one(conn, name: str, table: str, definition: str, unique: bool) -> None:
+    if _index_valid(conn, name) is False:
+        # Left behind by an interrupted CONCURRENTLY build
+        conn.execute(sa.text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(sa.text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}"
+    ))
+
+
+def create_index(
+    conn,
+    name: str,
+    table: str,
+    columns: str,
+    unique: bool = False,
+    where: Optional[str] = None,
+    using: Optional[str] = None,
+) -> None:
+    """
+    ``columns`` is the parenthesised list, e.g. ``'(user_id, created_at)'``.
+    Partitioned tables get an index ON ONLY the parent (metadata only),
+    one concurrent build per partition, then each is attached; the
+    parent becomes valid once every partition's index is attached.
+    """
+    _check_autocommit(conn)
+    definition = f"{f'USING {using} ' if using else ''}{columns}{f' WHERE {where}' if where else ''}"
+    if not _is_partitioned(conn, table):
+        _create_one(conn, name, table, definition, unique)
+        return
+
+    ddl(conn, f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON ONLY {table} {definition}")
+    for partition in _partitions(conn, table):
+        child = f"{partition}_{name}"[:63]
+        _create_one(conn, child, partition, definition, unique)
+        attached = conn.execute(sa.text(
+            "SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:child) AND inhparent = to_regclass(:parent)"
+        ), {"child": child, "parent": name}).first()
+        if not attached:
+            ddl(conn, f"ALTER INDEX {name} ATTACH PARTITION {child}")
+
+
+def drop_index(conn, name: str, table: Optional[str] = None) -> None:
+    """CONCURRENTLY where possible; a partitioned parent index can't be."""
+    _check_autocommit(conn)
+    if table is not None and _is_partitioned(conn, table):
+        ddl(conn, f"DROP INDEX IF EXISTS {name}")
+    else:
+        conn.execute(sa.text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+# -------------------------------------------------
+# Constraints
+# -------------------------------------------------
+
+def _constraint_exists(conn, table: str, name: str) -> bool:
+    return conn.execute(sa.text(
+        "SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(:table) AND conname = :name"
+    ), {"table": table, "name": name}).first() is not None
+
+
+def validate_constraint(conn, table: str, name: str) -> None:
+    # VALIDATE takes SHARE UPDATE EXCLUSIVE: reads and writes carry on
+    ddl(conn, f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+
+
+def add_check_constraint(conn, table: str, name: str, condition: str, validate: bool = True) -> None:
+    _check_autocommit(conn)
+    if not _constraint_exists(conn, table, name):
+        ddl(conn, f"ALTER TABLE {table} ADD CONSTRAINT {name} CHECK ({condition}) NOT VALID")
+    if validate:
+        validate_constraint(conn, table, name)
+
+
+def add_foreign_key(
+    conn,
+    table: str,
+    name: str,
+    columns: str,
+    ref_table: str,
+    ref_columns: str,
+    on_delete: Optional[str] = None,
+    validate: bool = True,
+) -> None:
+    """
+    A partitioned table can't take a ``NOT VALID`` key, so each partition
+    gets its own validated copy first. The parent's key then adopts them
+    without scanning again (``validate`` has no effect there).
+    """
+    _check_autocommit(conn)
+    definition = (
+        f"FOREIGN KEY ({columns}) REFERENCES {ref_table} ({ref_columns})"
+        + (f" ON DELETE {on_delete}" if on_delete else "")
+    )
+    if _is_partitioned(conn, table):
+        for partition in _partitions(conn, table):
+            add_foreign_key(conn, partition, f"{partition}_{name}"[:63], columns, ref_table, ref_columns, on_delete)
+        if not _constraint_exists(conn, table, name):
+            ddl(conn, f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+        return
+
+    if not _constraint_exists(conn, table, name):
+        ddl(conn, f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition} NOT VALID")
+    if validate:
+        validate_constraint(conn, table, name)
+
+
+# pg_constraint.confdeltype
+ON_DELETE_CODES = {"NO ACTION": "a", "RESTRICT": "r", "CASCADE": "c", "SET NULL": "n", "SET DEFAULT": "d"}
+
+
+def replace_foreign_key(
+    conn,
+    table: str,
+    name: str,
+    columns: str,
+    ref_table: str,
+    ref_columns: str,
+    on_delete: Optional[str] = None,
+) -> None:
+    """
+    Swaps foreign key ``name`` for one with a different ``on_delete``. The
+    new key is added and validated online under a temporary name; dropping
+    the old one and renaming are brief catalog-only locks. Safe to rerun.
+    """
+    _check_autocommit(conn)
+    temporary = f"{name[:59]}_new"
+    current = conn.execute(sa.text(
+        "SELECT confdeltype FROM pg_constraint WHERE conrelid = to_regclass(:table) AND conname = :name"
+    ), {"table": table, "name": name}).scalar()
+    if current == ON_DELETE_CODES[(on_delete or "NO ACTION").upper()] and not _constraint_exists(conn, table, temporary):
+        return
+
+    add_foreign_key(conn, table, temporary, columns, ref_table, ref_columns, on_delete)
+    ddl(conn, f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}")
+    ddl(conn, f"ALTER TABLE {table} RENAME CONSTRAINT {temporary} TO {name}")
+    for partition in _partitions(conn, table):
+        child = f"{partition}_{temporary}"[:63]
+        if _constraint_exists(conn, partition, child):
+            ddl(conn, f"ALTER TABLE {partition} RENAME CONSTRAINT {child} TO {f'{partition}_{name}'[:63]}")
+
+
+def set_not_null(conn, table: str, column: str) -> None:
+    """
+    SET NOT NULL normally scans the whole table under an ACCESS EXCLUSIVE
+    lock. With a validated ``column IS NOT NULL`` check in place Postgres
+    (12+) trusts the check and skips the scan; the check is dropped after.
+    """
+    name = f"{table}_{column}_not_null"[:63]
+    add_check_constraint(conn, table, name, f"{column} IS NOT NULL")
+    ddl(conn, f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL")
+    ddl(conn, f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}")
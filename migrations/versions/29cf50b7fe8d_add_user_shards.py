@@ -0,0 +1,48 @@
+"""add user_shards directory
+
+Revision ID: 29cf50b7fe8d
+Revises: dac4c2e92108
+Create Date: 2026-10-19 17:30:52.774108
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '29cf50b7fe8d'
+down_revision: Union[str, None] = 'dac4c2e92108'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('user_shards',
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('shard', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('email', sa.String(length=100), nullable=False),
+    sa.Column('moving', sa.Boolean(), server_default=sa.text('false'), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('user_id'),
+    sa.UniqueConstraint('email')
+    )
+    # Everyone so far lives on shard 0. On a fresh extra shard this is a no-op.
+    op.execute("INSERT INTO user_shards (user_id, shard, email) SELECT id, 0, email FROM users")
+
+    # Token families stay on shard 0 while users may move off it
+    op.drop_constraint('refresh_token_families_user_id_fkey', 'refresh_token_families', type_='foreignkey')
+    op.create_foreign_key(
+        'refresh_token_families_user_id_fkey', 'refresh_token_families', 'user_shards',
+        ['user_id'], ['user_id'],
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('refresh_token_families_user_id_fkey', 'refresh_token_families', type_='foreignkey')
+    op.create_foreign_key(
+        'refresh_token_families_user_id_fkey', 'refresh_token_families', 'users',
+        ['user_id'], ['id'],
+    )
+    op.drop_table('user_shards')
@@ -0,0 +1,46 @@
+"""cascade user foreign keys
+
+Revision ID: 480a0c9a2557
+Revises: 5e83ce65cb9e
+Create Date: 2026-10-19 21:14:03.518270
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migrations import online
+
+
+# revision identifiers, used by Alembic.
+revision: str = '480a0c9a2557'
+down_revision: Union[str, None] = '5e83ce65cb9e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The User relationships use passive_deletes, so deleting a user leaves
+# its rows to these keys
+USER_FOREIGN_KEYS = [
+    ('climbs', 'climbs_user_id_fkey', 'user_id', 'users', 'id'),
+    ('projects', 'projects_user_id_fkey', 'user_id', 'users', 'id'),
+    ('gyms', 'gyms_user_id_fkey', 'user_id', 'users', 'id'),
+    ('climb_imports', 'climb_imports_user_id_fkey', 'user_id', 'users', 'id'),
+    ('account_exports', 'account_exports_user_id_fkey', 'user_id', 'users', 'id'),
+    ('grade_forecasts', 'grade_forecasts_user_id_fkey', 'user_id', 'users', 'id'),
+    ('refresh_token_families', 'refresh_token_families_user_id_fkey', 'user_id', 'user_shards', 'user_id'),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        for table, name, column, ref_table, ref_column in USER_FOREIGN_KEYS:
+            online.replace_foreign_key(conn, table, name, column, ref_table, ref_column, on_delete='CASCADE')
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        for table, name, column, ref_table, ref_column in USER_FOREIGN_KEYS:
+            online.replace_foreign_key(conn, table, name, column, ref_table, ref_column)
@@ -0,0 +1,99 @@
+"""add gym_catalog and dedupe gyms into it
+
+Revision ID: 5e83ce65cb9e
+Revises: 7163975e794f
+Create Date: 2026-10-19 19:52:27.604113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from migrations import online
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e83ce65cb9e'
+down_revision: Union[str, None] = '7163975e794f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Must match app.gym_catalog.normalize_name
+NORMALIZED_NAME = "btrim(regexp_replace(lower({column}), '\\s+', ' ', 'g'))"
+
+# One entry per normalized name. It takes the bands most users of that
+# gym have (ties: ones with bands, then the oldest gym's) and that
+# gym's spelling of the name.
+FILL_CATALOG = f"""
+    INSERT INTO gym_catalog (name, normalized_name, grade_ranges)
+    SELECT DISTINCT ON (normalized_name) name, normalized_name, grade_ranges
+      FROM (
+        SELECT name, normalized_name, grade_ranges, created_at,
+               count(*) OVER (PARTITION BY normalized_name, grade_ranges) AS votes
+          FROM (
+            SELECT name, {NORMALIZED_NAME.format(column='name')} AS normalized_name,
+                   coalesce(grade_ranges, '[]'::jsonb) AS grade_ranges, created_at
+              FROM gyms
+          ) named
+      ) ranked
+     ORDER BY normalized_name, votes DESC, grade_ranges <> '[]'::jsonb DESC, created_at, name
+    ON CONFLICT (normalized_name) DO NOTHING
+"""
+
+# Gyms whose bands match the catalog's drop their copy
+CATALOG_ENTRY = f"(SELECT c.{{column}} FROM gym_catalog c WHERE c.normalized_name = {NORMALIZED_NAME.format(column='gyms.name')})"
+LINK_GYMS = f"""
+    catalog_id = {CATALOG_ENTRY.format(column='id')},
+    grade_ranges = CASE
+        WHEN coalesce(grade_ranges, '[]'::jsonb) = {CATALOG_ENTRY.format(column='grade_ranges')} THEN NULL
+        ELSE grade_ranges
+    END
+"""
+
+
+def upgrade() -> None:
+    op.create_table('gym_catalog',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('normalized_name', sa.String(length=100), nullable=False),
+    sa.Column('grade_ranges', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('normalized_name')
+    )
+    op.create_index('ix_gym_catalog_normalized_name_pattern', 'gym_catalog', ['normalized_name'], unique=False, postgresql_ops={'normalized_name': 'text_pattern_ops'})
+    op.add_column('gyms', sa.Column('catalog_id', sa.Integer(), nullable=True))
+    op.alter_column('gyms', 'grade_ranges', existing_type=postgresql.JSONB(astext_type=sa.Text()), nullable=True)
+
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        conn.execute(sa.text(FILL_CATALOG))
+        # Gyms the old code adds after this are caught by running
+        # `python -m app.gym_catalog link` once the new code is deployed
+        online.backfill(
+            conn, 'gyms_catalog_id', 'gyms',
+            set_sql=LINK_GYMS,
+            where="catalog_id IS NULL",
+        )
+        online.create_index(conn, 'ix_gyms_catalog_id', 'gyms', '(catalog_id)')
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        online.backfill(
+            conn, 'gyms_catalog_ranges_restore', 'gyms',
+            set_sql="grade_ranges = coalesce((SELECT c.grade_ranges FROM gym_catalog c WHERE c.id = gyms.catalog_id), '[]'::jsonb)",
+            where="grade_ranges IS NULL",
+        )
+        online.reset_backfill(conn, 'gyms_catalog_ranges_restore')
+        online.reset_backfill(conn, 'gyms_catalog_id')
+        online.drop_index(conn, 'ix_gyms_catalog_id')
+
+    op.alter_column('gyms', 'grade_ranges', existing_type=postgresql.JSONB(astext_type=sa.Text()), nullable=False)
+    op.drop_column('gyms', 'catalog_id')
+    op.drop_index('ix_gym_catalog_normalized_name_pattern', table_name='gym_catalog', postgresql_ops={'normalized_name': 'text_pattern_ops'})
+    op.drop_table('gym_catalog')
@@ -0,0 +1,35 @@
+"""add grade_forecasts
+
+Revision ID: 7163975e794f
+Revises: 62f340233553
+Create Date: 2026-10-19 18:41:09.336817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7163975e794f'
+down_revision: Union[str, None] = '62f340233553'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('grade_forecasts',
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('level', sa.Float(), nullable=False),
+    sa.Column('slope_per_week', sa.Float(), nullable=False),
+    sa.Column('spread', sa.Float(), nullable=False),
+    sa.Column('weeks_of_data', sa.Integer(), nullable=False),
+    sa.Column('computed_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('grade_forecasts')
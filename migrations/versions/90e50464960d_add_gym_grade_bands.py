@@ -0,0 +1,52 @@
+"""add gym_grade_bands
+
+Revision ID: 90e50464960d
+Revises: 466ceaa2d378
+Create Date: 2026-10-19 14:48:10.337561
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '90e50464960d'
+down_revision: Union[str, None] = '466ceaa2d378'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # GiST over (gym_id integer, grades int4range) needs btree_gist
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    op.create_table('gym_grade_bands',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('gym_id', sa.Integer(), nullable=False),
+    sa.Column('label', sa.String(length=100), nullable=False),
+    sa.Column('grades', postgresql.INT4RANGE(), nullable=False),
+    sa.ForeignKeyConstraint(['gym_id'], ['gyms.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # Backfill from gyms.grade_ranges ({label, lo, hi} objects, inclusive)
+    op.execute("""
+        INSERT INTO gym_grade_bands (gym_id, label, grades)
+        SELECT g.id, band->>'label', int4range((band->>'lo')::int, (band->>'hi')::int, '[]')
+          FROM gyms g
+         CROSS JOIN LATERAL jsonb_array_elements(g.grade_ranges) AS band
+         WHERE band ? 'label' AND band ? 'lo' AND band ? 'hi'
+    """)
+
+    op.create_index('ix_gym_grade_bands_gym_id_grades', 'gym_grade_bands', ['gym_id', 'grades'],
+                    unique=False, postgresql_using='gist')
+    op.create_index('ix_gym_grade_bands_gym_id_label', 'gym_grade_bands', ['gym_id', 'label'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_gym_grade_bands_gym_id_label', table_name='gym_grade_bands')
+    op.drop_index('ix_gym_grade_bands_gym_id_grades', table_name='gym_grade_bands')
+    op.drop_table('gym_grade_bands')
@@ -0,0 +1,32 @@
+"""add climb_import_chunks
+
+Revision ID: 9d2f4b7c1e08
+Revises: 480a0c9a2557
+Create Date: 2026-10-19 23:02:41.137905
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d2f4b7c1e08'
+down_revision: Union[str, None] = '480a0c9a2557'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('climb_import_chunks',
+    sa.Column('import_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['import_id'], ['climb_imports.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('import_id', 'seq')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('climb_import_chunks')
@@ -0,0 +1,197 @@
+"""partition climbs by month
+
+Revision ID: b49591e5df63
+Revises: ea6fa3ef1ea5
+Create Date: 2026-10-19 10:41:37.552918
+
+Rebuilds ``climbs`` as a table range-partitioned on ``created_at`` by month.
+
+The move runs online: rows are copied into ``climbs_partitioned`` in id
+batches, each in its own short transaction, while the old table keeps
+taking writes. Climbs can be updated and deleted as well as inserted, so
+a trigger logs the id of every row written after the copy starts, in
+``climbs_changed``. Those rows are copied again, in batches, until few
+are left. The final step locks ``climbs``, re-copies only the rows
+logged since, and swaps the tables.
+
+Upcoming partitions are created by ``app.partitions.ensure_climbs_partitions``
+(on app startup and from cron).
+"""
+import time
+from datetime import date
+from typing import Optional, Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b49591e5df63'
+down_revision: Union[str, None] = 'ea6fa3ef1ea5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+BATCH_SIZE = 10_000
+BATCH_PAUSE_SECONDS = 0.05
+MONTHS_AHEAD = 3
+
+# (index name, definition) created on the new table under a temporary name
+# and renamed once the old table is gone
+INDEXES = [
+    ('ix_climbs_id', '(id)'),
+    ('ix_climbs_internal_grade', '(internal_grade)'),
+    ('ix_climbs_gym_id', '(gym_id)'),
+    ('ix_climbs_user_id_created_at', '(user_id, created_at)'),
+    ('ix_climbs_user_id_flashes', '(user_id, created_at) WHERE attempts = 1'),
+]
+
+
+def _add_months(month: date, count: int) -> date:
+    index = month.year * 12 + (month.month - 1) + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _copy_in_batches(conn, source: str, target: str, start_id: int, end_id: int) -> None:
+    lo = start_id
+    while lo <= end_id:
+        hi = lo + BATCH_SIZE
+        conn.execute(sa.text(
+            f"INSERT INTO {target} SELECT * FROM {source} WHERE id >= :lo AND id < :hi"
+        ), {"lo": lo, "hi": hi})
+        lo = hi
+        time.sleep(BATCH_PAUSE_SECONDS)
+
+
+def _log_changes() -> None:
+    # CREATE TRIGGER waits for the writes already in flight, so every row
+    # written before it is seen by the batch copy and every later write is
+    # logged. An update that changes the id logs both.
+    op.execute("CREATE TABLE climbs_changed (id integer PRIMARY KEY)")
+    op.execute("""
+        CREATE FUNCTION climbs_log_change() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                INSERT INTO climbs_changed VALUES (OLD.id) ON CONFLICT DO NOTHING;
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                INSERT INTO climbs_changed VALUES (NEW.id) ON CONFLICT DO NOTHING;
+            END IF;
+            RETURN NULL;
+        END $$
+    """)
+    op.execute(
+        "CREATE TRIGGER climbs_log_change AFTER INSERT OR UPDATE OR DELETE ON climbs "
+        "FOR EACH ROW EXECUTE FUNCTION climbs_log_change()"
+    )
+
+
+def _drop_change_log() -> None:
+    # The trigger went with the old table
+    op.execute("DROP TABLE climbs_changed")
+    op.execute("DROP FUNCTION climbs_log_change()")
+
+
+def _catch_up(conn, target: str, batch_size: Optional[int] = BATCH_SIZE) -> None:
+    """
+    Re-copies the logged rows (a deleted one is just removed). Before the
+    lock, runs in batches until a batch comes back short; under it,
+    ``batch_size=None`` takes whatever is left in one pass.
+    """
+    limit = "" if batch_size is None else f" LIMIT {batch_size}"
+    while True:
+        ids = conn.execute(sa.text(f"SELECT id FROM climbs_changed ORDER BY id{limit}")).scalars().all()
+        if not ids:
+            return
+        # Forgotten first: a row written again from here on is logged again
+        conn.execute(sa.text("DELETE FROM climbs_changed WHERE id = ANY(:ids)"), {"ids": ids})
+        conn.execute(sa.text(f"DELETE FROM {target} WHERE id = ANY(:ids)"), {"ids": ids})
+        conn.execute(sa.text(f"INSERT INTO {target} SELECT * FROM climbs WHERE id = ANY(:ids)"), {"ids": ids})
+        if batch_size is None or len(ids) < batch_size:
+            return
+        time.sleep(BATCH_PAUSE_SECONDS)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    with op.get_context().autocommit_block():
+        op.execute("UPDATE climbs SET created_at = now() WHERE created_at IS NULL")
+
+        op.execute(
+            "CREATE TABLE climbs_partitioned (LIKE climbs INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (created_at)"
+        )
+        op.execute("ALTER TABLE climbs_partitioned ALTER COLUMN created_at SET NOT NULL")
+        op.execute("ALTER TABLE climbs_partitioned ADD PRIMARY KEY (id, created_at)")
+        op.execute(
+            "ALTER TABLE climbs_partitioned ADD CONSTRAINT climbs_partitioned_user_id_fkey "
+            "FOREIGN KEY (user_id) REFERENCES users (id)"
+        )
+        op.execute(
+            "ALTER TABLE climbs_partitioned ADD CONSTRAINT climbs_partitioned_gym_id_fkey "
+            "FOREIGN KEY (gym_id) REFERENCES gyms (id)"
+        )
+        for name, definition in INDEXES:
+            op.execute(f"CREATE INDEX {name}_new ON climbs_partitioned {definition}")
+
+        # One partition per month from the oldest climb to a few months ahead
+        oldest = conn.execute(sa.text(
+            "SELECT date_trunc('month', coalesce(min(created_at), now()))::date FROM climbs"
+        )).scalar()
+        current = conn.execute(sa.text("SELECT date_trunc('month', now())::date")).scalar()
+        month = oldest
+        while month <= _add_months(current, MONTHS_AHEAD):
+            following = _add_months(month, 1)
+            op.execute(
+                f"CREATE TABLE climbs_p{month:%Y_%m} PARTITION OF climbs_partitioned "
+                f"FOR VALUES FROM ('{month}') TO ('{following}')"
+            )
+            month = following
+        op.execute("CREATE TABLE climbs_default PARTITION OF climbs_partitioned DEFAULT")
+
+        _log_changes()
+        min_id, max_id = conn.execute(sa.text("SELECT min(id), max(id) FROM climbs")).one()
+        if max_id is not None:
+            _copy_in_batches(conn, 'climbs', 'climbs_partitioned', min_id, max_id)
+        _catch_up(conn, 'climbs_partitioned')
+
+    # Swap under a single short lock
+    op.execute("LOCK TABLE climbs IN ACCESS EXCLUSIVE MODE")
+    _catch_up(conn, 'climbs_partitioned', batch_size=None)
+    op.execute("ALTER SEQUENCE climbs_id_seq OWNED BY climbs_partitioned.id")
+    op.execute("DROP TABLE climbs")
+    _drop_change_log()
+    op.execute("ALTER TABLE climbs_partitioned RENAME TO climbs")
+    op.execute("ALTER TABLE climbs RENAME CONSTRAINT climbs_partitioned_pkey TO climbs_pkey")
+    op.execute("ALTER TABLE climbs RENAME CONSTRAINT climbs_partitioned_user_id_fkey TO climbs_user_id_fkey")
+    op.execute("ALTER TABLE climbs RENAME CONSTRAINT climbs_partitioned_gym_id_fkey TO climbs_gym_id_fkey")
+    for name, _ in INDEXES:
+        op.execute(f"ALTER INDEX {name}_new RENAME TO {name}")
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+
+    with op.get_context().autocommit_block():
+        op.execute("CREATE TABLE climbs_unpartitioned (LIKE climbs INCLUDING DEFAULTS)")
+        op.execute("ALTER TABLE climbs_unpartitioned ALTER COLUMN created_at DROP NOT NULL")
+        # Before the copy, so the catch-up can probe it by id
+        op.execute("ALTER TABLE climbs_unpartitioned ADD CONSTRAINT climbs_unpartitioned_pkey PRIMARY KEY (id)")
+        _log_changes()
+        min_id, max_id = conn.execute(sa.text("SELECT min(id), max(id) FROM climbs")).one()
+        if max_id is not None:
+            _copy_in_batches(conn, 'climbs', 'climbs_unpartitioned', min_id, max_id)
+        _catch_up(conn, 'climbs_unpartitioned')
+
+    op.execute("LOCK TABLE climbs IN ACCESS EXCLUSIVE MODE")
+    _catch_up(conn, 'climbs_unpartitioned', batch_size=None)
+    op.execute("ALTER SEQUENCE climbs_id_seq OWNED BY climbs_unpartitioned.id")
+    op.execute("DROP TABLE climbs CASCADE")
+    _drop_change_log()
+    op.execute("ALTER TABLE climbs_unpartitioned RENAME TO climbs")
+    op.execute("ALTER TABLE climbs RENAME CONSTRAINT climbs_unpartitioned_pkey TO climbs_pkey")
+    op.create_foreign_key('climbs_user_id_fkey', 'climbs', 'users', ['user_id'], ['id'])
+    op.create_foreign_key('climbs_gym_id_fkey', 'climbs', 'gyms', ['gym_id'], ['id'])
+    for name, definition in INDEXES:
+        op.execute(f"CREATE INDEX {name} ON climbs {definition}")
@@ -0,0 +1,52 @@
+"""add climb filter indexes
+
+Revision ID: b8b1faa0f185
+Revises: 90e50464960d
+Create Date: 2026-10-19 15:36:22.871045
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8b1faa0f185'
+down_revision: Union[str, None] = '90e50464960d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = [
+    # min/max grade filters and hardest/easiest sorts
+    ('ix_climbs_user_id_internal_grade', '(user_id, internal_grade)'),
+    # per-gym history, newest first
+    ('ix_climbs_user_id_gym_id_created_at', '(user_id, gym_id, created_at)'),
+]
+
+
+def _create_partitioned_index(conn, name: str, table: str, columns: str) -> None:
+    # CONCURRENTLY is not allowed on a partitioned parent: build an invalid
+    # parent index, build each partition's index concurrently, attach them.
+    op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {columns}")
+    partitions = conn.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table)"
+    ), {"table": table}).scalars().all()
+    for partition in partitions:
+        child = f"{partition}_{name}"[:63]
+        op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition} {columns}")
+        op.execute(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES:
+            _create_partitioned_index(conn, name, 'climbs', columns)
+
+
+def downgrade() -> None:
+    for name, _ in INDEXES:
+        op.drop_index(name, table_name='climbs')
@@ -0,0 +1,45 @@
+"""add climb_imports
+
+Revision ID: cf6143f7613e
+Revises: b8b1faa0f185
+Create Date: 2026-10-19 16:12:04.518327
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'cf6143f7613e'
+down_revision: Union[str, None] = 'b8b1faa0f185'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('climb_imports',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('job_id', sa.BigInteger(), nullable=True),
+    sa.Column('filename', sa.String(length=255), nullable=True),
+    sa.Column('status', sa.String(length=20), server_default='queued', nullable=False),
+    sa.Column('total_rows', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('processed_rows', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('imported_rows', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('duplicate_rows', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('error_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('errors', postgresql.JSONB(astext_type=sa.Text()), server_default=sa.text("'[]'::jsonb"), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_climb_imports_user_id'), 'climb_imports', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_climb_imports_user_id'), table_name='climb_imports')
+    op.drop_table('climb_imports')
@@ -0,0 +1,85 @@
+"""add performance indexes
+
+Revision ID: ea6fa3ef1ea5
+Revises: 6c6d1d6581b5
+Create Date: 2026-10-19 09:12:04.183201
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ea6fa3ef1ea5'
+down_revision: Union[str, None] = '6c6d1d6581b5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# CREATE INDEX CONCURRENTLY cannot run inside a transaction, so every
+# statement here goes through an autocommit block. IF [NOT] EXISTS keeps
+# the revision re-runnable after a build was interrupted half way.
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        # crud.get_user_climbs / /average_grade/: user_id = ? [AND created_at range] ORDER BY created_at DESC
+        op.create_index(
+            'ix_climbs_user_id_created_at', 'climbs', ['user_id', 'created_at'],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        # Flash views only ever look at attempts = 1, so keep that index small
+        op.create_index(
+            'ix_climbs_user_id_flashes', 'climbs', ['user_id', 'created_at'],
+            postgresql_where=sa.text('attempts = 1'),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        # FK lookups from gyms back to their climbs
+        op.create_index(
+            'ix_climbs_gym_id', 'climbs', ['gym_id'],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        # crud.get_user_gyms and the gym ownership check in /add_climb/
+        op.create_index(
+            'ix_gyms_user_id', 'gyms', ['user_id'],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        # crud.get_user_projects: user_id = ? ORDER BY created_at DESC.
+        # Supersedes the single column ix_projects_user_id.
+        op.create_index(
+            'ix_projects_user_id_created_at', 'projects', ['user_id', 'created_at'],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index(
+            'ix_projects_user_id', table_name='projects',
+            postgresql_concurrently=True, if_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_projects_user_id', 'projects', ['user_id'],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index(
+            'ix_projects_user_id_created_at', table_name='projects',
+            postgresql_concurrently=True, if_exists=True,
+        )
+        op.drop_index(
+            'ix_gyms_user_id', table_name='gyms',
+            postgresql_concurrently=True, if_exists=True,
+        )
+        op.drop_index(
+            'ix_climbs_gym_id', table_name='climbs',
+            postgresql_concurrently=True, if_exists=True,
+        )
+        op.drop_index(
+            'ix_climbs_user_id_flashes', table_name='climbs',
+            postgresql_concurrently=True, if_exists=True,
+        )
+        op.drop_index(
+            'ix_climbs_user_id_created_at', table_name='climbs',
+            postgresql_concurrently=True, if_exists=True,
+        )
@@ -0,0 +1,64 @@
+"""add updated_at and tombstones for delta sync
+
+Revision ID: fd9cddc23b71
+Revises: b49591e5df63
+Create Date: 2026-10-19 12:03:58.210447
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'fd9cddc23b71'
+down_revision: Union[str, None] = 'b49591e5df63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLES = ['climbs', 'gyms', 'projects']
+
+
+def _create_partitioned_index(conn, name: str, table: str, columns: str) -> None:
+    # CONCURRENTLY is not allowed on a partitioned parent: build an invalid
+    # parent index, build each partition's index concurrently, attach them.
+    op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {columns}")
+    partitions = conn.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table)"
+    ), {"table": table}).scalars().all()
+    for partition in partitions:
+        child = f"{partition}_{name}"[:63]
+        op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition} {columns}")
+        op.execute(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+
+
+def upgrade() -> None:
+    # now() is stable, so these defaults are stored once in the catalog
+    # rather than rewriting the tables. Existing rows look "updated" at
+    # migration time, which just means the first sync is a full one.
+    for table in TABLES:
+        op.add_column(table, sa.Column(
+            'updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False,
+        ))
+        op.add_column(table, sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=True))
+
+    conn = op.get_bind()
+    with op.get_context().autocommit_block():
+        _create_partitioned_index(conn, 'ix_climbs_user_id_updated_at', 'climbs', '(user_id, updated_at)')
+        for table in ('gyms', 'projects'):
+            op.create_index(
+                f'ix_{table}_user_id_updated_at', table, ['user_id', 'updated_at'],
+                postgresql_concurrently=True, if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_climbs_user_id_updated_at', table_name='climbs')
+    for table in ('gyms', 'projects'):
+        op.drop_index(f'ix_{table}_user_id_updated_at', table_name=table)
+    for table in TABLES:
+        op.drop_column(table, 'deleted_at')
+        op.drop_column(table, 'updated_at')
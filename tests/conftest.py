@@ -0,0 +1,180 @@
+"""
+Shared fixtures.
+
+Tests that need Postgres take ``pg_engine`` or ``db`` and are skipped
+when TEST_DATABASE_URL can't be reached. The schema is dropped and
+rebuilt with create_all (as app.main does), so point it at a scratch
+database:
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost/flashed_test pytest
+
+TEST_SHARD_URL is a second scratch database, run as shard 1. When it
+can't be reached the suite runs with shard 0 only and the tests that
+need two shards (``second_shard``) are skipped.
+"""
+import os
+from typing import NamedTuple
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "postgresql://postgres@localhost/flashed_test")
+TEST_SHARD_URL = os.getenv("TEST_SHARD_URL", "postgresql://postgres@localhost/flashed_test_shard1")
+
+# Before anything imports app.database
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+os.environ["SHARD_URLS"] = TEST_SHARD_URL
+os.environ.pop("DATABASE_REPLICA_URL", None)
+os.environ["CACHE_URL"] = "memory://"
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    from app.cache import LRUBackend, cache
+    cache.backend = LRUBackend()
+    cache.available = True
+    yield cache
+
+
+@pytest.fixture(scope="session")
+def pg_engine():
+    from sqlalchemy.exc import OperationalError
+
+    from app import models, partitions  # noqa: F401 (registers the tables)
+    from app.database import Base, engine, shard_engines, shard_sessions
+
+    try:
+        with engine.connect():
+            pass
+    except OperationalError as e:
+        pytest.skip(f"Postgres not reachable at {TEST_DATABASE_URL}: {e}")
+    try:
+        with shard_engines[1].connect():
+            pass
+    except OperationalError:
+        # Every module shares these lists, so this leaves a one-shard app
+        del shard_engines[1:], shard_sessions[1:]
+
+    for shard_engine in shard_engines:
+        Base.metadata.drop_all(shard_engine)
+        Base.metadata.create_all(shard_engine)
+        partitions.ensure_climbs_partitions(shard_engine)
+    yield engine
+    for shard_engine in shard_engines:
+        Base.metadata.drop_all(shard_engine)
+
+
+@pytest.fixture
+def second_shard(pg_engine):
+    """Shard 1's engine; skips unless TEST_SHARD_URL can be reached."""
+    from app.database import shard_engines
+
+    if len(shard_engines) < 2:
+        pytest.skip(f"second shard not reachable at {TEST_SHARD_URL}")
+    return shard_engines[1]
+
+
+def truncate_all() -> None:
+    from sqlalchemy import text
+
+    from app.database import Base, shard_engines
+
+    names = ", ".join(table.name for table in Base.metadata.sorted_tables)
+    for shard_engine in shard_engines:
+        with shard_engine.begin() as conn:
+            conn.execute(text(f"TRUNCATE {names} RESTART IDENTITY CASCADE"))
+
+
+@pytest.fixture
+def db(pg_engine):
+    from app.database import SessionLocal
+
+    session = SessionLocal()
+    yield session
+    session.close()
+    # Code under test opens sessions of its own, so clean up by truncating
+    truncate_all()
+
+
+@pytest.fixture
+def make_user(db):
+    from app import models, shards
+
+    def make(email: str = "climber@example.com", **values) -> models.User:
+        user = models.User(
+            first_name="Test", last_name="Climber", email=email, password_hash="x",
+            location="Wellington", grade_style="V-Scale", **values,
+        )
+        db.add(user)
+        db.flush()
+        shards.register_user(db, user.id, 0, email)
+        db.commit()
+        return user
+
+    return make
+
+
+@pytest.fixture
+def explain(db):
+    """
+    Runs ``fn(db)`` and returns the plans of the statements it sent as a
+    ``Plan``: the indexes they use and the tables they scan sequentially.
+    Partitions are reported as their parent table or index. The planner
+    picks by the statistics, so seed enough rows and ANALYZE first.
+    """
+    from sqlalchemy import event
+
+    def run(fn) -> Plan:
+        statements = []
+        connection = db.connection()
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT"):
+                statements.append((statement, parameters))
+
+        event.listen(connection, "before_cursor_execute", capture)
+        try:
+            fn(db)
+        finally:
+            event.remove(connection, "before_cursor_execute", capture)
+
+        indexes, seq_scans = set(), set()
+        for statement, parameters in statements:
+            plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+            for node in _plan_nodes(plan):
+                if "Index Name" in node:
+                    indexes.add(_parent(db, node["Index Name"]))
+                if node.get("Node Type") == "Seq Scan":
+                    seq_scans.add(_parent(db, node["Relation Name"]))
+        return Plan(indexes, seq_scans)
+
+    return run
+
+
+class Plan(NamedTuple):
+    indexes: set
+    seq_scans: set
+
+
+def _plan_nodes(node):
+    if isinstance(node, dict):
+        if "Node Type" in node:
+            yield node
+        for value in node.values():
+            yield from _plan_nodes(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _plan_nodes(value)
+
+
+def _parent(db, name: str) -> str:
+    from sqlalchemy import text
+
+    parent = db.execute(text("""
+        SELECT p.relname FROM pg_inherits i
+          JOIN pg_class c ON c.oid = i.inhrelid
+          JOIN pg_class p ON p.oid = i.inhparent
+         WHERE c.relname = :name
+    """), {"name": name}).scalar()
+    return parent or name
@@ -0,0 +1,198 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException  # noqa: E402
+
+from app import admission  # noqa: E402
+from app.admission import ConcurrencyLimiter, TokenBucketLimiter  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Only admission's view of time; asyncio keeps the real clock
+    monkeypatch.setattr(admission, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def request_from(host: str):
+    return SimpleNamespace(client=SimpleNamespace(host=host), headers={})
+
+
+# -------------------------------------------------
+# Token bucket
+# -------------------------------------------------
+
+def test_bucket_allows_a_burst_then_asks_to_wait(clock):
+    bucket = TokenBucketLimiter(rate=1, burst=3)
+    assert [bucket.take("a") for _ in range(3)] == [0, 0, 0]
+    assert bucket.take("a") == pytest.approx(1.0)
+
+
+def test_bucket_refills_at_rate(clock):
+    bucket = TokenBucketLimiter(rate=2, burst=2)
+    bucket.take("a")
+    bucket.take("a")
+    assert bucket.take("a") == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.take("a") == 0
+    # Refill is capped at the burst
+    clock.now += 60
+    assert [bucket.take("a") for _ in range(2)] == [0, 0]
+    assert bucket.take("a") > 0
+
+
+def test_buckets_are_per_client_and_bounded(clock):
+    bucket = TokenBucketLimiter(rate=1, burst=1, max_clients=2)
+    assert bucket.take("a") == 0
+    assert bucket.take("b") == 0
+    assert bucket.take("a") > 0
+    bucket.take("c")
+    # "b" was least recently seen, so it was evicted and starts full
+    assert bucket.take("b") == 0
+
+
+def test_guard_rejects_with_429_and_retry_after(clock, monkeypatch):
+    monkeypatch.setenv("TEST429_RATE_PER_MINUTE", "60")
+    monkeypatch.setenv("TEST429_RATE_BURST", "1")
+    dependency = admission.guard("test429")
+
+    async def call():
+        gen = dependency(request_from("1.2.3.4"))
+        await gen.__anext__()
+        await gen.aclose()
+
+    asyncio.run(call())
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(call())
+    assert rejected.value.status_code == 429
+    assert rejected.value.headers["Retry-After"] == "1"
+
+    # A token back after a second
+    clock.now += 1
+    asyncio.run(call())
+
+
+# -------------------------------------------------
+# Concurrency limit and queue
+# -------------------------------------------------
+
+def test_full_queue_is_rejected_at_once_with_503():
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", limit=1, max_queue=1, queue_timeout=5)
+        await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.waiting == 1
+
+        with pytest.raises(HTTPException) as rejected:
+            await limiter.acquire()
+        assert rejected.value.status_code == 503
+        assert rejected.value.headers["Retry-After"] == "5"
+        assert limiter.rejected == 1
+
+        limiter.release()
+        await queued
+        assert limiter.stats() == {"limit": 1, "in_flight": 1, "waiting": 0, "rejected": 1}
+        limiter.release()
+
+    asyncio.run(scenario())
+
+
+def test_queue_wait_times_out_with_503():
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", limit=1, max_queue=5, queue_timeout=0.05)
+        await limiter.acquire()
+        with pytest.raises(HTTPException) as rejected:
+            await limiter.acquire()
+        assert rejected.value.status_code == 503
+        assert rejected.value.headers["Retry-After"] == "1"
+        assert limiter.waiting == 0
+        assert limiter.in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_slots_are_handed_to_waiters_in_turn():
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", limit=2, max_queue=10, queue_timeout=1)
+        peak = 0
+
+        async def work():
+            nonlocal peak
+            await limiter.acquire()
+            try:
+                peak = max(peak, limiter.in_flight)
+                await asyncio.sleep(0.01)
+            finally:
+                limiter.release()
+
+        await asyncio.gather(*(work() for _ in range(8)))
+        assert peak == 2
+        assert limiter.rejected == 0
+
+    asyncio.run(scenario())
+
+
+class LateSemaphore:
+    """Takes the permit even when its wait is cancelled, as a racing acquire can."""
+
+    def __init__(self):
+        self.released = 0
+
+    async def acquire(self):
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            pass
+        return True
+
+    def release(self):
+        self.released += 1
+
+
+def test_a_permit_won_after_the_timeout_is_handed_back():
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", limit=1, max_queue=5, queue_timeout=0.01)
+        limiter._semaphore = LateSemaphore()
+        with pytest.raises(HTTPException) as rejected:
+            await limiter.acquire()
+        assert rejected.value.status_code == 503
+        # The cancel, then the done callback, each take a tick
+        await asyncio.sleep(0.01)
+        assert limiter._semaphore.released == 1
+        assert limiter.stats() == {"limit": 1, "in_flight": 0, "waiting": 0, "rejected": 1}
+
+    asyncio.run(scenario())
+
+
+def test_a_cancelled_waiter_leaves_the_slot_for_the_next():
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", limit=1, max_queue=5, queue_timeout=5)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        # Freed and cancelled in the same tick: the client went away
+        limiter.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.waiting == 0
+
+        await asyncio.wait_for(limiter.acquire(), 1)
+        assert limiter.in_flight == 1
+
+    asyncio.run(scenario())
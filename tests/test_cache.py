@@ -0,0 +1,283 @@
+import socketserver
+import threading
+import time
+
+import pytest
+
+from app.cache import Cache, CacheUnavailable, LRUBackend, RedisBackend, stale_read
+
+
+@pytest.fixture
+def lru_cache():
+    return Cache(LRUBackend(), prefix="test")
+
+
+# -------------------------------------------------
+# Namespaces and versioned invalidation
+# -------------------------------------------------
+
+def test_invalidate_orphans_every_key_in_the_namespace(lru_cache):
+    lru_cache.set("user:1", "snapshot", {"name": "Ella"})
+    lru_cache.set("user:1", "stats", [1, 2])
+    lru_cache.set("user:2", "snapshot", {"name": "Tom"})
+
+    lru_cache.invalidate("user:1")
+
+    assert lru_cache.get("user:1", "snapshot") is None
+    assert lru_cache.get("user:1", "stats") is None
+    assert lru_cache.get("user:2", "snapshot") == {"name": "Tom"}
+
+
+def test_keys_carry_the_namespace_version(lru_cache):
+    assert lru_cache.key("gym:3", "grade_ranges") == "test:gym:3:v0:grade_ranges"
+    lru_cache.invalidate("gym:3")
+    assert lru_cache.key("gym:3", "grade_ranges") == "test:gym:3:v1:grade_ranges"
+
+
+def test_get_or_set_reloads_after_invalidate(lru_cache):
+    loads = []
+    def loader():
+        loads.append(1)
+        return len(loads)
+
+    assert lru_cache.get_or_set("user:1", "count", loader) == 1
+    assert lru_cache.get_or_set("user:1", "count", loader) == 1
+    lru_cache.invalidate("user:1")
+    assert lru_cache.get_or_set("user:1", "count", loader) == 2
+
+
+
+def test_replica_reads_right_after_a_write_are_not_cached(lru_cache):
+    loads = []
+    def replica_loader():
+        loads.append(1)
+        stale_read.set(True)
+        return len(loads)
+
+    # Nothing written lately: a replica read is as good as any
+    assert lru_cache.get_or_set("user:1", "count", replica_loader) == 1
+    assert lru_cache.get_or_set("user:1", "count", replica_loader) == 1
+
+    lru_cache.invalidate("user:1")
+    assert lru_cache.get_or_set("user:1", "count", replica_loader) == 2
+    assert lru_cache.get_or_set("user:1", "count", replica_loader) == 3
+    # The flag doesn't outlive the load
+    assert stale_read.get() is False
+    # A primary read is stored as usual
+    assert lru_cache.get_or_set("user:1", "count", lambda: 10) == 10
+    assert lru_cache.get_or_set("user:1", "count", replica_loader) == 10
+
+def test_lru_evicts_least_recently_used_and_expires():
+    backend = LRUBackend(max_entries=2)
+    backend.set("a", b"1")
+    backend.set("b", b"2")
+    backend.get("a")
+    backend.set("c", b"3")
+    assert backend.get("b") is None
+    assert backend.get("a") == b"1"
+
+    backend.set("short", b"x", ttl=0.01)
+    time.sleep(0.02)
+    assert backend.get("short") is None
+
+
+# -------------------------------------------------
+# Single-flight
+# -------------------------------------------------
+
+def test_get_or_set_loads_once_for_concurrent_callers(lru_cache):
+    calls = []
+    started = threading.Event()
+
+    def slow_loader():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return "value"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(lru_cache.get_or_set("ns", "k", slow_loader)))
+        for _ in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ["value"] * 20
+    # Every caller has left, so nothing is kept per key
+    assert lru_cache._flights == {}
+
+
+def test_flight_lock_is_shared_until_the_last_caller_leaves(lru_cache):
+    first = lru_cache._join_flight("k")
+    second = lru_cache._join_flight("k")
+    assert first is second
+    lru_cache._leave_flight("k")
+    # Still in use by one caller: a newcomer must get the same lock
+    assert lru_cache._join_flight("k") is first
+    lru_cache._leave_flight("k")
+    lru_cache._leave_flight("k")
+    assert "k" not in lru_cache._flights
+
+
+def test_loader_error_releases_the_flight(lru_cache):
+    def broken():
+        raise RuntimeError("db down")
+
+    with pytest.raises(RuntimeError):
+        lru_cache.get_or_set("ns", "k", broken)
+    assert lru_cache._flights == {}
+    assert lru_cache.get_or_set("ns", "k", lambda: 7) == 7
+
+
+# -------------------------------------------------
+# RESP backend against a fake server
+# -------------------------------------------------
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    """Just the commands RedisBackend sends, over real RESP."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeRedisHandler)
+        self.data: dict[bytes, tuple[bytes, float]] = {}
+        self.commands: list[list[bytes]] = []
+        self.lock = threading.Lock()
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        assert line[:1] == b"*"
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def live(self, key):
+        entry = self.server.data.get(key)
+        if entry and entry[1] and entry[1] <= time.monotonic():
+            del self.server.data[key]
+            return None
+        return entry[0] if entry else None
+
+    def reply(self, value):
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(value, int):
+            self.wfile.write(b":%d\r\n" % value)
+        elif isinstance(value, bytes):
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+        else:
+            self.wfile.write(f"+{value}\r\n".encode())
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            self.server.commands.append(args)
+            name, rest = args[0].upper(), args[1:]
+            with self.server.lock:
+                if name == b"PING":
+                    self.reply("PONG")
+                elif name in (b"AUTH", b"SELECT"):
+                    self.reply("OK")
+                elif name == b"GET":
+                    self.reply(self.live(rest[0]))
+                elif name == b"SET":
+                    key, value, options = rest[0], rest[1], [arg.upper() for arg in rest[2:]]
+                    if b"NX" in options and self.live(key) is not None:
+                        self.reply(None)
+                        continue
+                    expires = 0
+                    if b"PX" in options:
+                        expires = time.monotonic() + int(rest[2 + options.index(b"PX") + 1]) / 1000
+                    self.server.data[key] = (value, expires)
+                    self.reply("OK")
+                elif name == b"DEL":
+                    self.reply(1 if self.server.data.pop(rest[0], None) else 0)
+                elif name == b"INCR":
+                    value = int(self.live(rest[0]) or 0) + 1
+                    self.server.data[rest[0]] = (str(value).encode(), 0)
+                    self.reply(value)
+                else:
+                    self.wfile.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture
+def fake_redis():
+    server = FakeRedis()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def redis_url(server, path="") -> str:
+    host, port = server.server_address
+    return f"redis://{host}:{port}{path}"
+
+
+def test_redis_backend_commands(fake_redis):
+    backend = RedisBackend(redis_url(fake_redis))
+    assert backend.ping()
+    assert backend.get("missing") is None
+    backend.set("k", b"v")
+    assert backend.get("k") == b"v"
+    assert backend.add("k", b"other") is False
+    assert backend.add("fresh", b"1", ttl=5) is True
+    assert backend.incr("n") == 1
+    assert backend.incr("n") == 2
+    backend.delete("k")
+    assert backend.get("k") is None
+
+
+def test_redis_backend_ttl_is_sent_in_milliseconds(fake_redis):
+    backend = RedisBackend(redis_url(fake_redis))
+    backend.set("k", b"v", ttl=0.05)
+    assert fake_redis.commands[-1] == [b"SET", b"k", b"v", b"PX", b"50"]
+    time.sleep(0.1)
+    assert backend.get("k") is None
+
+
+def test_redis_backend_selects_db_and_authenticates(fake_redis):
+    host, port = fake_redis.server_address
+    backend = RedisBackend(f"redis://:secret@{host}:{port}/2")
+    backend.ping()
+    assert fake_redis.commands[:2] == [[b"AUTH", b"secret"], [b"SELECT", b"2"]]
+
+
+def test_cache_over_redis_shares_values_between_instances(fake_redis):
+    # Two workers, one server
+    first = Cache(RedisBackend(redis_url(fake_redis)), prefix="test")
+    second = Cache(RedisBackend(redis_url(fake_redis)), prefix="test")
+    first.set("user:1", "snapshot", {"id": 1})
+    assert second.get("user:1", "snapshot") == {"id": 1}
+    second.invalidate("user:1")
+    assert first.get("user:1", "snapshot") is None
+    assert first.get_or_set("user:1", "snapshot", lambda: {"id": 1, "v": 2}) == {"id": 1, "v": 2}
+    assert second.get("user:1", "snapshot") == {"id": 1, "v": 2}
+
+
+def test_unreachable_server_is_a_miss_not_an_error(fake_redis):
+    host, port = fake_redis.server_address
+    fake_redis.shutdown()
+    fake_redis.server_close()
+    backend = RedisBackend(f"redis://{host}:{port}", timeout=0.1)
+    with pytest.raises(CacheUnavailable):
+        backend.get("k")
+
+    cache = Cache(backend, prefix="test")
+    assert cache.get("ns", "k", default="fallback") == "fallback"
+    assert cache.get_or_set("ns", "k", lambda: 3) == 3
+    assert cache.available is False
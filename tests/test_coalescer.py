@@ -0,0 +1,95 @@
+import threading
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from app import coalescer  # noqa: E402
+from app.coalescer import GroupCommitPending, GroupCommitTimeout, WriteCoalescer  # noqa: E402
+
+
+class Flush:
+    """Records batches; ``gate`` holds a flush until the test opens it."""
+
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+
+    def __call__(self, rows):
+        self.started.set()
+        self.gate.wait()
+        self.batches.append(list(rows))
+        if any(row["n"] == self.fail_on for row in rows):
+            raise ValueError("bad row")
+        return [{"id": row["n"]} for row in rows]
+
+
+@pytest.fixture
+def short_timeout(monkeypatch):
+    monkeypatch.setattr(coalescer, "GROUP_COMMIT_TIMEOUT_SECONDS", 0.1)
+
+
+def submit_all(writer, count):
+    results = [None] * count
+
+    def submit(n):
+        try:
+            results[n] = writer.submit({"n": n})
+        except Exception as e:
+            results[n] = e
+
+    threads = [threading.Thread(target=submit, args=(n,)) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_rows_share_a_batch():
+    flush = Flush()
+    writer = WriteCoalescer(flush, max_batch=50, max_wait_ms=50, flushers=1)
+    results = submit_all(writer, 20)
+    assert results == [{"id": n} for n in range(20)]
+    assert len(flush.batches) < 20
+
+
+def test_a_bad_row_only_fails_its_caller():
+    flush = Flush(fail_on=3)
+    writer = WriteCoalescer(flush, max_batch=50, max_wait_ms=50, flushers=1)
+    results = submit_all(writer, 6)
+    assert isinstance(results[3], ValueError)
+    assert [r for n, r in enumerate(results) if n != 3] == [{"id": n} for n in (0, 1, 2, 4, 5)]
+
+
+def test_timed_out_row_is_withdrawn_unwritten(short_timeout):
+    flush = Flush()
+    flush.gate.clear()
+    writer = WriteCoalescer(flush, max_batch=1, max_wait_ms=0, flushers=1)
+    # The only flusher is stuck on the first row...
+    first = threading.Thread(target=lambda: writer.submit({"n": 1}))
+    first.start()
+    flush.started.wait()
+    # ...so the second is still queued when its caller gives up
+    with pytest.raises(GroupCommitTimeout):
+        writer.submit({"n": 2})
+
+    flush.gate.set()
+    first.join()
+    writer.submit({"n": 3})
+    assert flush.batches == [[{"n": 1}], [{"n": 3}]]
+
+
+def test_row_being_written_is_reported_pending(short_timeout):
+    flush = Flush()
+    flush.gate.clear()
+    writer = WriteCoalescer(flush, max_batch=1, max_wait_ms=0, flushers=1)
+    with pytest.raises(GroupCommitPending):
+        writer.submit({"n": 1})
+    # It does get written
+    flush.gate.set()
+    assert writer.submit({"n": 2}) == {"id": 2}
+    assert flush.batches == [[{"n": 1}], [{"n": 2}]]
@@ -0,0 +1,84 @@
+import asyncio
+import gzip
+import json
+
+from app.compression import CompressionMiddleware
+
+
+def json_app(headers: list[tuple[bytes, bytes]]):
+    body = json.dumps([{"grade": "V4"}] * 200).encode()
+
+    async def app(scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + headers,
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    return app, body
+
+
+def call(app, accept_encoding: bytes = b"gzip", minimum_size: int = 1024) -> tuple[dict, bytes]:
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", accept_encoding)]}
+    asyncio.run(CompressionMiddleware(app, minimum_size)(scope, None, send))
+    start, *bodies = messages
+    headers = {}
+    for key, value in start["headers"]:
+        headers.setdefault(key.decode(), []).append(value.decode())
+    return headers, b"".join(message.get("body", b"") for message in bodies)
+
+
+def test_gzips_json_and_varies_on_accept_encoding():
+    app, body = json_app([])
+    headers, compressed = call(app)
+    assert headers["content-encoding"] == ["gzip"]
+    assert headers["vary"] == ["Accept-Encoding"]
+    assert gzip.decompress(compressed) == body
+
+
+def test_keeps_the_routes_vary_values():
+    app, _ = json_app([(b"vary", b"Origin"), (b"Vary", b"Authorization, Cookie")])
+    headers, _ = call(app)
+    assert headers["vary"] == ["Origin, Authorization, Cookie, Accept-Encoding"]
+
+
+def test_does_not_repeat_accept_encoding_or_widen_a_star():
+    app, _ = json_app([(b"vary", b"accept-encoding, Origin")])
+    assert call(app)[0]["vary"] == ["accept-encoding, Origin"]
+
+    app, _ = json_app([(b"vary", b"*")])
+    assert call(app)[0]["vary"] == ["*"]
+
+
+
+def test_small_bodies_pass_through_but_vary_on_accept_encoding():
+    app, body = json_app([(b"vary", b"Origin")])
+    headers, sent = call(app, minimum_size=len(body) + 1)
+    assert "content-encoding" not in headers
+    assert headers["content-length"] == [str(len(body))]
+    assert headers["vary"] == ["Origin, Accept-Encoding"]
+    assert sent == body
+
+
+def test_clients_without_gzip_get_identity_with_vary():
+    app, body = json_app([])
+    headers, sent = call(app, accept_encoding=b"identity")
+    assert "content-encoding" not in headers
+    assert headers["vary"] == ["Accept-Encoding"]
+    assert sent == body
+
+
+def test_responses_that_cannot_be_compressed_are_untouched():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"image/png")]})
+        await send({"type": "http.response.body", "body": b"\x89PNG" * 500})
+
+    headers, _ = call(app)
+    assert "vary" not in headers
+    assert "content-encoding" not in headers
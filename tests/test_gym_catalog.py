@@ -0,0 +1,84 @@
+import importlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import text  # noqa: E402
+
+from app import gym_catalog, models  # noqa: E402
+from migrations import online  # noqa: E402
+
+BANDS = [{"label": "Blue", "lo": 0, "hi": 3}]
+OTHER_BANDS = [{"label": "Red", "lo": 2, "hi": 5}]
+
+
+def test_find_or_create_matches_on_the_normalized_name(db):
+    first_id, first_ranges = gym_catalog.find_or_create("  Beta   BLOC ", BANDS)
+    second_id, second_ranges = gym_catalog.find_or_create("beta bloc", OTHER_BANDS)
+
+    assert second_id == first_id
+    # The first user's bands seed the entry
+    assert first_ranges == second_ranges == BANDS
+    entry = gym_catalog.get_entry(first_id)
+    assert (entry.name, entry.normalized_name) == ("Beta   BLOC", "beta bloc")
+    assert gym_catalog.find_or_create("Beta Bloc Two")[0] != first_id
+
+
+def test_effective_grade_ranges_fall_back_to_the_catalog(db, make_user):
+    user = make_user()
+    catalog_id, _ = gym_catalog.find_or_create("Beta Bloc", BANDS)
+    inherits = models.Gym(name="Beta Bloc", user_id=user.id, catalog_id=catalog_id)
+    overrides = models.Gym(name="Beta Bloc", user_id=user.id, catalog_id=catalog_id, grade_ranges=OTHER_BANDS)
+    uncataloged = models.Gym(name="Home Wall", user_id=user.id)
+    db.add_all([inherits, overrides, uncataloged])
+    db.commit()
+
+    assert inherits.grade_ranges is None
+    assert inherits.effective_grade_ranges == BANDS
+    assert overrides.effective_grade_ranges == OTHER_BANDS
+    assert uncataloged.effective_grade_ranges == []
+
+
+def test_migration_links_existing_gyms_to_the_catalog(pg_engine, db, make_user):
+    pytest.importorskip("alembic")
+    migration = importlib.import_module("migrations.versions.5e83ce65cb9e_add_gym_catalog")
+    users = [make_user(email=f"climber{n}@example.com") for n in range(3)]
+    now = datetime.now(timezone.utc)
+    # Gyms as the old code wrote them: a full copy each, no catalog entry
+    gyms = [
+        models.Gym(name="Beta Bloc", user_id=users[0].id, grade_ranges=BANDS, created_at=now - timedelta(days=3)),
+        models.Gym(name=" beta  BLOC", user_id=users[1].id, grade_ranges=BANDS, created_at=now - timedelta(days=2)),
+        models.Gym(name="BETA BLOC", user_id=users[2].id, grade_ranges=OTHER_BANDS, created_at=now - timedelta(days=4)),
+        models.Gym(name="Home Wall", user_id=users[0].id, grade_ranges=[], created_at=now),
+    ]
+    db.add_all(gyms)
+    db.commit()
+
+    with pg_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(migration.FILL_CATALOG))
+        online.backfill(conn, "gyms_catalog_id", "gyms", set_sql=migration.LINK_GYMS, where="catalog_id IS NULL")
+        online.reset_backfill(conn, "gyms_catalog_id")
+        catalog = {
+            normalized: (entry_id, name, ranges)
+            for entry_id, name, normalized, ranges in conn.execute(text(
+                "SELECT id, name, normalized_name, grade_ranges FROM gym_catalog"
+            ))
+        }
+        linked = {
+            gym_id: (catalog_id, ranges)
+            for gym_id, catalog_id, ranges in conn.execute(text("SELECT id, catalog_id, grade_ranges FROM gyms"))
+        }
+
+    # The bands most users have win, with the oldest of those gyms' spelling
+    assert catalog["beta bloc"][1:] == ("Beta Bloc", BANDS)
+    assert catalog["home wall"][1:] == ("Home Wall", [])
+    beta_bloc, home_wall = catalog["beta bloc"][0], catalog["home wall"][0]
+    assert linked == {
+        gyms[0].id: (beta_bloc, None),
+        gyms[1].id: (beta_bloc, None),
+        # Bands that differ stay as the user's override
+        gyms[2].id: (beta_bloc, OTHER_BANDS),
+        gyms[3].id: (home_wall, None),
+    }
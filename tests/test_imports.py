@@ -0,0 +1,47 @@
+import io
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("fastapi")
+
+from sqlalchemy import text  # noqa: E402
+
+from app import imports, models  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+
+CSV = "\ufeffGrade,Scale,Date,Attempts\nV3,VScale,2026-01-05T10:00:00,2\nV5,VScale,,1\nV99,VScale,,1\n"
+
+
+def test_import_reads_the_upload_back_from_the_database(db, make_user, monkeypatch):
+    # Small chunks, so rows (and the BOM) span chunk boundaries
+    monkeypatch.setattr(imports, "IMPORT_SPOOL_CHUNK_BYTES", 7)
+    user = make_user()
+    record = models.ClimbImport(user_id=user.id)
+    db.add(record)
+    db.flush()
+    assert imports.spool_upload(db, record.id, io.BytesIO(CSV.encode())) == 3
+    db.commit()
+    assert db.execute(text("SELECT count(*) FROM climb_import_chunks")).scalar() > 1
+
+    # As a worker on another node would: nothing but the database
+    with SessionLocal() as worker:
+        result = imports.run_import(worker, record.id)
+        imports.discard_upload(worker, record.id)
+
+    assert result["status"] == "done"
+    assert (result["processed_rows"], result["imported_rows"], result["error_count"]) == (3, 2, 1)
+    assert db.execute(text("SELECT original_grade FROM climbs ORDER BY internal_grade")).scalars().all() == ["V3", "V5"]
+    assert db.execute(text("SELECT count(*) FROM climb_import_chunks")).scalar() == 0
+
+
+def test_oversized_upload_is_refused(db, make_user, monkeypatch):
+    from fastapi import HTTPException
+
+    monkeypatch.setattr(imports, "IMPORT_MAX_BYTES", 10)
+    record = models.ClimbImport(user_id=make_user().id)
+    db.add(record)
+    db.flush()
+    with pytest.raises(HTTPException) as raised:
+        imports.spool_upload(db, record.id, io.BytesIO(CSV.encode()))
+    assert raised.value.status_code == 413
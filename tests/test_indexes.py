@@ -0,0 +1,115 @@
+"""
+Each hot crud query reads one user's rows through an index
+(migration ea6fa3ef1ea5, plus the filter indexes of b8b1faa0f185).
+
+The tables are filled with other users' rows and analyzed, so the
+planner weighs real statistics. Which of the indexes that lead with
+user_id it picks is its call, so the tests accept any that keeps the
+read to the user's rows, and check that nothing is scanned in full.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import text  # noqa: E402
+
+from app import crud, models, schemas  # noqa: E402
+
+OTHER_USERS = 2000
+
+BACKGROUND = [
+    f"""
+    INSERT INTO users (first_name, last_name, email, password_hash, location, grade_style,
+                       onboarding_complete, auth_provider, notifications_enabled)
+    SELECT 'Other', 'Climber', 'other' || n || '@example.com', 'x', 'Wellington', 'V-Scale', true, 'email', true
+      FROM generate_series(1, {OTHER_USERS}) AS n
+    """,
+    """
+    INSERT INTO gyms (name, user_id, is_default)
+    SELECT 'Gym ' || (u.id % 50 + n), u.id, false
+      FROM users u CROSS JOIN generate_series(1, 2) AS n WHERE u.email LIKE 'other%'
+    """,
+    """
+    INSERT INTO projects (user_id, is_active, total_moves, total_moves_completed, notes, moves, sessions)
+    SELECT u.id, true, 0, 0, '{}', '[]', '[]'
+      FROM users u CROSS JOIN generate_series(1, 2) AS n WHERE u.email LIKE 'other%'
+    """,
+    """
+    INSERT INTO climbs (user_id, internal_grade, original_grade, original_scale, attempts, created_at)
+    SELECT u.id, n % 12, 'V' || (n % 12), 'V-Scale', 1 + n % 4, now() - make_interval(hours => n)
+      FROM users u CROSS JOIN generate_series(1, 20) AS n WHERE u.email LIKE 'other%'
+    """,
+    "ANALYZE users, gyms, projects, climbs",
+]
+
+# Any of these keeps a climbs read to the one user's rows
+USER_CLIMB_INDEXES = {
+    "ix_climbs_user_id_created_at",
+    "ix_climbs_user_id_flashes",
+    "ix_climbs_user_id_updated_at",
+    "ix_climbs_user_id_internal_grade",
+    "ix_climbs_user_id_gym_id_created_at",
+}
+
+
+@pytest.fixture
+def climber(db, make_user):
+    user = make_user()
+    gym = models.Gym(name="Beta Bloc", user_id=user.id)
+    db.add(gym)
+    db.flush()
+    now = datetime.now(timezone.utc)
+    db.add_all([
+        models.Climb(
+            user_id=user.id, gym_id=gym.id, internal_grade=grade, original_grade=f"V{grade}",
+            original_scale="V-Scale", attempts=attempts, created_at=now - timedelta(hours=grade),
+        )
+        for grade in range(1, 8) for attempts in (1, 3)
+    ])
+    db.add(models.Project(user_id=user.id))
+    for statement in BACKGROUND:
+        db.execute(text(statement))
+    db.commit()
+    return user
+
+
+def climbs(user, **filters):
+    def run(db):
+        crud.get_user_climbs(db, user.id, schemas.ClimbFilter(**filters), None)
+    return run
+
+
+def assert_indexed(plan, table: str, indexes: set) -> None:
+    assert table not in plan.seq_scans, plan
+    assert plan.indexes & indexes, plan
+
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"flash_only": True},
+    {"sort": schemas.ClimbSort.HARDEST},
+], ids=["newest", "flash-only", "hardest"])
+def test_user_climbs_use_a_user_index(climber, explain, filters):
+    assert_indexed(explain(climbs(climber, **filters)), "climbs", USER_CLIMB_INDEXES)
+
+
+def test_gym_filter_uses_a_user_or_gym_index(climber, explain):
+    plan = explain(climbs(climber, gym_id=climber.gyms[0].id))
+    assert_indexed(plan, "climbs", USER_CLIMB_INDEXES | {"ix_climbs_gym_id"})
+
+
+def test_user_gyms_use_a_user_index(climber, explain):
+    plan = explain(lambda db: crud.get_user_gyms(db, climber.id))
+    assert_indexed(plan, "gyms", {"ix_gyms_user_id", "ix_gyms_user_id_updated_at"})
+
+
+def test_user_projects_use_a_user_index(climber, explain):
+    plan = explain(lambda db: crud.get_user_projects(db, climber.id))
+    assert_indexed(plan, "projects", {"ix_projects_user_id_created_at", "ix_projects_user_id_updated_at"})
+
+
+def test_login_lookup_uses_unique_email(climber, explain):
+    # Emails are compared exactly, so the unique index is enough
+    assert_indexed(explain(lambda db: crud.get_user_by_email(db, climber.email)), "users", {"users_email_key"})
@@ -0,0 +1,102 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import text  # noqa: E402
+
+from app import jobs  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+
+
+def status(db, job_id: int) -> str:
+    db.expire_all()
+    return db.execute(text("SELECT status FROM jobs WHERE id = :id"), {"id": job_id}).scalar()
+
+
+def start(db, job_id: int, minutes_ago: int = 0) -> None:
+    """As if a worker claimed the job ``minutes_ago``."""
+    db.execute(text(
+        "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_by = 'test', "
+        "locked_at = now() - make_interval(mins => :ago) WHERE id = :id"
+    ), {"id": job_id, "ago": minutes_ago})
+    db.commit()
+
+
+@pytest.fixture
+def running_and_queued(db):
+    """A job running for key "k", plus the newer queued one enqueued meanwhile."""
+    running = jobs.enqueue(db, "recount", dedupe_key="k")
+    db.commit()
+    start(db, running, minutes_ago=60)
+    queued = jobs.enqueue(db, "recount", dedupe_key="k")
+    db.commit()
+    assert queued is not None
+    return running, queued
+
+
+def test_enqueue_dedupes_while_queued(db):
+    first = jobs.enqueue(db, "recount", dedupe_key="k")
+    assert jobs.enqueue(db, "recount", dedupe_key="k") is None
+    db.commit()
+    assert status(db, first) == "queued"
+
+
+def test_stale_job_with_a_queued_duplicate_is_superseded(db, running_and_queued):
+    running, queued = running_and_queued
+    # An unrelated stale job on the same shard must still be recovered
+    other = jobs.enqueue(db, "recount", dedupe_key="other")
+    db.commit()
+    start(db, other, minutes_ago=60)
+
+    assert jobs.requeue_stale() == 2
+
+    assert status(db, running) == "superseded"
+    assert status(db, queued) == "queued"
+    assert status(db, other) == "queued"
+
+
+def test_two_stale_jobs_with_one_key_leave_one_queued(db):
+    first = jobs.enqueue(db, "recount", dedupe_key="k")
+    db.commit()
+    start(db, first, minutes_ago=60)
+    second = jobs.enqueue(db, "recount", dedupe_key="k")
+    db.commit()
+    start(db, second, minutes_ago=60)
+
+    jobs.requeue_stale()
+
+    assert sorted([status(db, first), status(db, second)]) == ["queued", "superseded"]
+
+
+def test_retry_with_a_queued_duplicate_is_superseded(db, running_and_queued):
+    running, queued = running_and_queued
+
+    jobs._fail(SessionLocal, running, attempts=1, max_attempts=5, error="boom")
+
+    assert status(db, running) == "superseded"
+    assert status(db, queued) == "queued"
+    assert db.execute(text("SELECT last_error FROM jobs WHERE id = :id"), {"id": running}).scalar() == "boom"
+
+
+def test_retry_without_a_duplicate_is_queued_with_backoff(db):
+    job_id = jobs.enqueue(db, "recount", dedupe_key="k")
+    db.commit()
+    start(db, job_id)
+
+    jobs._fail(SessionLocal, job_id, attempts=3, max_attempts=5, error="boom")
+
+    assert status(db, job_id) == "queued"
+    delay = db.execute(text(
+        "SELECT extract(epoch FROM run_after - now()) FROM jobs WHERE id = :id"
+    ), {"id": job_id}).scalar()
+    assert 6 < delay <= 8
+
+
+def test_last_attempt_fails(db):
+    job_id = jobs.enqueue(db, "recount")
+    db.commit()
+    start(db, job_id)
+
+    jobs._fail(SessionLocal, job_id, attempts=5, max_attempts=5, error="boom")
+
+    assert status(db, job_id) == "failed"
@@ -0,0 +1,213 @@
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import text  # noqa: E402
+
+from app import models  # noqa: E402
+from migrations import online  # noqa: E402
+
+
+@pytest.fixture
+def autocommit(pg_engine):
+    with pg_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        yield conn
+        conn.execute(text("DROP TABLE IF EXISTS online_migration_checkpoints"))
+
+
+class Interrupted(Exception):
+    pass
+
+
+def pause_hook(monkeypatch, hook):
+    """Runs ``hook(call_number)`` at each pause between backfill batches."""
+    calls = []
+
+    def sleep(seconds):
+        calls.append(seconds)
+        hook(len(calls))
+
+    monkeypatch.setattr(online, "time", SimpleNamespace(sleep=sleep, monotonic=time.monotonic))
+
+
+def add_climbs(db, user, ages: list[timedelta]) -> None:
+    now = datetime.now(timezone.utc)
+    db.add_all([
+        models.Climb(
+            user_id=user.id, internal_grade=3, original_grade="V3", original_scale="VScale",
+            attempts=0, created_at=now - age,
+        )
+        for age in ages
+    ])
+    db.commit()
+
+
+def attempts_counts(conn) -> list[int]:
+    return conn.execute(text("SELECT attempts FROM climbs ORDER BY id")).scalars().all()
+
+
+def delete_actions(conn, table: str) -> dict[str, str]:
+    """confdeltype of every foreign key on ``table`` and its partitions, by constraint name."""
+    return dict(conn.execute(text("""
+        SELECT c.conname, c.confdeltype FROM pg_constraint c
+         WHERE c.contype = 'f' AND c.confrelid = 'users'::regclass
+           AND (c.conrelid = to_regclass(:table)
+                OR c.conrelid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(:table)))
+    """), {"table": table}).all())
+
+
+# -------------------------------------------------
+# Foreign keys
+# -------------------------------------------------
+
+def test_replace_foreign_key_on_a_partitioned_table(autocommit, db, make_user):
+    user = make_user()
+    db.add(models.Climb(user_id=user.id, internal_grade=3, original_grade="V3", original_scale="V-Scale", attempts=1))
+    db.commit()
+    partitions = online._partitions(autocommit, "climbs")
+
+    online.replace_foreign_key(autocommit, "climbs", "climbs_user_id_fkey", "user_id", "users", "id")
+    actions = delete_actions(autocommit, "climbs")
+    assert actions["climbs_user_id_fkey"] == "a"
+    assert set(actions.values()) == {"a"}
+
+    online.replace_foreign_key(autocommit, "climbs", "climbs_user_id_fkey", "user_id", "users", "id", on_delete="CASCADE")
+    # Rerunning finds it done
+    online.replace_foreign_key(autocommit, "climbs", "climbs_user_id_fkey", "user_id", "users", "id", on_delete="CASCADE")
+    actions = delete_actions(autocommit, "climbs")
+    assert actions.pop("climbs_user_id_fkey") == "c"
+    # One adopted key per partition, renamed after the parent's
+    assert actions == {f"{partition}_climbs_user_id_fkey"[:63]: "c" for partition in partitions}
+
+    db.execute(text("DELETE FROM users WHERE id = :id"), {"id": user.id})
+    db.commit()
+    assert db.execute(text("SELECT count(*) FROM climbs")).scalar() == 0
+
+
+def test_deleting_a_user_cascades_to_their_rows(db, make_user):
+    user = make_user()
+    gym = models.Gym(name="Beta Bloc", user_id=user.id)
+    db.add_all([
+        gym,
+        models.Project(user_id=user.id),
+        models.ClimbImport(user_id=user.id),
+        models.Climb(user_id=user.id, internal_grade=3, original_grade="V3", original_scale="V-Scale", attempts=1),
+    ])
+    db.commit()
+
+    db.delete(user)
+    db.commit()
+
+    for table in ("climbs", "gyms", "projects", "climb_imports"):
+        assert db.execute(text(f"SELECT count(*) FROM {table}")).scalar() == 0, table
+
+
+# -------------------------------------------------
+# Backfills
+# -------------------------------------------------
+
+def test_backfill_resumes_from_its_checkpoint_on_a_partitioned_table(autocommit, db, make_user, monkeypatch):
+    # This month's partition and climbs_default (a year back)
+    add_climbs(db, make_user(), [timedelta(minutes=n) for n in range(6)] + [timedelta(days=400 + n) for n in range(6)])
+
+    def interrupt(call):
+        raise Interrupted()
+
+    pause_hook(monkeypatch, interrupt)
+    # Not idempotent on purpose: a row updated twice would show attempts = 2
+    backfill = lambda: online.backfill(  # noqa: E731
+        autocommit, "climbs_attempts", "climbs", set_sql="attempts = attempts + 1", batch_size=4,
+    )
+    with pytest.raises(Interrupted):
+        backfill()
+    assert attempts_counts(autocommit).count(1) == 4
+    last_key, rows, finished = online._checkpoint(autocommit, "climbs_attempts")
+    assert (rows, finished) == (4, False)
+
+    pause_hook(monkeypatch, lambda call: None)
+    assert backfill() == 8
+    assert attempts_counts(autocommit) == [1] * 12
+    assert online._checkpoint(autocommit, "climbs_attempts")[2] is True
+
+
+def test_backfill_covers_rows_inserted_while_it_runs(autocommit, db, make_user, monkeypatch):
+    user = make_user()
+    add_climbs(db, user, [timedelta(minutes=n) for n in range(4)])
+
+    def insert_more(call):
+        if call == 1:
+            add_climbs(db, user, [timedelta(0)] * 3)
+
+    pause_hook(monkeypatch, insert_more)
+    online.backfill(autocommit, "climbs_attempts", "climbs", set_sql="attempts = 1", where="attempts = 0", batch_size=2)
+    assert attempts_counts(autocommit) == [1] * 7
+
+
+def test_rerun_after_finishing_only_covers_new_rows(autocommit, db, make_user, monkeypatch):
+    user = make_user()
+    pause_hook(monkeypatch, lambda call: None)
+    add_climbs(db, user, [timedelta(minutes=n) for n in range(3)])
+    backfill = lambda: online.backfill(  # noqa: E731
+        autocommit, "climbs_attempts", "climbs", set_sql="attempts = attempts + 1",
+    )
+    assert backfill() == 3
+    # Written by code that predates the backfill
+    add_climbs(db, user, [timedelta(0)] * 2)
+    assert backfill() == 2
+    assert backfill() == 0
+    assert attempts_counts(autocommit) == [1] * 5
+
+
+@pytest.mark.slow
+def test_backfill_a_million_rows(autocommit, monkeypatch):
+    pause_hook(monkeypatch, lambda call: None)
+    autocommit.execute(text("DROP TABLE IF EXISTS backfill_test"))
+    autocommit.execute(text("CREATE TABLE backfill_test (id bigserial PRIMARY KEY, value int, doubled int)"))
+    autocommit.execute(text("INSERT INTO backfill_test (value) SELECT n FROM generate_series(1, 1000000) AS n"))
+    try:
+        updated = online.backfill(
+            autocommit, "backfill_test_doubled", "backfill_test",
+            set_sql="doubled = value * 2", where="doubled IS NULL",
+        )
+        assert updated == 1_000_000
+        assert autocommit.execute(text(
+            "SELECT count(*) FROM backfill_test WHERE doubled IS DISTINCT FROM value * 2"
+        )).scalar() == 0
+        assert online._checkpoint(autocommit, "backfill_test_doubled") == (1_000_000, 1_000_000, True)
+    finally:
+        autocommit.execute(text("DROP TABLE backfill_test"))
+
+
+# -------------------------------------------------
+# Indexes
+# -------------------------------------------------
+
+def index_state(conn, name: str) -> tuple[bool, int]:
+    """(parent index valid, partition indexes attached to it)"""
+    return conn.execute(text("""
+        SELECT i.indisvalid, (SELECT count(*) FROM pg_inherits WHERE inhparent = i.indexrelid)
+          FROM pg_index i WHERE i.indexrelid = to_regclass(:name)
+    """), {"name": name}).one()
+
+
+def test_create_index_on_a_partitioned_table_resumes(autocommit, db, make_user):
+    add_climbs(db, make_user(), [timedelta(minutes=1), timedelta(days=400)])
+    partitions = online._partitions(autocommit, "climbs")
+    first = partitions[0]
+    try:
+        # As if an earlier run had built one partition's index and died
+        autocommit.execute(text(
+            f"CREATE INDEX CONCURRENTLY {first}_ix_climbs_test ON {first} (user_id, attempts)"
+        ))
+        online.create_index(autocommit, "ix_climbs_test", "climbs", "(user_id, attempts)")
+        assert index_state(autocommit, "ix_climbs_test") == (True, len(partitions))
+        # Nothing left to do
+        online.create_index(autocommit, "ix_climbs_test", "climbs", "(user_id, attempts)")
+        assert index_state(autocommit, "ix_climbs_test") == (True, len(partitions))
+    finally:
+        online.drop_index(autocommit, "ix_climbs_test", "climbs")
+    assert autocommit.execute(text("SELECT to_regclass('ix_climbs_test')")).scalar() is None
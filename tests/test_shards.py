@@ -0,0 +1,150 @@
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from app import crud, imports, jobs, models, shards  # noqa: E402
+from app.database import shard_engines, shard_for_user  # noqa: E402
+
+
+@pytest.fixture
+def no_drain(monkeypatch):
+    monkeypatch.setattr(shards, "SHARD_MAP_TTL_SECONDS", 0)
+    monkeypatch.setattr(shards, "SHARD_MOVE_DRAIN_SECONDS", 0)
+
+
+@pytest.fixture
+def user_with_rows(db, make_user):
+    """A user on shard 0 with a row in every per-user table and a queued import."""
+    user = make_user()
+    now = datetime.now(timezone.utc)
+    gym = models.Gym(name="Beta Bloc", user_id=user.id, grade_ranges=[{"label": "Blue", "lo": 0, "hi": 3}])
+    db.add_all([
+        gym,
+        models.Project(user_id=user.id),
+        models.AccountExport(user_id=user.id),
+        models.GradeForecast(
+            user_id=user.id, level=4.0, slope_per_week=0.1, spread=0.5, weeks_of_data=8, computed_at=now,
+        ),
+        # This month, and a back-dated one the target has no partition for
+        *[
+            models.Climb(
+                user_id=user.id, internal_grade=3, original_grade="V3", original_scale="VScale",
+                attempts=1, created_at=now - age,
+            )
+            for age in (timedelta(0), timedelta(days=400))
+        ],
+    ])
+    db.flush()
+    crud.sync_gym_bands(db, gym)
+    record = models.ClimbImport(user_id=user.id)
+    db.add(record)
+    db.flush()
+    imports.spool_upload(db, record.id, io.BytesIO(b"grade,scale\nV3,VScale\n"))
+    record.job_id = jobs.enqueue(db, "import_climbs", {"import_id": record.id})
+    db.commit()
+    return user
+
+
+def counts(conn, user_id: int) -> dict[str, int]:
+    """The user's rows per table, as move_user selects them."""
+    return {
+        table.name: conn.execute(text(f"SELECT count(*) FROM {table.name} WHERE {where}"), {"user_id": user_id}).scalar()
+        for table, where in shards.USER_TABLES
+    }
+
+
+def test_requests_route_to_the_directory_shard(db, make_user, second_shard):
+    user = make_user()
+    assert shard_for_user(user.id) == 0
+    assert shard_for_user(None) == 0
+
+    db.execute(text("UPDATE user_shards SET shard = 1 WHERE user_id = :id"), {"id": user.id})
+    db.commit()
+    # The mapping is cached for SHARD_MAP_TTL_SECONDS
+    assert shard_for_user(user.id) == 0
+    shards.cache.delete("shards", user.id)
+    assert shard_for_user(user.id) == 1
+    assert shards.session_for(1).bind is second_shard
+
+    shards._set_moving(user.id, True)
+    with pytest.raises(HTTPException) as raised:
+        shard_for_user(user.id)
+    assert raised.value.status_code == 503
+
+
+def test_move_user_with_a_queued_job(db, user_with_rows, second_shard, no_drain):
+    user_id = user_with_rows.id
+    with shard_engines[0].connect() as conn:
+        before = counts(conn, user_id)
+        ids = {
+            table.name: conn.execute(text(f"SELECT array_agg(id ORDER BY id) FROM {table.name}")).scalar()
+            for table, _ in shards.USER_TABLES if "id" in table.c
+        }
+
+    result = shards.move_user(user_id, 1)
+
+    assert result["jobs"] == 1
+    assert result["rows"] == sum(before.values()) == 10
+    with second_shard.connect() as conn:
+        assert counts(conn, user_id) == before
+        # Rows keep their ids
+        for name, expected in ids.items():
+            assert conn.execute(text(f"SELECT array_agg(id ORDER BY id) FROM {name}")).scalar() == expected, name
+        job = conn.execute(text("SELECT id, kind, status FROM jobs")).one()
+        assert (job.kind, job.status) == ("import_climbs", "queued")
+        assert conn.execute(text("SELECT job_id FROM climb_imports")).scalar() == job.id
+
+    with shard_engines[0].connect() as conn:
+        assert set(counts(conn, user_id).values()) == {0}
+        assert conn.execute(text("SELECT count(*) FROM jobs")).scalar() == 0
+        entry = conn.execute(text("SELECT shard, moving FROM user_shards WHERE user_id = :id"), {"id": user_id}).one()
+    assert (entry.shard, entry.moving) == (1, False)
+    assert shard_for_user(user_id) == 1
+
+
+def test_move_is_refused_while_a_job_runs(db, user_with_rows, second_shard, no_drain):
+    db.execute(text("UPDATE jobs SET status = 'running', locked_at = now()"))
+    db.commit()
+
+    with pytest.raises(RuntimeError):
+        shards.move_user(user_with_rows.id, 1)
+
+    with second_shard.connect() as conn:
+        assert set(counts(conn, user_with_rows.id).values()) == {0}
+    assert counts(db, user_with_rows.id)["climbs"] == 2
+    assert db.execute(text("SELECT shard, moving FROM user_shards")).one() == (0, False)
+
+
+@pytest.fixture
+def restore_sequences(second_shard):
+    yield
+    for shard_engine in shard_engines:
+        with shard_engine.begin() as conn:
+            for table, _ in shards.USER_TABLES:
+                if "id" not in table.c:
+                    continue
+                sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table.name}).scalar()
+                if sequence is not None:
+                    conn.execute(text(f"ALTER SEQUENCE {sequence} INCREMENT BY 1 RESTART WITH 1"))
+
+
+def test_init_sequences_gives_each_shard_its_own_ids(db, make_user, second_shard, restore_sequences):
+    make_user()
+    shards.init_sequences()
+
+    for shard, shard_engine in enumerate(shard_engines):
+        with shard_engine.begin() as conn:
+            new_ids = {
+                table.name: conn.execute(text(f"SELECT nextval(pg_get_serial_sequence('{table.name}', 'id'))")).scalar()
+                for table, _ in shards.USER_TABLES if "id" in table.c
+            }
+        assert {new_id % shards.SHARD_ID_STRIDE for new_id in new_ids.values()} == {shard}, new_ids
+        # Above the user that already exists on shard 0
+        assert new_ids["users"] > 1
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from app import tracing  # noqa: E402
+
+SAMPLED = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+def test_rate_zero_ignores_a_sampled_traceparent(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 0)
+    monkeypatch.setattr(tracing, "TRACE_TRUST_TRACEPARENT", True)
+    assert tracing.start_root_span("GET /climbs", SAMPLED) is tracing.INVALID_SPAN
+
+
+def test_traceparent_sampling_is_only_obeyed_when_trusted(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1e-12)
+    assert tracing.start_root_span("GET /climbs", SAMPLED) is tracing.INVALID_SPAN
+
+    monkeypatch.setattr(tracing, "TRACE_TRUST_TRACEPARENT", True)
+    span = tracing.start_root_span("GET /climbs", SAMPLED)
+    assert (span.trace_id, span.parent_id) == ("0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331")
+
+
+def test_sampled_requests_keep_the_incoming_trace_id(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1)
+    span = tracing.start_root_span("GET /climbs", SAMPLED.replace("-01", "-00"))
+    assert span.trace_id == "0af7651916cd43dd8448eb211c80319c"
+
+
+def test_exporter_writes_from_a_background_thread(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    exporter = tracing.Exporter("file", str(path))
+    monkeypatch.setattr(tracing, "exporter", exporter)
+    for n in range(3):
+        tracing.Span(f"span {n}", "0" * 32, None).end()
+    exporter.flush()
+
+    assert exporter._thread.is_alive()
+    assert [json.loads(line)["name"] for line in path.read_text().splitlines()] == ["span 0", "span 1", "span 2"]
+
+
+def test_exporter_drops_spans_when_the_queue_is_full(tmp_path, monkeypatch):
+    exporter = tracing.Exporter("file", str(tmp_path / "traces.jsonl"), max_queue=1)
+    monkeypatch.setattr(tracing, "exporter", exporter)
+    # Not started, so nothing drains the queue
+    exporter._thread = object()
+    for n in range(3):
+        tracing.Span(f"span {n}", "0" * 32, None).end()
+    assert exporter.dropped == 2